@@ -0,0 +1,47 @@
+import argparse
+import time
+
+import numpy as np
+
+from fibsem_maestro.tools.fft_backend import FFT_BACKENDS, create_fft_backend
+
+parser = argparse.ArgumentParser(description='FFT backend benchmark (real 2D FFT of the image sizes used by criteria)')
+parser.add_argument('--backends', default=list(FFT_BACKENDS), nargs='+', help='tested backends')
+parser.add_argument('--workers', default=-1, type=int, help='number of FFT threads (negative - all cores)')
+parser.add_argument('--repeat', default=5, type=int, help='number of runs (the best time is reported)')
+parser.add_argument('--tiles', default=64, type=int, help='number of tiles in the tile stack')
+parser.add_argument('--tile-size', default=256, type=int, help='tile size (px)')
+args = parser.parse_args()
+
+rng = np.random.default_rng(0)
+cases = {
+    f'{args.tiles}x tile {args.tile_size}': rng.random((args.tiles, args.tile_size, args.tile_size), dtype=np.float32),
+    '2048x2048': rng.random((2048, 2048), dtype=np.float32),
+    '6144x4096': rng.random((4096, 6144), dtype=np.float32),
+}
+
+backends = []
+for name in args.backends:
+    backend = create_fft_backend(name, args.workers)
+    if backend.name != name:  # fallback (pyfftw not installed)
+        print(f'{name} is not available')
+        continue
+    backends.append(backend)
+
+
+def measure(backend, data):
+    """ Best run time (s) of rfft2 (the first call is not measured - planning) """
+    backend.rfft2(data)
+    best_time = np.inf
+    for _ in range(args.repeat):
+        start = time.perf_counter()
+        backend.rfft2(data)
+        best_time = min(best_time, time.perf_counter() - start)
+    return best_time
+
+
+print(f'{"image":>16} ' + ' '.join(f'{backend.name + " [ms]":>12}' for backend in backends) + '  fastest')
+for case, data in cases.items():
+    times = [measure(backend, data) for backend in backends]
+    fastest = backends[int(np.argmin(times))]
+    print(f'{case:>16} ' + ' '.join(f'{t * 1e3:>12.2f}' for t in times) + f'  {fastest}')
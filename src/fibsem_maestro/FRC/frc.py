@@ -1,32 +1,32 @@
-import fibsem_maestro.FRC.frc_utils as frc_util
-import fibsem_maestro.FRC.secondary_utils as su
+import functools
+
 import numpy as np
 import matplotlib.pyplot as plt
+from scipy import sparse
+
+from fibsem_maestro.tools.fft_backend import get_fft_backend
+
+EM_THRESHOLD = 1 / 7
+BATCH_CHUNK_PIXELS = 2 ** 18  # tile pixels processed together by frc_batch (larger stacks are not cache friendly)
+
 
 def frc(img, pixel_size, show_image=False):
-    threshold = 'EM'
-    inside_square	= True
-    anaRing			= True
-    info_split     = True
-    img = img.astype(np.float32)
-    img = su.normalize_data_ab(0, 1, img)
-    sa1, sa2, sb1, sb2 = frc_util.diagonal_split(img)
-    sa1 = frc_util.apply_hanning_2d(su.normalize_data_ab(0, 1, sa1))
-    sa2 = frc_util.apply_hanning_2d(su.normalize_data_ab(0, 1, sa2))
-    #sb1 = frc_util.apply_hanning_2d(su.normalize_data_ab(0, 1, sb1))
-    #sb2 = frc_util.apply_hanning_2d(su.normalize_data_ab(0, 1, sb2))
-    xc, corr1, xt, thres_val = frc_util.FRC(sa1, sa2, thresholding=threshold, inscribed_rings=inside_square, analytical_arc_based=anaRing, info_split=info_split)
-    #_, corr2, _, _           = frc_util.FRC(sb1, sb2, thresholding=threshold, inscribed_rings=inside_square, analytical_arc_based=anaRing, info_split=info_split)
-    #_, corr3, _, _           = frc_util.FRC(sa1, sb1, thresholding=threshold, inscribed_rings=inside_square, analytical_arc_based=anaRing, info_split=info_split)
-    #_, corr4, _, _           = frc_util.FRC(sa2, sb1, thresholding=threshold, inscribed_rings=inside_square, analytical_arc_based=anaRing)
-    #_, corr5, _, _          = frc_util.FRC(sa2, sb2, thresholding=threshold, inscribed_rings=inside_square, analytical_arc_based=anaRing)
-    #_, corr6, _ , _         = frc_util.FRC(sb1, sb2, thresholding=threshold, inscribed_rings=inside_square, analytical_arc_based=anaRing)
-    #corr_avg                 = (corr1+corr2+corr3)/3.0
-    corr_avg 				= corr1
-        
+    """
+    FRC resolution of the image (diagonal split, EM threshold). See frc_curves.
+    Raises ValueError if the FRC curve does not cross the threshold.
+    """
+    img = np.asarray(img)
+    if img.ndim != 2:
+        raise ValueError('Only 2D images are supported by FRC')
+    with np.errstate(divide='ignore', invalid='ignore'):
+        xc, corr = frc_curves(img[np.newaxis])
+    corr_avg = corr[0]
+    xt = xc
+    thres_val = np.full(len(xc), EM_THRESHOLD)
+
     if show_image:
         plt.plot(xc[:-1]/2, corr_avg[:-1], label = 'chip-FRC', color='black')
-        plt.plot(xt[:-1]/2, (thres_val[3])[:-1], label='EM', color='Orange')
+        plt.plot(xt[:-1]/2, thres_val[:-1], label='EM', color='Orange')
         plt.xlim(0.0, 0.5)
         plt.ylim(0.0, 1)
         plt.grid(linestyle='dotted', color='black', alpha=0.3) 
@@ -37,8 +37,144 @@ def frc(img, pixel_size, show_image=False):
         # plt.title ('Fourier Ring Correlation (FRC)', {'size':20})
         plt.tick_params(axis='both', labelsize=7)
     	
-    cross_i = next(x for x, val in enumerate(corr_avg) if val < thres_val[3][0])# EM cros
-    freq = xc[cross_i] / 2
+    below = np.flatnonzero(corr_avg < EM_THRESHOLD)  # EM cross
+    if len(below) == 0:
+        raise ValueError('FRC curve does not cross the threshold')
+    freq = xc[below[0]] / 2
     resolution = (1/freq)*pixel_size*np.sqrt(2)
     #print(f'Resolution: {resolution}')
     return resolution
+
+
+@functools.lru_cache(maxsize=16)
+def hann_window_2d(size):
+    """ Separable 2D Hann window (outer product of 1D windows) - cached """
+    hann = np.hanning(size).astype(np.float32)
+    window = np.outer(hann, hann)
+    window.setflags(write=False)
+    return window
+
+
+@functools.lru_cache(maxsize=16)
+def half_plane_rings(size, inscribed_rings=True):
+    """
+    Ring averaging operator of the rfft2 half-plane of size x size spectrum (the same rings as frc_util.spinavej
+    uses on the fftshift-ed full spectrum). Cached.
+
+    Each frequency contributes to its floor and ceil ring by weight/2. The weight is 2 if the frequency stands also
+    for its conjugate-symmetric counterpart, 1 for the 0 and Nyquist columns.
+
+    :return: sparse matrix (rings, half-plane frequencies)
+    """
+    fi = np.fft.fftfreq(size, 1 / size)  # signed integer frequencies
+    fj = np.fft.rfftfreq(size, 1 / size)
+    radius = np.sqrt(fi[:, np.newaxis] ** 2 + fj[np.newaxis, :] ** 2)
+    if inscribed_rings:
+        maxindex = int(size / 2)
+    else:
+        maxindex = int(np.max(np.round(radius)))
+    weights = np.full(radius.shape, 2.)
+    weights[:, 0] = 1
+    if size % 2 == 0:
+        weights[:, -1] = 1
+    index_floor = np.floor(radius).astype(np.int64).ravel()
+    index_ceil = np.ceil(radius).astype(np.int64).ravel()
+    frequency = np.arange(radius.size)
+
+    rings = np.concatenate([index_floor, index_ceil])
+    columns = np.concatenate([frequency, frequency])
+    values = np.concatenate([weights.ravel(), weights.ravel()]) / 2
+    used = rings < maxindex
+    return sparse.csr_matrix((values[used], (rings[used], columns[used])), shape=(maxindex, radius.size))
+
+
+def _normalize_stack(tiles):
+    """ normalize_data_ab(0, 1, tile) of each tile in the stack (N, h, w) """
+    min_x = tiles.min(axis=(1, 2), keepdims=True)
+    max_x = tiles.max(axis=(1, 2), keepdims=True)
+    return (tiles - min_x) / (max_x - min_x)
+
+
+def _ring_average_half_plane(values, inscribed_rings=True):
+    """
+    frc_util.spinavej of the full spectra calculated from the rfft2 half-planes (M, h, w//2+1) of real values.
+    All items are reduced by one product with the cached ring operator. Returns array (M, rings)
+    """
+    operator = half_plane_rings(values.shape[1], inscribed_rings)
+    return (operator @ values.reshape(values.shape[0], -1).T).T
+
+
+def frc_curves(tiles):
+    """
+    FRC curves of each tile in the stack (N, h, w).
+    The tile is diagonally split (strided views), the halves are normalized and windowed
+    (frc_util.apply_hanning_2d) and the cross and power spectra are ring-averaged from rfft2 half-planes.
+
+    :return: frequency axis (x_fsc), FRC curves (N, rings)
+    """
+    tiles = np.asarray(tiles, dtype=np.float32)
+    h, w = tiles.shape[-2:]
+    if (h % 4 != 0) or (w % 4 != 0):
+        raise ValueError('Input image must have dimensions divisible by 4')
+    if h != w:
+        raise ValueError('Input images must be squares')
+
+    # diagonal split (the normalization of the whole tile is omitted - the halves are normalized)
+    half_size = h // 2
+    window = hann_window_2d(half_size)
+    fft = get_fft_backend()
+    spectra = []
+    for half in (tiles[:, ::2, ::2], tiles[:, 1::2, 1::2]):
+        half = _normalize_stack(half)
+        # apply_hanning_2d: (img * h) * (img * h).T
+        half *= np.swapaxes(half, 1, 2) * window
+        spectra.append(fft.rfft2(half, axes=(1, 2)))
+    I1, I2 = spectra
+
+    # cross (real(I1*conj(I2))) and power spectra reduced together
+    ring_values = np.empty((3,) + I1.shape, dtype=np.float32)
+    np.multiply(I1.real, I2.real, out=ring_values[0])
+    ring_values[0] += I1.imag * I2.imag
+    np.multiply(I1.real, I1.real, out=ring_values[1])
+    ring_values[1] += I1.imag * I1.imag
+    np.multiply(I2.real, I2.real, out=ring_values[2])
+    ring_values[2] += I2.imag * I2.imag
+    n_items = tiles.shape[0]
+    rings = _ring_average_half_plane(ring_values.reshape((-1,) + I1.shape[1:])).astype(np.float32)
+    C, C1, C2 = rings[:n_items], rings[n_items:2 * n_items], rings[2 * n_items:]
+    corr = abs(C) / np.sqrt(C1 * C2)
+
+    x_fsc = np.arange(corr.shape[1]) / (half_size / 2)
+    return x_fsc, corr
+
+
+def frc_batch(tiles, pixel_size, return_curves=False):
+    """
+    FRC resolution of each tile in the stack (..., h, w). It is the same calculation as frc() (diagonal split,
+    EM threshold) vectorized over all tiles - stacked FFT and shared ring reduction (in chunks of
+    BATCH_CHUNK_PIXELS).
+
+    :return: array (...) of resolutions. The resolution is NaN if the FRC curve does not cross the threshold.
+    If return_curves, tuple (resolutions, frequency axis, FRC curves (..., rings)) is returned.
+    """
+    tiles = np.asarray(tiles, dtype=np.float32)
+    leading_shape = tiles.shape[:-2]
+    if int(np.prod(leading_shape)) == 0:  # empty stack
+        resolution = np.empty(leading_shape)
+        return (resolution, np.empty(0), np.empty(leading_shape + (0,))) if return_curves else resolution
+    tiles = tiles.reshape((-1,) + tiles.shape[-2:])
+    chunk = max(1, BATCH_CHUNK_PIXELS // (tiles.shape[1] * tiles.shape[2]))
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        curves = [frc_curves(tiles[i:i + chunk]) for i in range(0, len(tiles), chunk)]
+        x_fsc = curves[0][0]
+        corr = np.concatenate([c for _, c in curves])
+        below = corr < EM_THRESHOLD
+        cross_i = np.argmax(below, axis=1)  # first crossing
+        freq = x_fsc[cross_i] / 2
+        resolution = (1 / freq) * pixel_size * np.sqrt(2)
+    resolution[~below.any(axis=1)] = np.nan  # no crossing
+    resolution = resolution.reshape(leading_shape)
+    if return_curves:
+        return resolution, x_fsc, corr.reshape(leading_shape + corr.shape[1:])
+    return resolution
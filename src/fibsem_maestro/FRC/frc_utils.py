@@ -8,12 +8,16 @@
 #
 
 
+import functools
+
 import numpy as np
 import numpy.fft as fft
 import matplotlib.pyplot as plt 
 import itertools
 import sys
 
+from fibsem_maestro.tools.fft_backend import get_fft_backend
+
 def diagonal_split(img):
     '''
     This function takes an input image and splits it diagonally into four sub-regions.
@@ -146,69 +150,50 @@ def ring_indices(x, inscribed_rings=True, plot=False):
             \n the inscribed circle in the image (spacing of 20 [px] between rings)')
     return(indices)
 
+@functools.lru_cache(maxsize=32)
+def ring_labels(shape, inscribed_rings=True):
+    ''' Ring labels of the 2D array of shape (cached per shape and inscribed_rings)
+    Returns floor and ceil ring index of each pixel (flattened), number of bins of bincount
+    and number of output rings (maxindex)
+    '''
+    if len(shape) != 2:
+        raise ValueError('Only 2D arrays are supported for ring averaging')
+    nr, nc = shape
+    nrdc = np.floor(nr/2)
+    ncdc = np.floor(nc/2)
+    r = np.arange(nr)-nrdc
+    c = np.arange(nc)-ncdc
+    [R,C] = np.meshgrid(r,c)
+    radius = np.sqrt(R**2+C**2)
+    if (inscribed_rings == True):
+        maxindex = int(nr/2)
+    else:
+        maxindex = int(np.max(np.round(radius)))
+    index_floor = np.floor(radius).astype(np.int64).ravel()
+    index_ceil = np.ceil(radius).astype(np.int64).ravel()
+    n_bins = int(index_ceil.max()) + 1
+    index_floor.setflags(write=False)
+    index_ceil.setflags(write=False)
+    return index_floor, index_ceil, n_bins, maxindex
+
 def spinavej(x, inscribed_rings=True):
     ''' modification of code by sajid an
     Based on the MATLAB code by Michael Wojcik
-    '''
-    shape = np.shape(x)     
-    dim = np.size(shape)
-    ''' Depending on the dimension of the image 2D/3D, create an array of integers 
-    which increase with distance from the center of the array
-    '''
-    if dim == 2 :
-        nr,nc = shape
-        nrdc = np.floor(nr/2)
-        ncdc = np.floor(nc/2)
-        r = np.arange(nr)-nrdc 
-        c = np.arange(nc)-ncdc  
-        [R,C] = np.meshgrid(r,c)
-        index = np.round(np.sqrt(R**2+C**2))
-        indexf = np.floor(np.sqrt(R**2+C**2))
-        indexC = np.ceil(np.sqrt(R**2+C**2))
-    
-    elif dim == 3 :
-        nr,nc,nz = shape
-        nrdc = np.floor(nr/2)+1
-        ncdc = np.floor(nc/2)+1
-        nzdc = np.floor(nz/2)+1
-        r = np.arange(nr)-nrdc + 1
-        c = np.arange(nc)-ncdc + 1 
-        z = np.arange(nc)-nzdc + 1 
-        [R,C,Z] = np.meshgrid(r,c,z)
-        index = np.round(np.sqrt(R**2+C**2+Z**2))+1    
-    else :
-        print('input is neither a 2d or 3d array')
-    '''
-    The index array has integers from 1 to maxindex arranged according to distance
-    from the center
-    '''
 
-    if (inscribed_rings == True):
-        maxindex = nr/2
-    else:
-        maxindex = np.max(index)
-    output = np.zeros(int(maxindex),dtype = complex)
-    
-    ''' In the next step output is generated. The output is an array of length
-    maxindex. The elements in this array corresponds to the sum of all the elements
-    in the original array correponding to the integer position of the output array 
-    divided by the number of elements in the index array with the same value as the
-    integer position. 
-    
-    Depending on the size of the input array, use either the pixel or index method.
-    By-pixel method for large arrays and by-index method for smaller ones.
+    The output element i is the average of sums of all elements with floor and ceil
+    of the distance from the center equal to i (ring labels are cached, sums by bincount)
     '''
-    #print('performed by index method')
-    indices = []
-    indicesf, indicesC = [], []
-    for i in np.arange(int(maxindex)):
-        #indices.append(np.where(index == i+1))
-        indicesf.append(np.where(indexf == i))
-        indicesC.append(np.where(indexC == i))
+    index_floor, index_ceil, n_bins, maxindex = ring_labels(np.shape(x), inscribed_rings)
 
-    for i in np.arange(int(maxindex)):
-        #output[i] = sum(x[indices[i]])/len(indices[i][0])
-        output[i] = (sum(x[indicesf[i]])+sum(x[indicesC[i]]))/2
+    def ring_sum(values):
+        values = values.ravel()
+        return (np.bincount(index_floor, weights=values, minlength=n_bins)
+                + np.bincount(index_ceil, weights=values, minlength=n_bins))[:maxindex] / 2
+
+    output = np.zeros(maxindex, dtype=complex)
+    output.real = ring_sum(np.real(x))
+    if np.iscomplexobj(x):
+        output.imag = ring_sum(np.imag(x))
     return output
 
 def FRC( i1, i2, thresholding='half-bit', inscribed_rings=True, analytical_arc_based=True, info_split=True):
@@ -228,8 +213,9 @@ def FRC( i1, i2, thresholding='half-bit', inscribed_rings=True, analytical_arc_b
     ''' Performing the fourier transform of input
     images to determine the FRC
     '''
-    I1 = fft.fftshift(fft.fft2(i1))
-    I2 = fft.fftshift(fft.fft2(i2))
+    fft_backend = get_fft_backend()
+    I1 = fft.fftshift(fft_backend.fft2(i1))
+    I2 = fft.fftshift(fft_backend.fft2(i2))
     C  = spinavej(I1*np.conjugate(I2), inscribed_rings=inscribed_rings)
     C = np.real(C)
     C1 = spinavej(np.abs(I1)**2, inscribed_rings=inscribed_rings)
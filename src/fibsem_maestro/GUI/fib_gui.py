@@ -49,12 +49,6 @@ class FibGui:
         fiducial_area = self.settings('milling', 'fiducial_area')
         milling_area = self.settings('milling', 'milling_area')
 
-        if hasattr(self.microscope, 'is_virtual'):
-            raise NotImplementedError('Load image in virtual mode')
-            from autoscript_sdb_microscope_client.structures import AdornedImage
-            #image = Image.from_as(AdornedImage.load('/home/cemcof/Downloads/cell.tif'))
-            #image = Image.from_as(AdornedImage.load('D:\ceitec_data\ins - fccb\data\raw\slice_00547_(0).tif'))
-
         if self.serial_control.running:
             QMessageBox.critical(None, 'FIB image', 'Cannot take image in running job.')
         else:
@@ -169,6 +169,8 @@ if __name__ == "__main__":
                         help="Default project folder path")
     parser.add_argument('--virtual', action="store_true",
                         help="Virtual mode (without connection to microscope)")
+    parser.add_argument('--resume', action="store_true",
+                        help="Resume acquisition from the checkpoint in the project folder")
     args = parser.parse_args()
 
 
@@ -184,15 +186,14 @@ if __name__ == "__main__":
         if not os.path.exists(settings_yaml_path):
             shutil.copy(default_settings_yaml_path, settings_yaml_path)
 
-        # enables virtual mode
-        if args.virtual:
-            pass
-            # TODO: control virtual mode
-
         # settings must be loaded before Logger
         settings = Settings()
         settings.load(settings_yaml_path)
 
+        # enables virtual mode
+        if args.virtual:
+            settings.set('general', 'library', value='virtual')
+
         serial_control = SerialControl()
         serial_control.change_dir_settings(folder_path)  # change dirs settings to correct project folder
         settings.save()
@@ -202,4 +203,7 @@ if __name__ == "__main__":
 
         win = Window()
         win.show()
+
+        if args.resume:
+            serial_control.resume(folder_path)  # continue with the slice after the checkpoint
         sys.exit(app.exec())
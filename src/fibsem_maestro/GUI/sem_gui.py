@@ -69,15 +69,12 @@ class SemGui:
         # if acquisition running -> get last image
         dirs_output_images = self.settings('dirs', 'output_images')
 
-        if hasattr(self.microscope, 'is_virtual'):
-            from autoscript_sdb_microscope_client.structures import AdornedImage
-            # image = Image.from_as(AdornedImage.load('/home/cemcof/Downloads/cell.tif'))
-            image = Image.from_as(AdornedImage.load('img.tif'))
-        elif self.serial_control.running:
+        if self.serial_control.running:
             _, img_filename = findfile(dirs_output_images)
             # load image if AS is used
             if isinstance(self.microscope, AutoscriptMicroscopeControl):
-                from autoscript_sdb_microscope_client.structures import AdornedImage
+                # real or virtual AdornedImage
+                from fibsem_maestro.microscope_control.autoscript_control import AdornedImage
                 image = Image.from_as(AdornedImage.load(img_filename))
             else:
                 raise NotImplementedError('Image loading of non-autoscript type is not implemented')
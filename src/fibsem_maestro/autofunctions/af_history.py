@@ -0,0 +1,221 @@
+import logging
+import threading
+from collections import deque
+
+import numpy as np
+
+from fibsem_maestro.settings import Settings
+from fibsem_maestro.tools.support import Point
+
+PREDICTION_MODELS = ('kalman', 'linear')
+MIN_RECORDS = 3  # min. number of AF results of the variable used for prediction
+QUALITY_WINDOW = 5  # number of the last prediction errors used for the prediction quality
+
+
+def _to_array(value):
+    """ AF value (float or Point) as 1D array """
+    if isinstance(value, Point):
+        return np.array(value.to_array(), dtype=float)
+    return np.atleast_1d(np.asarray(value, dtype=float))
+
+
+def _from_array(array, point):
+    """ 1D array as AF value (float or Point) """
+    return Point(float(array[0]), float(array[1])) if point else float(array[0])
+
+
+class KalmanPredictor:
+    """
+    Constant-velocity Kalman filter of the AF results (each component separately). The state is the optimal value
+    and its change per slice. process_noise - random change of the rate per slice, measurement_noise - AF precision
+    (both in variable units).
+    """
+    def __init__(self, process_noise, measurement_noise):
+        self.process_noise = process_noise
+        self.measurement_noise = measurement_noise
+        self.updates = 0
+        self._x = None  # state (components, 2): value, rate
+        self._p = None  # state covariance (components, 2, 2)
+        self._slice = None  # slice number of the last update
+
+    def _propagate(self, slice_number):
+        dt = max(slice_number - self._slice, 0)
+        f = np.array([[1., dt], [0., 1.]])
+        q = self.process_noise ** 2 * np.array([[dt ** 3 / 3, dt ** 2 / 2], [dt ** 2 / 2, dt]])
+        return self._x @ f.T, f @ self._p @ f.T + q
+
+    def predict(self, slice_number):
+        """ Predicted value in the slice (None if no result is known) """
+        if self._x is None:
+            return None
+        return self._propagate(slice_number)[0][:, 0]
+
+    def update(self, slice_number, value):
+        r = self.measurement_noise ** 2
+        if self._x is None:
+            # unknown rate - its initial uncertainty is the AF precision per slice
+            self._x = np.stack([value, np.zeros_like(value)], axis=-1)
+            self._p = np.tile(np.diag([r, r]), (len(value), 1, 1))
+        else:
+            self._x, self._p = self._propagate(slice_number)
+            gain = self._p[:, :, 0] / (self._p[:, 0, 0] + r)[:, None]
+            self._x = self._x + gain * (value - self._x[:, 0])[:, None]
+            self._p = self._p - gain[:, :, None] * self._p[:, None, 0, :]
+        self._slice = slice_number
+        self.updates += 1
+
+    @property
+    def rate(self):
+        """ Change of the optimal value per slice """
+        return self._x[:, 1]
+
+
+class LinearPredictor:
+    """ Least-squares line fitted to the last AF results (history_size) over slice number """
+    def __init__(self, history_size):
+        self.updates = 0
+        self._slices = deque(maxlen=history_size)
+        self._values = deque(maxlen=history_size)
+
+    def _fit(self):
+        """ Slope and intercept (per component). Constant if the slope cannot be fitted """
+        slices = np.array(self._slices, dtype=float)
+        values = np.array(self._values)
+        if len(slices) < 2 or np.ptp(slices) == 0:
+            return np.zeros(values.shape[1]), values[-1]
+        return np.polyfit(slices, values, 1)
+
+    def predict(self, slice_number):
+        """ Predicted value in the slice (None if no result is known) """
+        if len(self._values) == 0:
+            return None
+        slope, intercept = self._fit()
+        return slope * slice_number + intercept
+
+    def update(self, slice_number, value):
+        self._slices.append(slice_number)
+        self._values.append(value)
+        self.updates += 1
+
+    @property
+    def rate(self):
+        """ Change of the optimal value per slice """
+        return self._fit()[0]
+
+
+class AfHistory:
+    """
+    Singleton. History of autofunction results (slice, variable, initial and final value, criterion) and prediction
+    of the optimal value of each AF variable from the previous results (focus tracking). The predicted change is
+    pre-applied on each slice (af_prediction section). Noise settings are relative to the AF sweeping range.
+    """
+    _instance = None
+
+    # Singleton construction
+    def __new__(cls, *args, **kwargs):
+        if cls._instance is None:
+            cls._instance = super(AfHistory, cls).__new__(cls)
+            cls._instance.settings = Settings()
+            cls._instance._lock = threading.Lock()
+            cls._instance.clear()
+        return cls._instance
+
+    def clear(self):
+        self._records = []
+        self._variables = {}  # variable: {predictor, scale, point, errors}
+
+    def _create_predictor(self, scale):
+        model = self.settings('af_prediction', 'model') or 'kalman'
+        if model == 'kalman':
+            return KalmanPredictor(self.settings('af_prediction', 'process_noise') * scale,
+                                   self.settings('af_prediction', 'measurement_noise') * scale)
+        if model == 'linear':
+            return LinearPredictor(self.settings('af_prediction', 'history_size'))
+        raise ValueError(f'Unknown prediction model {model}. Possible values: {", ".join(PREDICTION_MODELS)}')
+
+    def record(self, af, slice_number):
+        """ Add the result of the finished autofunction """
+        if slice_number is None or af.final_af_value is None:
+            return
+        sweeping_range = af.settings('autofunction', af.auto_function_name, 'sweeping_range')
+        record = {'slice': slice_number,
+                  'autofunction': af.auto_function_name,
+                  'variable': af.settings('autofunction', af.auto_function_name, 'variable'),
+                  'initial': af.initial_af_value,
+                  'final': af.final_af_value,
+                  'criterion': af.best_criterion_value,
+                  # half of the sweeping range - scale of the noise settings
+                  'scale': (sweeping_range[1] - sweeping_range[0]) / 2 if sweeping_range is not None else None}
+        with self._lock:
+            self._add(record)
+
+    def _add(self, record):
+        history_size = self.settings('af_prediction', 'history_size') or 0
+        self._records.append(record)
+        if history_size > 0:
+            del self._records[:-history_size]
+
+        if record['scale'] is None or record['scale'] <= 0:
+            return  # the variable is not swept - no prediction
+        variable = self._variables.get(record['variable'])
+        if variable is None:
+            variable = {'predictor': self._create_predictor(record['scale']),
+                        'scale': record['scale'],
+                        'point': isinstance(record['final'], Point),
+                        'errors': deque(maxlen=QUALITY_WINDOW)}
+            self._variables[record['variable']] = variable
+        elif isinstance(record['final'], Point) != variable['point']:
+            logging.warning(f'AF result of {record["variable"]} has unexpected type. Not used for prediction.')
+            return
+        final = _to_array(record['final'])
+        predicted = variable['predictor'].predict(record['slice'])
+        if predicted is not None and variable['predictor'].updates >= MIN_RECORDS:
+            # prediction error relative to the sweeping range
+            variable['errors'].append(np.linalg.norm(final - predicted) / variable['scale'])
+        variable['predictor'].update(record['slice'], final)
+
+    def records(self, variable=None):
+        """ List of AF results (of the variable) """
+        with self._lock:
+            return [x for x in self._records if variable is None or x['variable'] == variable]
+
+    def prediction_error(self, variable):
+        """ RMS of the last prediction errors relative to the sweeping range (None if not known yet) """
+        with self._lock:
+            state = self._variables.get(variable)
+            if state is None or len(state['errors']) < QUALITY_WINDOW:
+                return None
+            return float(np.sqrt(np.mean(np.square(state['errors']))))
+
+    def prediction_good(self, variable):
+        """ True if the last predictions of the variable were more precise than af_prediction.good_error """
+        error = self.prediction_error(variable)
+        return error is not None and error < self.settings('af_prediction', 'good_error')
+
+    def predicted_increments(self):
+        """
+        Predicted change of the optimal value per slice of each variable (float or Point). The deterministic
+        part (acquisition.wd_correction of working distance) is subtracted. Limited by af_prediction.max_increment.
+        """
+        deterministic = {'electron_beam.working_distance': self.settings('acquisition', 'wd_correction') or 0}
+        max_increment = self.settings('af_prediction', 'max_increment')
+        increments = {}
+        with self._lock:
+            for name, state in self._variables.items():
+                if state['predictor'].updates < MIN_RECORDS:
+                    continue
+                increment = state['predictor'].rate - deterministic.get(name, 0)
+                limit = max_increment * state['scale']
+                increments[name] = _from_array(np.clip(increment, -limit, limit), state['point'])
+        return increments
+
+    def get_state(self):
+        """ State for checkpoint (predictors are rebuilt from records) """
+        return self.records()
+
+    def set_state(self, state):
+        with self._lock:
+            self.clear()
+            for record in state:
+                self._add(record)
+        logging.info(f'AF history restored ({len(state)} records)')
@@ -0,0 +1,127 @@
+import logging
+from collections import deque
+
+import numpy as np
+
+from fibsem_maestro.settings import Settings
+
+DEGRADATION_METHODS = ('cusum', 'ewma')
+
+
+class AfScheduler:
+    """
+    Resolution-trend-driven autofunction firing. The image resolution of the first af_scheduler.window slices
+    (after start or re-baseline) defines the baseline. The degradation (resolution increase) is detected by one-sided
+    CUSUM or EWMA chart. On degradation, the cheapest autofunction of the escalation list is fired. If the
+    degradation is detected again in escalation_slices, the next (more expensive) autofunction is fired. The
+    baseline is measured again after the last autofunction of the list.
+    If the resolution is stable, autofunctions fired periodically (execute_slices) can be suppressed. The firing by
+    the resolution threshold (execute_resolution) is never suppressed.
+    """
+    def __init__(self):
+        self.settings = Settings()
+        self.reset()
+
+    def reset(self):
+        """ Reset the baseline and escalation """
+        self._window = deque()  # resolution values of the baseline
+        self._baseline = None  # mean, sigma
+        self.statistic = 0.  # CUSUM sum or EWMA in sigma units above the baseline
+        self._ewma = 0.  # EWMA of the normalized resolution (starts on baseline)
+        self._level = 0  # index of the escalation autofunction fired on the next degradation
+        self._last_fire = None  # slice number of the last fired escalation autofunction
+        self._last_slice = None  # the last processed slice
+
+    @property
+    def stable(self):
+        """ True if the baseline is known and no degradation is indicated """
+        return self._baseline is not None and self.statistic < self._threshold() / 2
+
+    def _threshold(self):
+        return self.settings('af_scheduler', 'threshold')
+
+    def _set_baseline(self):
+        min_sigma = self.settings('af_scheduler', 'min_sigma')
+        mean = float(np.mean(self._window))
+        # sigma limit - the same resolution on all slices would give infinite statistic
+        sigma = max(float(np.std(self._window, ddof=1)), min_sigma * mean)
+        self._baseline = (mean, sigma)
+        logging.info(f'AF scheduler baseline: resolution {mean} (sigma {sigma})')
+
+    def _update_statistic(self, resolution):
+        """ Update the degradation statistic by the resolution (normalized to baseline) """
+        method = self.settings('af_scheduler', 'method')
+        mean, sigma = self._baseline
+        z = (resolution - mean) / sigma
+        if method == 'cusum':
+            self.statistic = max(0., self.statistic + z - self.settings('af_scheduler', 'cusum_k'))
+        elif method == 'ewma':
+            ewma_lambda = self.settings('af_scheduler', 'ewma_lambda')
+            self._ewma = ewma_lambda * z + (1 - ewma_lambda) * self._ewma
+            # EWMA in units of its asymptotic sigma
+            self.statistic = max(0., self._ewma / np.sqrt(ewma_lambda / (2 - ewma_lambda)))
+        else:
+            raise ValueError(f'Unknown degradation method {method}. Possible values: {", ".join(DEGRADATION_METHODS)}')
+
+    def __call__(self, slice_number, image_resolution):
+        """
+        Process the resolution of the slice.
+        :return: name of the autofunction to fire (None if no degradation)
+        """
+        if image_resolution is None or slice_number == self._last_slice:
+            return None
+        self._last_slice = slice_number
+
+        if self._baseline is None:
+            self._window.append(image_resolution)
+            if len(self._window) >= self.settings('af_scheduler', 'window'):
+                self._set_baseline()
+            return None
+
+        self._update_statistic(image_resolution)
+        logging.info(f'AF scheduler statistic: {self.statistic}')
+        if self.statistic <= self._threshold():
+            return None
+
+        # degradation - escalate if the previous autofunction did not help
+        escalation = self.settings('af_scheduler', 'escalation')
+        escalation_slices = self.settings('af_scheduler', 'escalation_slices')
+        if self._last_fire is None or slice_number - self._last_fire > escalation_slices:
+            self._level = 0
+        level = min(self._level, len(escalation) - 1)
+        logging.warning(f'Resolution degradation detected (statistic {self.statistic}). '
+                        f'Escalation level {level}: {escalation[level]}')
+        self._level = level + 1
+        self._last_fire = slice_number
+        self.statistic = 0.
+        self._ewma = 0.
+        if level == len(escalation) - 1:
+            # the most expensive autofunction fired - new baseline
+            self._window.clear()
+            self._baseline = None
+        return escalation[level]
+
+    def suppress(self, af, slice_number):
+        """ True if periodic firing of the af is not needed (the resolution is stable, af executed recently enough) """
+        if not self.settings('af_scheduler', 'suppress_stable') or not self.stable:
+            return False
+        max_suppressed_slices = self.settings('af_scheduler', 'max_suppressed_slices')
+        return af.af_slice_number is not None and slice_number - af.af_slice_number < max_suppressed_slices
+
+    def get_state(self):
+        """ State for checkpoint """
+        return {'window': list(self._window),
+                'baseline': self._baseline,
+                'statistic': self.statistic,
+                'ewma': self._ewma,
+                'level': self._level,
+                'last_fire': self._last_fire}
+
+    def set_state(self, state):
+        self._window = deque(state['window'])
+        self._baseline = state['baseline']
+        self.statistic = state['statistic']
+        self._ewma = state['ewma']
+        self._level = state['level']
+        self._last_fire = state['last_fire']
+        self._last_slice = None
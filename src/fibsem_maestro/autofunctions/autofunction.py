@@ -1,3 +1,4 @@
+import copy
 import importlib
 import logging
 import numpy as np
@@ -10,10 +11,12 @@ from fibsem_maestro.tools.image_tools import get_stripes
 from fibsem_maestro.logger import Logger
 from fibsem_maestro.settings import Settings
 from fibsem_maestro.microscope_control.microscope import GlobalMicroscope
-from autoscript_sdb_microscope_client.structures import GrabFrameSettings
+from fibsem_maestro.microscope_control.settings import invalidate_settings_state
 
 
 class AutoFunction:
+    adaptive_sweeping = True  # supports sweeping strategies driven by criterion values (AdaptiveSweeping)
+
     def __init__(self, auto_function_name: str):
         """
         :param microscope: The microscope control instance.
@@ -64,14 +67,43 @@ class AutoFunction:
     def sweeping_strategy_changed(self, value):
         sweeping_module = importlib.import_module('fibsem_maestro.autofunctions.sweeping')
         Sweeping = getattr(sweeping_module, value)  # Load correct sweeping class
+        if Sweeping.adaptive and not self.adaptive_sweeping:
+            logging.error(f'{type(self).__name__} does not support adaptive sweeping ({value}).')
+            raise ValueError(f'{value} cannot be used with {type(self).__name__}')
         self._sweeping = Sweeping(self.auto_function_name)
 
     def max_attempts_changed(self, value):
         self.max_attempts = value
 
-    def set_sweep(self):
+    def set_sweep(self, range_scale=None):
+        """ Set sweeping base. range_scale - multiplier of sweeping range (None - unchanged) """
+        if range_scale is not None:
+            self._sweeping.range_scale = range_scale
         self._sweeping.set_sweep()
 
+    def get_state(self):
+        """ State for checkpoint """
+        return {'attempt': self.attempt,
+                'af_slice_number': self.af_slice_number,
+                'initial_af_value': self.initial_af_value,
+                'final_af_value': self.final_af_value,
+                'best_criterion_value': self.best_criterion_value,
+                'last_sweeping_value': self.last_sweeping_value,
+                # copy - values can be appended by criterion threads
+                'criterion_values': {k: copy.copy(v) for k, v in list(self._criterion_values.items())},
+                'sweeping': self._sweeping.get_state() if self._sweeping is not None else None}
+
+    def set_state(self, state):
+        self.attempt = state['attempt']
+        self.af_slice_number = state['af_slice_number']
+        self.initial_af_value = state['initial_af_value']
+        self.final_af_value = state['final_af_value']
+        self.best_criterion_value = state['best_criterion_value']
+        self.last_sweeping_value = state['last_sweeping_value']
+        self._criterion_values = state['criterion_values']
+        if self._sweeping is not None and state['sweeping'] is not None:
+            self._sweeping.set_state(state['sweeping'])
+
 
     def _initialize_criteria_dict(self):
         """
@@ -83,7 +115,7 @@ class AutoFunction:
 
     def _prepare(self, image_for_mask=None):
         """ Update mask if needed and set the microscope """
-        image_settings = self.settings('image', self.auto_function_name)
+        image_settings = self.settings('image', self.auto_function_name, return_view=True)
         # grab the image for masking if mask enabled
         if self._criterion.mask_used:
             self._criterion.mask.update_img(image_for_mask)
@@ -116,10 +148,13 @@ class AutoFunction:
         """ Finalizing function called on the end of resolution calculation thread"""
         # criterion can be None of not enough masked regions
         if resolution is not None:
-            self._criterion_values[kwargs['sweeping_value']].append(resolution)
+            # adaptive sweeping values are not known in advance
+            self._criterion_values.setdefault(kwargs['sweeping_value'], []).append(resolution)
         else:
             logging.warning('Criterion omitted (not enough masked region)!')
         logging.info(f"Criterion value: {resolution}")
+        # feedback to the sweeping strategy (adaptive sweeping selects the next value)
+        self._sweeping.report(kwargs['sweeping_value'], resolution)
 
     def _evaluate(self, slice_number):
         """
@@ -138,10 +173,10 @@ class AutoFunction:
 
         try:
             if len(self._criterion_values) > 0:
-                best_value = max(self._criterion_values, key=self._criterion_values.get)
+                # the best value is selected by sweeping strategy (best swept value, fit...)
+                best_value, self.best_criterion_value = self._sweeping.best_value(self._criterion_values)
                 self._sweeping.value = best_value  # set best value
                 self.final_af_value = best_value
-                self.best_criterion_value = max(self._criterion_values.values())
                 logging.info(f'Autofunction: {variable} = {best_value}. Criterion: {self.best_criterion_value}')
             else:
                 logging.error('Autofunction fail!')
@@ -159,21 +194,25 @@ class AutoFunction:
                 self.attempt = 1
         self.af_slice_number = slice_number
 
-    def check_firing(self, slice_number, image_resolution):
-        """ Check if the firing condition is passed"""
-        execute_slices = self.settings('autofunction', self.auto_function_name, 'execute_slices')
+    def check_firing(self, slice_number, image_resolution, slices_factor=1):
+        """
+        Check if the firing condition is passed.
+        slices_factor - multiplier of execute_slices (lower firing frequency if the variable is predicted well)
+        :return: the passed condition ('resolution' or 'slices'), None if the af is not fired
+        """
+        execute_slices = self.settings('autofunction', self.auto_function_name, 'execute_slices') * slices_factor
         execute_resolution = self.settings('autofunction', self.auto_function_name, 'execute_resolution')
 
-        # number of slices execution
-        if execute_slices > 0 and slice_number % execute_slices == 0:
-            return True
-
-        # number of slices execution
+        # resolution threshold execution
         if image_resolution is not None:
             if 0 < execute_resolution < image_resolution:
-                return True
+                return 'resolution'
 
-        return False
+        # number of slices execution
+        if execute_slices > 0 and slice_number % execute_slices == 0:
+            return 'slices'
+
+        return None
 
     def __call__(self, image_for_mask=None, slice_number=None):
         """
@@ -222,12 +261,19 @@ class AutoFunction:
     def criterion_values(self):
         return self._criterion_values
 
+    @property
+    def fit_curve(self):
+        """ Curve fitted by sweeping strategy (x, y) or None """
+        return self._sweeping.fit_curve if self._sweeping is not None else None
+
     @property
     def best_value(self):
         return
 
 
 class LineAutoFunction(AutoFunction):
+    adaptive_sweeping = False  # all values are swept during one scan
+
     def __init__(self, auto_function_name: str):
         super().__init__(auto_function_name)
         self._line_focuses = {}
@@ -292,26 +338,41 @@ class LineAutoFunction(AutoFunction):
 
         # convert to one-item list if only one section entered
         if isinstance(forbidden_sections, int):
-            self.forbidden_sections = [forbidden_sections]
+            forbidden_sections = [forbidden_sections]
+        self.forbidden_sections = forbidden_sections
 
+        # indices of all lines and their sweeping values
         sweeping_steps = steps
+        line_indices = []
+        line_variables = []
         for image_section_index, bin in get_stripes(img, separate_value=separate_value):
             if image_section_index not in self.forbidden_sections:
                 logging.debug(f'Stripe length: {len(bin)}')
                 bin = np.array_split(bin, sweeping_steps)  # split bins to equal parts the equal to focus_steps parts
                 # go over all variable values
                 for bin_index, variable in enumerate(self._sweeping.sweep_inner(image_section_index)):
-                    # each line
-                    for line_index in bin[bin_index]:
-                        # Autofunction._get_image_finalize is called be event
-                        # -> the resolution is appended to self._criterion_values
-                        f = self._criterion(img, line_number=line_index, slice_number=self.slice_number,
-                                            sweeping_value=variable)
-
-                        if f is not None:
-                            self._line_focuses[line_index] = f
-                        else:
-                            logging.warning('Criterion omitted due to not enough masked regions.')
+                    line_indices.append(bin[bin_index])
+                    line_variables.append(np.full(len(bin[bin_index]), variable))
+
+        if len(line_indices) == 0:
+            logging.warning('No image stripes found for line autofunction.')
+            return
+        line_indices = np.concatenate(line_indices)
+        line_variables = np.concatenate(line_variables)
+
+        # criterion of all lines at once
+        values = self._criterion.evaluate_lines(img, line_indices)
+        valid = ~np.isnan(values)
+        if not np.all(valid):
+            logging.warning(f'Criterion omitted on {np.sum(~valid)} lines.')
+        line_indices, line_variables, values = line_indices[valid], line_variables[valid], values[valid]
+        self._line_focuses.update(zip(line_indices.tolist(), values.tolist()))
+
+        # group line values by sweeping value and append them to self._criterion_values
+        variables, inverse = np.unique(line_variables, return_inverse=True)
+        groups = np.split(values[np.argsort(inverse, kind='stable')], np.cumsum(np.bincount(inverse))[:-1])
+        for variable, group in zip(variables.tolist(), groups):
+            self._criterion_values.setdefault(variable, []).extend(group.tolist())
 
     def _line_focus(self, slice_number):
         """
@@ -353,6 +414,8 @@ class LineAutoFunction(AutoFunction):
 
 
 class StepAutoFunction(AutoFunction):
+    adaptive_sweeping = False  # sweep list is created in advance
+
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self._step_number = 0  # actual step
@@ -367,6 +430,22 @@ class StepAutoFunction(AutoFunction):
     def keep_trying_setting_changed(self, value):
         self.keep_trying = value
 
+    def get_state(self):
+        state = super().get_state()
+        state['step_number'] = self._step_number
+        state['sweep_list'] = self.sweep_list
+        return state
+
+    def set_state(self, state):
+        super().set_state(state)
+        self._step_number = state['step_number']
+        self.sweep_list = state['sweep_list']
+        # the criterion of the last step could be still calculated when the checkpoint was taken
+        if 0 < self._step_number and len(self._criterion_values) < self._step_number:
+            logging.warning(f'Autofunction {self.auto_function_name}: criterion of some steps is missing in '
+                            f'checkpoint. Steps restarted.')
+            self._step_number = 0  # step values are absolute (sweep_list) - no need to restore the microscope
+
     def __call__(self, *args, **kwargs):
         """
         :param image_for_mask: The image to be used for masking. Defaults to None.
@@ -461,7 +540,7 @@ class ManufacturerAutoFunction(AutoFunction):
     def __init__(self, auto_function_name: str):
         super().__init__(auto_function_name)
 
-    def set_sweep(self):
+    def set_sweep(self, range_scale=None):
         pass
 
     def __call__(self, image_for_mask=None, slice_number=None):
@@ -529,11 +608,14 @@ class ManufacturerAutoFunction(AutoFunction):
 
         logging.info(f'Performing manufacturer autofunction - {sweeping_var}')
 
-        autofunction_fn(settings)
-
-        if sweeping_var == 'electron_beam.source_tilt':
-            self._microscope._microscope.detector.type.value = detector_backup
-            self._microscope._microscope.detector.mode.value = detector_mode_backup
+        try:
+            autofunction_fn(settings)
+        finally:
+            if sweeping_var == 'electron_beam.source_tilt':
+                self._microscope._microscope.detector.type.value = detector_backup
+                self._microscope._microscope.detector.mode.value = detector_mode_backup
+            # the autofunction (raw client) changes beam settings (WD, stigmator, scanning...)
+            invalidate_settings_state(self._microscope)
         self._microscope.electron_beam.dwell_time = dwell_backup
 
         self.move_stage_x(back=True)
@@ -8,6 +8,9 @@ from fibsem_maestro.tools.email_attention import send_email
 from fibsem_maestro.logger import Logger
 from fibsem_maestro.settings import Settings
 from fibsem_maestro.autofunctions.autofunction import StepAutoFunction, LineAutoFunction
+from fibsem_maestro.autofunctions.af_history import AfHistory
+from fibsem_maestro.autofunctions.af_scheduler import AfScheduler
+from fibsem_maestro.microscope_control.settings import invalidate_settings_state
 
 
 class AutofunctionControl:
@@ -20,6 +23,8 @@ class AutofunctionControl:
 
         self._masks = masks
         self.scheduler = []  # queue of autofunctions waiting to execute
+        self._predicted_slice = None  # the last slice with applied prediction of AF variables
+        self.af_scheduler = AfScheduler()  # resolution-trend-driven firing
 
         autofunction_settings = self.settings('autofunction', return_object=True)
         # list of all autofunctions objects
@@ -59,16 +64,40 @@ class AutofunctionControl:
         :param image_for_mask: an optional image used for masking
         :return: None
         """
+        self._apply_prediction(slice_number)
+
+        scheduler_enabled = self.settings('af_scheduler', 'enabled')
+        fired = {}  # fired af: sweeping range multiplier
         # check firing conditions of all autofunctions
         for af in self.autofunctions:
-            # Add af to scheduler if condition passed
-            if af.check_firing(slice_number, image_resolution):
-                if af not in self.scheduler:
-                    af.set_sweep()  # set sweeping base
-                    self.scheduler.append(af)
-                    logging.info(f'{af.auto_function_name} autofunction added to scheduler')
+            slices_factor, range_scale = self._prediction_factors(af)
+            firing = af.check_firing(slice_number, image_resolution, slices_factor=slices_factor)
+            if firing is not None:
+                # only periodic firing can be suppressed (resolution threshold is always executed)
+                if firing == 'slices' and scheduler_enabled and self.af_scheduler.suppress(af, slice_number):
+                    logging.info(f'{af.auto_function_name} autofunction suppressed (stable resolution)')
                 else:
-                    print(Fore.YELLOW, f'Autofunction {af.auto_function_name} already executed. It will not be added to the scheduler')
+                    fired[af] = range_scale
+
+        # fire af on resolution degradation (full sweeping range). Wait until the fired af is finished
+        escalation = self.settings('af_scheduler', 'escalation') or []
+        if scheduler_enabled and not any(af.auto_function_name in escalation for af in self.scheduler):
+            degradation_af = self.af_scheduler(slice_number, image_resolution)
+            Logger.log_params['degradation_statistic'] = self.af_scheduler.statistic
+            if degradation_af is not None:
+                try:
+                    fired[self.get_autofunction(degradation_af)] = 1.
+                except IndexError:
+                    logging.error(f'Autofunction {degradation_af} (af_scheduler.escalation) not found!')
+
+        # Add fired af to scheduler
+        for af, range_scale in fired.items():
+            if af not in self.scheduler:
+                af.set_sweep(range_scale)  # set sweeping base
+                self.scheduler.append(af)
+                logging.info(f'{af.auto_function_name} autofunction added to scheduler')
+            else:
+                print(Fore.YELLOW, f'Autofunction {af.auto_function_name} already executed. It will not be added to the scheduler')
 
         # log active autofunctions
         Logger.log_params['active_af'] = [x.auto_function_name for x in self.scheduler]
@@ -96,6 +125,7 @@ class AutofunctionControl:
                         self._microscope._microscope.imaging.set_active_view(1)
                         self._microscope._microscope.beams.electron_beam.scanning.mode.set_reduced_area()
                         mouseClickLineIntegration()
+                        invalidate_settings_state(self._microscope)  # view and scanning mode set by raw client
 
                 # run af
                 if af(image_for_mask, slice_number=slice_number):  # run af
@@ -106,6 +136,57 @@ class AutofunctionControl:
             if isinstance(af, StepAutoFunction):
                 break
 
+    def _apply_prediction(self, slice_number):
+        """ Pre-apply the predicted change of AF variables from the AF history (once per slice) """
+        if not self.settings('af_prediction', 'enabled') or slice_number == self._predicted_slice:
+            return
+        self._predicted_slice = slice_number
+        for variable, increment in AfHistory().predicted_increments().items():
+            beam_name, attribute = variable.split('.')
+            try:
+                beam = getattr(self._microscope, beam_name)
+                setattr(beam, attribute, getattr(beam, attribute) + increment)
+                logging.info(f'Predicted {variable} increment: {increment}')
+            except Exception as e:
+                logging.error(f'Predicted {variable} correction failed! ' + repr(e))
+                print(Fore.RED + f'Predicted {variable} correction failed!')
+
+    def _prediction_factors(self, af):
+        """
+        Multipliers of execute_slices and sweeping range of the af. If the af variable is predicted well,
+        af fires less often (af_prediction.firing_factor) with narrower range (af_prediction.range_factor).
+        """
+        if self.settings('af_prediction', 'enabled'):
+            variable = self.settings('autofunction', af.auto_function_name, 'variable')
+            if AfHistory().prediction_good(variable):
+                return (self.settings('af_prediction', 'firing_factor'),
+                        self.settings('af_prediction', 'range_factor'))
+        return 1, 1.
+
+    def get_state(self):
+        """ State for checkpoint (scheduler, state of all autofunctions and AF history) """
+        return {'scheduler': [af.auto_function_name for af in self.scheduler],
+                'autofunctions': {af.auto_function_name: af.get_state() for af in self.autofunctions},
+                'af_history': AfHistory().get_state(),
+                'af_scheduler': self.af_scheduler.get_state()}
+
+    def set_state(self, state):
+        if 'af_scheduler' in state:
+            self.af_scheduler.set_state(state['af_scheduler'])
+        if 'af_history' in state:
+            AfHistory().set_state(state['af_history'])
+        for name, af_state in state['autofunctions'].items():
+            try:
+                self.get_autofunction(name).set_state(af_state)
+            except IndexError:
+                logging.warning(f'Autofunction {name} from checkpoint not found. Its state is not restored.')
+        self.scheduler = []
+        for name in state['scheduler']:
+            try:
+                self.scheduler.append(self.get_autofunction(name))
+            except IndexError:
+                logging.warning(f'Autofunction {name} from checkpoint not found. It is removed from scheduler.')
+
     def remove_active_af(self):
         self.scheduler.pop(0)  # remove the finished af
 
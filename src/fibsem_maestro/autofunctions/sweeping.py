@@ -1,13 +1,39 @@
 import logging
+import math
+import threading
+
 import numpy as np
+from scipy.linalg import cho_factor, cho_solve
+from scipy.optimize import curve_fit
+from scipy.stats import norm
 
 from fibsem_maestro.settings import Settings
 from fibsem_maestro.microscope_control.microscope import GlobalMicroscope
+from fibsem_maestro.tools.support import Point
+
+FIT_MODELS = ('parabola', 'gauss', 'lorentz')
+FIT_MIN_VALUES = 5  # min. number of swept values for fit (parameters + at least 1 degree of freedom)
+FIT_MIN_VALUES_2D = 9  # min. number of swept values for surface fit (values used by quadratic surface fit)
+REPORT_TIMEOUT = 120  # max. waiting time for the criterion of the swept value in adaptive sweeping (s)
+TOLERANCE_FRACTION = 0.05  # default sweeping_tolerance of adaptive sweeping (fraction of the sweeping range width)
+GOLDEN_RATIO = (math.sqrt(5) - 1) / 2
+SPIRAL_CYCLES = 2  # default number of circles of SpiralSweeping (sweeping_spiral_cycles)
+
+
+def _gauss(x, amplitude, center, width, offset):
+    return offset + amplitude * np.exp(-0.5 * ((x - center) / width) ** 2)
+
+
+def _lorentz(x, amplitude, center, width, offset):
+    return offset + amplitude / (1 + ((x - center) / width) ** 2)
+
 
 class BasicSweeping:
     """
     Class for basic linear sweeping of any Microscope attribute.
     """
+    adaptive = False  # the sweeping values depend on the criterion of the previous values (see report)
+
     def __init__(self, autofunction_name):
         self._microscope = GlobalMicroscope().microscope_instance
         self.autofunction_name = autofunction_name
@@ -15,6 +41,9 @@ class BasicSweeping:
         self._base = None  # initial sweeping variable
         self._beam = None
         self._sweeping_var = None
+        self.fit_std = None  # standard deviation of the best value estimated by fit (None if not fitted)
+        self.fit_curve = None  # fitted curve (x, y) for the AF log (None if not fitted)
+        self.range_scale = 1.  # sweeping range multiplier (narrowed if the optimum is predicted well)
 
         sweeping_var_setting = self.settings('autofunction', self.autofunction_name,
                                              'variable', return_object=True)
@@ -41,9 +70,47 @@ class BasicSweeping:
         """ Set sweeping start point """
         self._base = self.value
 
+    def get_state(self):
+        """ State for checkpoint """
+        return {'base': self._base, 'range_scale': self.range_scale}
+
+    def set_state(self, state):
+        self._base = state['base']
+        self.range_scale = state.get('range_scale', 1.)
+
+    def sweeping_range(self):
+        """ Sweeping range [min, max] relative to the base value (settings multiplied by range_scale) """
+        sweeping_range = self.settings('autofunction', self.autofunction_name, 'sweeping_range')
+        return [x * self.range_scale for x in sweeping_range]
+
+    def report(self, value, criterion):
+        """
+        Criterion of the swept value (feedback from the autofunction, called when the criterion is calculated).
+        Not used by the basic sweeping.
+        """
+        pass
+
+    def axis_limits(self):
+        """ Limits [min, max] of each axis of the sweeping variable (x and y of Point variables) """
+        if isinstance(self._base, Point):
+            return [self._beam.limits(self._sweeping_var + '_x'), self._beam.limits(self._sweeping_var + '_y')]
+        return [self._beam.limits(self._sweeping_var)]
+
+    def best_value(self, criterion_values):
+        """
+        The best sweeping value from criterion values (dict sweeping value: criterion).
+        Basic sweeping selects the swept value with the maximal criterion.
+
+        :return: best value, criterion of the best value
+        """
+        self.fit_std = None
+        self.fit_curve = None
+        best_value = max(criterion_values, key=criterion_values.get)
+        return best_value, criterion_values[best_value]
+
     def define_sweep_space(self, repetition):
         # ensure zig zag manner
-        range = self.settings('autofunction', self.autofunction_name, 'sweeping_range')
+        range = self.sweeping_range()
         steps = int(self.settings('autofunction', self.autofunction_name, 'sweeping_steps'))
 
         if repetition % 2 == 0:
@@ -84,7 +151,7 @@ class BasicInterleavedSweeping(BasicSweeping):
     """ Basic sweeping interleaved by base sweeping values (Chans method)"""
     def define_sweep_space(self, *args, **kwargs):
         # if no of steps is odd -> remove 1. The base wd must be excluded
-        range = self.settings('autofunction', self.autofunction_name, 'sweeping_range')
+        range = self.sweeping_range()
         steps = int(self.settings('autofunction', self.autofunction_name, 'sweeping_steps'))
 
         if steps % 2 == 1:
@@ -96,46 +163,447 @@ class BasicInterleavedSweeping(BasicSweeping):
         merged_arr = np.dstack((interleave, sweep_space)).reshape(-1)
         return merged_arr
 
-#
-# class SpiralSweeping(BasicSweeping):
-#     def __init__(self, microscope, settings):
-#         super().__init__(microscope, settings)
-#         self.step_per_cycle = int(settings['sweeping_steps'])
-#         self.cycles = int(settings['sweeping_spiral_cycles'])
-#
-#     def sweep_inner(self, repetition):
-#         """ Basic sweeping"""
-#         if repetition % 2 == 0:
-#             sweep_space = np.arange(self.steps)
-#         else:
-#             sweep_space = np.arange(self.steps)[::-1]
-#
-#         for s in sweep_space:
-#             cycle_no = s // self.step_per_cycle  # cycle number
-#             step_no = s % self.step_per_cycle  # step number in the cycle
-#             radius = (self.range / self.cycles) * (cycle_no + 1)  # avoid zero radius
-#             angle = (2 * np.pi / self.step_per_cycle) * step_no
-#
-#             if cycle_no % 2 == 1:  # add angle shift for better covering
-#                 angle += (2 * np.pi / self.step_per_cycle) / 2
-#
-#             x = np.cos(angle) * radius
-#             y = np.sin(angle) * radius
-#
-#             value = self._base + Point(x, y)
-#             value_r = math.sqrt(value.x ** 2 + value.y ** 2)  # distance from zero (radius)
-#
-#             if value_r < self.max_limits:
-#                 yield value
-#             else:
-#                 logging.warning(f'Sweep of {self.sweeping_var} is out of range ({s}')
-#
-#     def sweep(self):
-#         """
-#         Perform a sweeping motion in a spiral pattern, generating a sequence of points.
-#
-#         :return: A generator that yields the points of the sweeping motion.
-#         """
-#         for repetition in range(self.total_cycles):
-#             for r in self.sweep_inner(repetition):
-#                 yield r
+
+class FittingSweeping(BasicSweeping):
+    """
+    Basic linear sweeping. The best value is the peak of the model (sweeping_fit_model: parabola, gauss, lorentz)
+    fitted to the criterion values, so the optimum is found between the swept values (less sweeping steps
+    needed). If the fit fails or the peak lies outside the swept range, the swept value with the maximal criterion
+    is used.
+    """
+    def best_value(self, criterion_values):
+        """
+        Peak of the fitted model. self.fit_std is set to the standard deviation of the peak position
+        (from the fit covariance).
+
+        :return: best value, criterion of the best value (fitted)
+        """
+        model = self.settings('autofunction', self.autofunction_name, 'sweeping_fit_model')
+        x = np.array(list(criterion_values.keys()), dtype=np.float64)
+        y = np.array(list(criterion_values.values()), dtype=np.float64)
+        try:
+            center, peak, center_std, curve = self._fit(x, y, model)
+        except Exception as e:
+            logging.warning(f'Autofunction {self.autofunction_name}: {model} fit failed, the best swept value is '
+                            f'used. ' + repr(e))
+            return super().best_value(criterion_values)
+
+        limits = self._beam.limits(self._sweeping_var)
+        center = float(np.clip(center, limits[0], limits[1]))
+        self.fit_std = center_std
+        self.fit_curve = curve
+        logging.info(f'Autofunction {self.autofunction_name}: {model} fit peak {center} (std {center_std})')
+        return center, peak
+
+    @staticmethod
+    def _fit(x, y, model):
+        """
+        Fit model to the criterion values. The sweeping values are normalized to <-1, 1> (numerical stability).
+
+        :return: peak position, peak criterion, standard deviation of peak position, fitted curve (x, y)
+        """
+        if model not in FIT_MODELS:
+            raise ValueError(f'Unknown fit model {model}. Possible values: {", ".join(FIT_MODELS)}')
+        if len(x) < FIT_MIN_VALUES:
+            raise ValueError(f'Not enough values for fit ({len(x)})')
+        middle = (x.max() + x.min()) / 2
+        half_span = (x.max() - x.min()) / 2
+        if half_span == 0:
+            raise ValueError('All swept values are equal')
+        u = (x - middle) / half_span
+        u_curve = np.linspace(-1, 1, 200)
+
+        if model == 'parabola':
+            # parabola describes only the top of the peak - fit the values around the maximum
+            order = np.argsort(u)
+            start = int(np.clip(np.argmax(y[order]) - FIT_MIN_VALUES // 2, 0, len(u) - FIT_MIN_VALUES))
+            top = order[start:start + FIT_MIN_VALUES]
+            (a, b, c), cov = np.polyfit(u[top], y[top], 2, cov=True)
+            if a >= 0:
+                raise ValueError('Fitted parabola has no maximum')
+            center = -b / (2 * a)
+            # standard deviation of -b/2a (error propagation)
+            gradient = np.array([b / (2 * a ** 2), -1 / (2 * a), 0])
+            center_var = gradient @ cov @ gradient
+            peak = c - b ** 2 / (4 * a)
+            u_curve = np.linspace(u[top].min(), u[top].max(), 200)
+            y_curve = np.polyval([a, b, c], u_curve)
+        else:
+            function = _gauss if model == 'gauss' else _lorentz
+            p0 = [y.max() - y.min(), u[np.argmax(y)], 0.5, y.min()]
+            bounds = ([0, -1, 1e-3, -np.inf], [np.inf, 1, np.inf, np.inf])
+            params, cov = curve_fit(function, u, y, p0=p0, bounds=bounds)
+            center = params[1]
+            center_var = cov[1, 1]
+            peak = params[0] + params[3]
+            y_curve = function(u_curve, *params)
+
+        if not -1 <= center <= 1:
+            raise ValueError(f'Fitted peak {middle + center * half_span} is outside the swept range')
+        if not np.isfinite(center_var) or np.sqrt(center_var) > 1:
+            raise ValueError('Fitted peak position is not reliable (uncertainty larger than the swept range)')
+        center_std = float(np.sqrt(center_var)) * half_span
+        return middle + center * half_span, float(peak), center_std, (middle + u_curve * half_span, y_curve)
+
+
+class AdaptiveSweeping(BasicSweeping):
+    """
+    Base of the sweeping strategies that select the next value from the criteria of the previous values.
+    The criteria are passed by report() (AutoFunction.get_image_finalize) - the sweep waits for the criterion of
+    the last value before the next value is selected. The sweep ends if the optimum is found with
+    sweeping_tolerance or the number of values reaches sweeping_steps.
+    Only AutoFunction supports adaptive sweeping (the swept values are not known in advance).
+    """
+    adaptive = True
+
+    def __init__(self, autofunction_name):
+        super().__init__(autofunction_name)
+        self._results = {}  # reported criteria (swept value: criterion)
+        self._results_condition = threading.Condition()
+
+    def report(self, value, criterion):
+        with self._results_condition:
+            self._results[value] = np.nan if criterion is None else criterion
+            self._results_condition.notify_all()
+
+    def _measure(self, value):
+        """ Wait for the criterion of the swept value (NaN if it is not reported in time) """
+        with self._results_condition:
+            if not self._results_condition.wait_for(lambda: value in self._results, timeout=REPORT_TIMEOUT):
+                logging.warning(f'Criterion of {self._sweeping_var} = {value} was not calculated in time.')
+                return np.nan
+            return self._results[value]
+
+    def _tolerance(self):
+        """ sweeping_tolerance (default - TOLERANCE_FRACTION of the sweeping range width) """
+        # optional setting
+        tolerance = self.settings('autofunction', self.autofunction_name, return_view=True).get('sweeping_tolerance')
+        if tolerance is None:
+            sweeping_range = self.sweeping_range()
+            tolerance = TOLERANCE_FRACTION * (sweeping_range[1] - sweeping_range[0])
+        return tolerance
+
+    def sweep_inner(self, repetition):
+        """ The values are selected during sweep - nothing is known in advance """
+        return iter(())
+
+    def sweep(self):
+        with self._results_condition:
+            self._results = {}
+        for value in self._adaptive_sweep():
+            yield 0, value
+
+    def _adaptive_sweep(self):
+        """ Generator of swept values. Criterion of the yielded value is available by self._measure(value) """
+        raise NotImplementedError()
+
+    def _sweeping_space(self):
+        """ Sweeping range around the base value (one [min, max] per axis), clipped to limits """
+        sweeping_range = self.sweeping_range()
+        base = self._base.to_array() if isinstance(self._base, Point) else [self._base]
+        return [[max(b + sweeping_range[0], limits[0]), min(b + sweeping_range[1], limits[1])]
+                for b, limits in zip(base, self.axis_limits())]
+
+
+class GoldenSectionSweeping(AdaptiveSweeping):
+    """
+    Golden-section search of the criterion maximum inside the sweeping range (scalar variables). Each step
+    shrinks the bracket of the optimum by golden ratio (one new value per step). It stops if the bracket is
+    narrower than sweeping_tolerance.
+    """
+    def _adaptive_sweep(self):
+        tolerance = self._tolerance()
+        max_steps = int(self.settings('autofunction', self.autofunction_name, 'sweeping_steps'))
+        (a, b), = self._sweeping_space()
+        start = (a, b)
+
+        def measure(value):
+            criterion = self._measure(value)
+            return -np.inf if np.isnan(criterion) else criterion
+
+        c = b - GOLDEN_RATIO * (b - a)
+        d = a + GOLDEN_RATIO * (b - a)
+        yield c
+        fc = measure(c)
+        yield d
+        fd = measure(d)
+        steps = 2
+        while b - a > tolerance and steps < max_steps:
+            if fc >= fd:  # maximum in [a, d]
+                b, d, fd = d, c, fc
+                c = b - GOLDEN_RATIO * (b - a)
+                yield c
+                fc = measure(c)
+            else:  # maximum in [c, b]
+                a, c, fc = c, d, fd
+                d = a + GOLDEN_RATIO * (b - a)
+                yield d
+                fd = measure(d)
+            steps += 1
+
+        logging.info(f'Golden-section sweep of {self._sweeping_var}: optimum in [{a}, {b}] after {steps} steps')
+        if b - a > tolerance:
+            logging.warning(f'Golden-section sweep of {self._sweeping_var} did not reach the tolerance {tolerance}.')
+        if a == start[0] or b == start[1]:
+            logging.warning(f'Optimum of {self._sweeping_var} is on the border of sweeping range.')
+
+
+class BayesianSweeping(AdaptiveSweeping):
+    """
+    Bayesian optimization of the criterion inside the sweeping range (scalar or Point variables, e.g. stigmator).
+    The criterion is modelled by gaussian process and the next value maximizes the expected improvement.
+    The sweep starts by the base value and the values around it and stops if the next value is closer than
+    sweeping_tolerance to an already swept value.
+    """
+    length_scale = 0.4  # GP length scale (normalized range <-1, 1>)
+    noise = 0.01  # GP noise variance (normalized criterion)
+    grid_size = {1: 401, 2: 41}  # number of candidate values per axis
+
+    def _to_array(self, value):
+        return np.array(value.to_array() if isinstance(value, Point) else [value], dtype=np.float64)
+
+    def _from_array(self, array):
+        return Point(float(array[0]), float(array[1])) if isinstance(self._base, Point) else float(array[0])
+
+    def _normalization(self):
+        """ Center and half-width of the sweeping space (value = center + u * half_width, u in <-1, 1>) """
+        space = np.array(self._sweeping_space(), dtype=np.float64)
+        return space.mean(axis=1), (space[:, 1] - space[:, 0]) / 2
+
+    def _posterior(self, u, y, u_candidates):
+        """ GP posterior mean and standard deviation (normalized criterion) on candidates """
+        def kernel(p, q):
+            return np.exp(-0.5 * np.sum((p[:, None, :] - q[None, :, :]) ** 2, axis=-1) / self.length_scale ** 2)
+
+        y_std = y.std() if y.std() > 0 else 1
+        y_norm = (y - y.mean()) / y_std
+        factor = cho_factor(kernel(u, u) + self.noise * np.eye(len(u)))
+        k_candidates = kernel(u_candidates, u)
+        mean = k_candidates @ cho_solve(factor, y_norm)
+        variance = 1 - np.sum(k_candidates * cho_solve(factor, k_candidates.T).T, axis=1)
+        return mean, np.sqrt(np.maximum(variance, 1e-12)), y_norm
+
+    def _adaptive_sweep(self):
+        tolerance = self._tolerance()
+        max_steps = int(self.settings('autofunction', self.autofunction_name, 'sweeping_steps'))
+        center, half_width = self._normalization()
+        dims = len(center)
+        grid = np.linspace(-1, 1, self.grid_size[dims])
+        u_candidates = np.stack([g.ravel() for g in np.meshgrid(*[grid] * dims, indexing='ij')], axis=-1)
+        half_width_safe = np.where(half_width > 0, half_width, 1)
+        # base value and the values around it
+        u_base = np.clip((self._to_array(self._base) - center) / half_width_safe, -1, 1)
+        if dims == 1:
+            initial = [u_base, np.array([-0.5]), np.array([0.5])]
+        else:
+            initial = [u_base] + [np.array([x, y]) for x in (-0.5, 0.5) for y in (-0.5, 0.5)]
+
+        u_swept, y_swept = [], []
+        for step in range(max_steps):
+            if step < len(initial):
+                u_next = initial[step]
+            else:
+                valid = ~np.isnan(y_swept)
+                if np.sum(valid) < 2:
+                    logging.warning('Bayesian sweep: not enough criterion values.')
+                    break
+                u, y = np.array(u_swept)[valid], np.array(y_swept)[valid]
+                mean, std, y_norm = self._posterior(u, y, u_candidates)
+                improvement = mean - y_norm.max() - 0.01
+                z = improvement / std
+                expected_improvement = improvement * norm.cdf(z) + std * norm.pdf(z)
+                u_next = u_candidates[np.argmax(expected_improvement)]
+                # converged - the next value is close to a swept value
+                distance = np.min(np.linalg.norm((np.array(u_swept) - u_next) * half_width, axis=1))
+                if distance < tolerance:
+                    logging.info(f'Bayesian sweep of {self._sweeping_var} converged after {step} steps')
+                    break
+            value = self._from_array(center + u_next * half_width)
+            yield value
+            u_swept.append(u_next)
+            y_swept.append(self._measure(value))
+
+    def best_value(self, criterion_values):
+        """ Swept value with the maximal criterion predicted by GP (less sensitive to noise than the maximum) """
+        self.fit_std = None
+        self.fit_curve = None
+        values = [k for k, v in criterion_values.items() if not np.isnan(v)]
+        if len(values) < 3:
+            return super().best_value(criterion_values)
+        center, half_width = self._normalization()
+        half_width = np.where(half_width > 0, half_width, 1)
+        u = np.array([(self._to_array(v) - center) / half_width for v in values])
+        y = np.array([criterion_values[v] for v in values], dtype=np.float64)
+        mean, _, _ = self._posterior(u, y, u)
+        best = values[int(np.argmax(mean))]
+        return best, criterion_values[best]
+
+
+def _quadratic_form(dx, dy, l1, l2, l3):
+    """ d^T L L^T d with lower triangular L = [[l1, 0], [l2, l3]] (positive semidefinite) """
+    u = l1 * dx + l2 * dy
+    v = l3 * dy
+    return u ** 2 + v ** 2
+
+
+def _gauss_2d(xy, amplitude, x0, y0, l1, l2, l3, offset):
+    return offset + amplitude * np.exp(-0.5 * _quadratic_form(xy[0] - x0, xy[1] - y0, l1, l2, l3))
+
+
+def _lorentz_2d(xy, amplitude, x0, y0, l1, l2, l3, offset):
+    return offset + amplitude / (1 + _quadratic_form(xy[0] - x0, xy[1] - y0, l1, l2, l3))
+
+
+class SpiralSweeping(BasicSweeping):
+    """
+    2D sweeping of Point variables (e.g. electron_beam.stigmator) - both axes are swept in one autofunction.
+    The values lie on a spiral around the base value: sweeping_spiral_cycles circles with sweeping_steps values
+    each (radius grows up to the max. of abs(sweeping_range)). The base value is swept first.
+    The best value is the peak of the surface (sweeping_fit_model: parabola, gauss, lorentz) fitted to the
+    criterion values. If the fit fails, the swept value with the maximal criterion is used.
+    """
+    def __init__(self, autofunction_name):
+        super().__init__(autofunction_name)
+        self._sweep_spaces = {}  # sweep space of each repetition (the same Point objects are used as dict keys)
+
+    def set_sweep(self):
+        super().set_sweep()
+        self._sweep_spaces = {}
+
+    def set_state(self, state):
+        super().set_state(state)
+        self._sweep_spaces = {}
+
+    def _radius(self):
+        sweeping_range = self.sweeping_range()
+        return max(abs(sweeping_range[0]), abs(sweeping_range[1]))
+
+    def _offsets(self, repetition):
+        """ Offsets (n, 2) from the base value """
+        steps = int(self.settings('autofunction', self.autofunction_name, 'sweeping_steps'))
+        cycles = int(self.settings('autofunction', self.autofunction_name, 'sweeping_spiral_cycles')
+                     or SPIRAL_CYCLES)
+        radius = self._radius()
+        offsets = [(0., 0.)]
+        for cycle in range(cycles):
+            cycle_radius = radius / cycles * (cycle + 1)
+            shift = np.pi / steps if cycle % 2 == 1 else 0  # shift of odd cycles (better covering)
+            for step in range(steps):
+                angle = 2 * np.pi / steps * step + shift
+                offsets.append((np.cos(angle) * cycle_radius, np.sin(angle) * cycle_radius))
+        return np.array(offsets)
+
+    def define_sweep_space(self, repetition):
+        if repetition not in self._sweep_spaces:
+            offsets = self._offsets(repetition)
+            if repetition % 2 == 1:  # zig zag manner
+                offsets = offsets[::-1]
+            limits = np.array(self.axis_limits())
+            values = np.array(self._base.to_array()) + offsets
+            outside = np.any((values < limits[:, 0]) | (values > limits[:, 1]), axis=1)
+            if np.any(outside):
+                logging.warning(f'Sweep of {self._sweeping_var} is out of range ({np.sum(outside)} values clipped)')
+            values = np.clip(values, limits[:, 0], limits[:, 1])
+            self._sweep_spaces[repetition] = [Point(float(x), float(y)) for x, y in values]
+        return self._sweep_spaces[repetition]
+
+    def sweep_inner(self, repetition):
+        """ Values are clipped to limits in define_sweep_space """
+        yield from self.define_sweep_space(repetition)
+
+    def best_value(self, criterion_values):
+        """
+        Peak of the fitted surface. self.fit_std is set to the standard deviation of the peak position
+        (Point, from the fit covariance).
+
+        :return: best value (Point), criterion of the best value
+        """
+        model = self.settings('autofunction', self.autofunction_name, 'sweeping_fit_model')
+        xy = np.array([value.to_array() for value in criterion_values.keys()], dtype=np.float64)
+        z = np.array(list(criterion_values.values()), dtype=np.float64)
+        try:
+            peak, criterion, peak_std = self._fit_surface(xy, z, model)
+        except Exception as e:
+            logging.warning(f'Autofunction {self.autofunction_name}: {model} surface fit failed, the best swept value '
+                            f'is used. ' + repr(e))
+            return super().best_value(criterion_values)
+
+        limits = np.array(self.axis_limits())
+        peak = np.clip(peak, limits[:, 0], limits[:, 1])
+        self.fit_std = Point(*peak_std)
+        self.fit_curve = None
+        best = Point(float(peak[0]), float(peak[1]))
+        logging.info(f'Autofunction {self.autofunction_name}: {model} surface peak {best} (std {self.fit_std})')
+        return best, criterion
+
+    def _fit_surface(self, xy, z, model):
+        """
+        Fit model surface to the criterion values. The values are normalized by the sweeping radius.
+
+        :return: peak position (2), peak criterion, standard deviation of the peak position (2)
+        """
+        if model not in FIT_MODELS:
+            raise ValueError(f'Unknown fit model {model}. Possible values: {", ".join(FIT_MODELS)}')
+        if len(z) < FIT_MIN_VALUES_2D:
+            raise ValueError(f'Not enough values for fit ({len(z)})')
+        base = np.array(self._base.to_array(), dtype=np.float64)
+        scale = self._radius()
+        u = (xy - base) / scale
+
+        if model == 'parabola':
+            # quadratic surface describes only the top of the peak - fit the values nearest to the maximum
+            nearest = np.argsort(np.linalg.norm(u - u[np.argmax(z)], axis=1))[:FIT_MIN_VALUES_2D]
+            un, zn = u[nearest], z[nearest]
+            design = np.stack([np.ones(len(un)), un[:, 0], un[:, 1], un[:, 0] ** 2, un[:, 0] * un[:, 1],
+                               un[:, 1] ** 2], axis=1)
+            coefficients, _, _, _ = np.linalg.lstsq(design, zn, rcond=None)
+            c0, cx, cy, cxx, cxy, cyy = coefficients
+            hessian = np.array([[2 * cxx, cxy], [cxy, 2 * cyy]])
+            if np.any(np.linalg.eigvalsh(hessian) >= 0):
+                raise ValueError('Fitted surface has no maximum')
+            center = np.linalg.solve(hessian, [-cx, -cy])
+            peak = c0 + 0.5 * np.dot([cx, cy], center)
+            # standard deviation of the peak position (residual variance and error propagation)
+            dof = max(len(zn) - design.shape[1], 1)
+            residual_var = np.sum((design @ coefficients - zn) ** 2) / dof
+            cov = residual_var * np.linalg.pinv(design.T @ design)
+            hessian_inv = np.linalg.inv(hessian)
+            # d center / d coefficients (implicit function theorem on H center = -g)
+            jacobian = np.zeros((2, 6))
+            jacobian[:, 1:3] = -hessian_inv
+            jacobian[:, 3] = -hessian_inv @ [2 * center[0], 0]
+            jacobian[:, 4] = -hessian_inv @ [center[1], center[0]]
+            jacobian[:, 5] = -hessian_inv @ [0, 2 * center[1]]
+            center_cov = jacobian @ cov @ jacobian.T
+        else:
+            function = _gauss_2d if model == 'gauss' else _lorentz_2d
+            p0 = [z.max() - z.min(), u[np.argmax(z), 0], u[np.argmax(z), 1], 2, 0, 2, z.min()]
+            bounds = ([0, -1.5, -1.5, -np.inf, -np.inf, -np.inf, -np.inf],
+                      [np.inf, 1.5, 1.5, np.inf, np.inf, np.inf, np.inf])
+            params, cov = curve_fit(function, u.T, z, p0=p0, bounds=bounds)
+            center = params[1:3]
+            peak = params[0] + params[6]
+            center_cov = cov[1:3, 1:3]
+
+        if np.linalg.norm(center) > 1 + 1e-9:
+            raise ValueError(f'Fitted peak {base + center * scale} is outside the swept area')
+        center_var = np.diag(center_cov)
+        if not np.all(np.isfinite(center_var)) or np.any(np.sqrt(center_var) > 1):
+            raise ValueError('Fitted peak position is not reliable (uncertainty larger than the swept area)')
+        return base + center * scale, float(peak), np.sqrt(center_var) * scale
+
+
+class LatinHypercubeSweeping(SpiralSweeping):
+    """
+    The same as SpiralSweeping, but the values are Latin hypercube samples of the square base +- max. of
+    abs(sweeping_range) (sweeping_steps values + the base value). Every row and column of the sweeping_steps x
+    sweeping_steps grid contains exactly one value.
+    """
+    def _offsets(self, repetition):
+        steps = int(self.settings('autofunction', self.autofunction_name, 'sweeping_steps'))
+        radius = self._radius()
+        rng = np.random.default_rng()
+        # one random value in each stratum of each axis, strata of the axes are paired randomly
+        strata = np.stack([rng.permutation(steps), rng.permutation(steps)], axis=1)
+        samples = (strata + rng.random((steps, 2))) / steps  # <0, 1>
+        return np.concatenate([[[0., 0.]], (samples * 2 - 1) * radius])
@@ -18,6 +18,7 @@ class TemplateMatchingDriftCorrection:
         self.settings = Settings()
         self.template_matching_image = None  # acquired template matching image
         self.heat_map = None
+        self.templates_positions = []  # positions of templates found in the last image
 
     def _prepare_image(self, img):
         # convert to 8bit if necessary
@@ -137,6 +138,13 @@ class TemplateMatchingDriftCorrection:
         tifffile.imwrite(template_image_name, template_image, imagej=True, metadata={'pixel_size': pixel_size})
 
 
+    def get_state(self):
+        """ State for checkpoint (templates are saved in the template matching dir) """
+        return {'templates_positions': list(self.templates_positions)}
+
+    def set_state(self, state):
+        self.templates_positions = state['templates_positions']
+
     def __call__(self, img, slice_number):
         """
         :param img: The input image for drift correction.
@@ -144,10 +152,10 @@ class TemplateMatchingDriftCorrection:
         :return: The point object representing the calculated beam shift.
         """
         areas = self.settings('drift_correction', 'driftcorr_areas')
-        drfitcorr_imaging_settings = self.settings('image', 'driftcorr')
+        drfitcorr_imaging_settings = self.settings('image', 'driftcorr', return_view=True)
 
         imaging_settings_name = self.settings('acquisition', 'image_name')
-        imaging_settings = self.settings('image', imaging_settings_name)
+        imaging_settings = self.settings('image', imaging_settings_name, return_view=True)
 
         if len(areas) == 0:
             logging.error('Template matching enabled but no areas not found. Drift correction disabled')
@@ -1,32 +1,59 @@
 import importlib
 import logging
-from threading import Thread
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, wait
+from contextlib import ExitStack
 
 import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
 
+from fibsem_maestro.image_criteria.criterion_cache import get_criterion_cache, image_digest, settings_digest
+from fibsem_maestro.image_criteria.criterion_executor import SharedImage, get_executor
 from fibsem_maestro.logger import Logger
-from fibsem_maestro.settings import Settings
+from fibsem_maestro.settings import Settings, SettingsView
+from fibsem_maestro.tools.fft_backend import get_fft_backend, set_fft_backend
+from fibsem_maestro.tools.support import Image
+
+BATCH_PIXELS = 2 ** 24  # max. number of tile pixels evaluated by one batch call (memory limit)
 
 
 class Criterion:
-    def __init__(self, criterion_name, mask=None):
-        self.settings = Settings()
+    def __init__(self, criterion_name, mask=None, criterion_settings=None):
+        """
+        criterion_settings - settings dict of the criterion. If set, the criterion is detached from Settings
+        (calculation in the worker process).
+        """
+        self.settings = Settings() if criterion_settings is None else None
         self.criterion_name = criterion_name
         self.mask = mask
 
         self.pixel_size = None  # pixel size is measured from image
         self.tile_width_px = None  # tile width calculated from image size
+        self.tile_size_px = None  # tile size calculated from pixel size
         self.border_x = 0  # border width in pixels
         self.border_y = 0  # border height in pixels
         self.img_with_border = None  # Image without border
-        self._threads = []  # threads list for criterion calculation in separated thread
+        self._tasks = deque()  # calculations submitted to the executor (in order of submission)
+        self._finalize_lock = threading.Lock()
+        self._detached_settings = criterion_settings
         # function that is called on the end of separated thread (one argument - resolution)
         self.finalize_thread_func = None
-        self.crit_images = None  # series of images to calculate criterion
         self.criterion_func = None
+        self.criterion_batch_func = None  # criterion over tile stack (<criterion>_batch), None if not supported
+        self.criterion_lines_func = None  # criterion of each image line (<criterion>_lines), None if not supported
+        self.criterion_map_func = None  # criterion of each window of the image (<criterion>_map), None if not supported
+        self.map_step_px = None  # shift of the neighbouring windows of the resolution map (px)
         self.final_regions_resolution = None
         self.final_resolution = None
 
+        if criterion_settings is not None:
+            self.criterion_changed(criterion_settings['criterion'])
+            self.final_regions_resolution_changed(criterion_settings['final_regions_resolution'])
+            self.final_resolution_changed(criterion_settings['final_resolution'])
+            return
+
         criterion_func_setting = self.settings('criterion_calculation', self.criterion_name, 'criterion',
                                                return_object=True)
         # refresh self.criterion_func on every change!
@@ -48,6 +75,9 @@ class Criterion:
     def criterion_changed(self, value):
         criteria_module = importlib.import_module('fibsem_maestro.image_criteria.criteria_math')
         self.criterion_func = getattr(criteria_module, value)
+        self.criterion_batch_func = getattr(criteria_module, value + '_batch', None)
+        self.criterion_lines_func = getattr(criteria_module, value + '_lines', None)
+        self.criterion_map_func = getattr(criteria_module, value + '_map', None)
 
     def final_regions_resolution_changed(self, value):
         self.final_regions_resolution = getattr(np, value)
@@ -55,9 +85,38 @@ class Criterion:
     def final_resolution_changed(self, value):
         self.final_resolution = getattr(np, value)
 
+    def _get_criterion_settings(self):
+        """ Settings of this criterion (criterion_calculation section) """
+        if self._detached_settings is not None:
+            return self._detached_settings
+        return self.settings('criterion_calculation', self.criterion_name, return_view=True)
+
+    def _detached_state(self):
+        """ Arguments of the detached criterion (picklable) """
+        criterion_settings = self._get_criterion_settings()
+        if isinstance(criterion_settings, SettingsView):
+            criterion_settings = criterion_settings.to_dict()
+        return self.criterion_name, criterion_settings
+
+    @staticmethod
+    def _overlap(criterion_settings):
+        """ Overlap of the neighbouring tiles (0 - no overlap). Optional setting """
+        return criterion_settings['overlap'] if 'overlap' in criterion_settings else 0
+
+    def _tile_size_px(self, pixel_size):
+        """ Tile size in pixels calculated from pixel size (divisible by 4) """
+        tile_size_px = int(self._get_criterion_settings()['tile_size'] / pixel_size)
+        return tile_size_px - tile_size_px % 4  # must be divisible by 4
+
+    def _tile_step(self, overlap=0, tile_size_px=None):
+        """ Shift of the neighbouring tiles (px) """
+        if tile_size_px is None:
+            tile_size_px = self.tile_size_px
+        return max(1, int(tile_size_px * (1 - overlap)))
+
     def _tiles_resolution(self, img, generate_map=False, return_best_tile=False, **kwargs):
-        criterion_settings = self.settings('criterion_calculation', self.criterion_name)
-        tile_size = self.settings('criterion_calculation', self.criterion_name, 'tile_size')
+        criterion_settings = self._get_criterion_settings()
+        tile_size = criterion_settings['tile_size']
 
         if min(img.shape) == 1 or len(img.shape) == 1:  # line
             logging.debug('Line image does not support tiling')
@@ -65,35 +124,42 @@ class Criterion:
 
         logging.info("Tiles resolution calculation...")
         # Apply resolution border to the acquired image
+        # local reference - self.img_with_border can be changed by parallel calculation
         if generate_map == False:
-            self.img_with_border = self._crop_image_with_border(img)
+            img_with_border = self._crop_image_with_border(img)
         else:
             # do not apply bordering if resolution map needed
-            self.img_with_border = img
-            tiles_coordinates = self._generate_image_fractions(self.img_with_border, return_coordinates=True)
-            resolution_map = np.zeros_like(self.img_with_border, dtype=np.float64)
+            img_with_border = img
+        self.img_with_border = img_with_border
 
-        self.tile_size_px = int(tile_size / self.pixel_size)
-        self.tile_size_px -= self.tile_size_px % 4  # must be divisible by 4
+        self.tile_size_px = self._tile_size_px(self.pixel_size)
+
+        if generate_map:
+            return self._tiles_resolution_map(img_with_border, criterion_settings, return_best_tile)
+
+        overlap = self._overlap(criterion_settings)
 
         # Get resolution of each tile and calculate final resolution
         res_arr = []
 
+        # batched evaluation of all tiles (vectorized)
+        if tile_size != 0 and self.criterion_batch_func is not None:
+            try:
+                return self._tiles_resolution_batch(img_with_border, criterion_settings, overlap, return_best_tile)
+            except Exception as e:
+                logging.warning("Batched tiles resolution calculation failed. Calculating tile by tile. " + repr(e))
+
         # if tile size = 0, not apply tilling
         if tile_size == 0:
-            tiles = [self.img_with_border]
+            tiles = [img_with_border]
         else:
-            tiles = self. _generate_image_fractions(self.img_with_border)
+            tiles = self. _generate_image_fractions(img_with_border, overlap)
 
         minimal_resolution = 1
         tile_img_best_res = None
         for tile_img in tiles:
             try:
                 res = self.criterion_func(tile_img, criterion_settings)
-                if generate_map:
-                    coordinates_array = next(tiles_coordinates)
-                    resolution_map[coordinates_array[0]:coordinates_array[0]+coordinates_array[2],
-                    coordinates_array[1]:coordinates_array[1] + coordinates_array[3]] = res
                 if res < minimal_resolution:
                     minimal_resolution = res
                     tile_img_best_res = tile_img
@@ -114,17 +180,116 @@ class Criterion:
             res_arr = res_arr[~np.isnan(res_arr)]  # remove NaN
             final_res = self.final_resolution(res_arr)  # apply final function (like min)
             result = (final_res,)
-            if generate_map:
-                result = result + (resolution_map,)  # append result tuple
             if return_best_tile:
                 result = result + (tile_img_best_res,)  # append result tuple
             return result
 
+    def _tile_stack(self, img, overlap=0):
+        """
+        Zero-copy stack of tiles (strided view of the image).
+
+        :return: stack (nx, ny, tile_size_px, tile_size_px), x coordinates (nx), y coordinates (ny)
+        """
+        step = self._tile_step(overlap)
+        windows = sliding_window_view(np.asarray(img), (self.tile_size_px, self.tile_size_px))
+        stack = windows[::step, ::step]
+        return stack, np.arange(stack.shape[0]) * step, np.arange(stack.shape[1]) * step
+
+    def _tiles_resolution_batch(self, img, criterion_settings, overlap=0, return_best_tile=False):
+        """
+        The same as tile loop in _tiles_resolution, but all tiles are evaluated by criterion_batch_func on the tile
+        stack.
+        """
+        if self.tile_size_px <= 0 or min(img.shape) < self.tile_size_px:
+            logging.error("Resolution not computed")
+            return 0
+        stack, _, _ = self._tile_stack(img, overlap)
+        tile_values = self._evaluate_tile_stack(stack, criterion_settings)
+        logging.info(f'Image sectioned to {tile_values.size} sections')
+        logging.debug(f'Tile resolutions: {tile_values.ravel()}')
+
+        res_arr = tile_values[~np.isnan(tile_values)]  # remove NaN
+        final_res = self.final_resolution(res_arr)  # apply final function (like min)
+        result = (final_res,)
+        if return_best_tile:
+            result = result + (self._best_tile(img, tile_values, self._tile_step(overlap)),)  # append result tuple
+        return result
+
+    def _evaluate_tile_stack(self, stack, criterion_settings):
+        """ criterion_batch_func of the tile stack (nx, ny, tile, tile). Returns array (nx, ny) """
+        # evaluate in chunks of tile rows (limit of memory used by the criterion temporaries)
+        rows_per_chunk = max(1, BATCH_PIXELS // (stack.shape[1] * self.tile_size_px ** 2))
+        return np.concatenate([np.asarray(self.criterion_batch_func(stack[i:i + rows_per_chunk],
+                                                                    self.pixel_size, criterion_settings),
+                                          dtype=np.float64)
+                               for i in range(0, stack.shape[0], rows_per_chunk)])
+
+    def _best_tile(self, img, tile_values, step):
+        """ The first tile with minimal resolution (< 1), None if there is no such tile """
+        candidates = np.where(np.isnan(tile_values), np.inf, tile_values)
+        best = np.unravel_index(np.argmin(candidates), candidates.shape)
+        if candidates[best] >= 1:
+            return None
+        x, y = best[0] * step, best[1] * step
+        return img[x:x + self.tile_size_px, y:y + self.tile_size_px]
+
+    def _tiles_resolution_map(self, img, criterion_settings, return_best_tile=False):
+        """
+        Resolution map - one criterion value per tile. The tiles overlap according to the overlap setting,
+        map[i, j] is the criterion of img[i * step: i * step + tile_size_px, j * step: j * step + tile_size_px]
+        (step = self.map_step_px). The map is evaluated by criterion_map_func (integral image over the image
+        filtered at once) if the criterion supports it, otherwise on the tile stack (batch or tile by tile).
+
+        :return: (final resolution, map) [+ best tile]
+        """
+        if criterion_settings['tile_size'] == 0:  # no tiling - map of one value
+            tile_values = np.array([[self.criterion_func(img, criterion_settings)]], dtype=np.float64)
+            self.map_step_px = 0
+        elif self.tile_size_px <= 0 or min(img.shape) < self.tile_size_px:
+            logging.error("Resolution not computed")
+            return 0
+        else:
+            overlap = self._overlap(criterion_settings)
+            step = self._tile_step(overlap)
+            self.map_step_px = step
+            tile_values = None
+            if self.criterion_map_func is not None:
+                try:
+                    tile_values = np.asarray(self.criterion_map_func(img, self.pixel_size, criterion_settings,
+                                                                     self.tile_size_px, step), dtype=np.float64)
+                except Exception as e:
+                    logging.warning("Resolution map calculation failed. Calculating on tiles. " + repr(e))
+            if tile_values is None:
+                tile_values = self._tile_stack_values(img, criterion_settings, overlap)
+        logging.info(f'Resolution map {tile_values.shape[0]}x{tile_values.shape[1]} tiles')
+
+        res_arr = tile_values[~np.isnan(tile_values)]  # remove NaN
+        result = (self.final_resolution(res_arr), tile_values)
+        if return_best_tile:
+            result = result + (self._best_tile(img, tile_values, self.map_step_px),)  # append result tuple
+        return result
+
+    def _tile_stack_values(self, img, criterion_settings, overlap=0):
+        """ Criterion of each tile of the tile stack (batch if supported, otherwise tile by tile). Array (nx, ny) """
+        stack, _, _ = self._tile_stack(img, overlap)
+        if self.criterion_batch_func is not None:
+            try:
+                return self._evaluate_tile_stack(stack, criterion_settings)
+            except Exception as e:
+                logging.warning("Batched tiles resolution calculation failed. Calculating tile by tile. " + repr(e))
+        tile_values = np.full(stack.shape[:2], np.nan)
+        for i, j in np.ndindex(*stack.shape[:2]):
+            try:
+                tile_values[i, j] = self.criterion_func(Image(stack[i, j], self.pixel_size), criterion_settings)
+            except Exception as e:
+                logging.warning("Resolution calculation error on current tile. " + repr(e))
+        return tile_values
+
     @property
     def mask_used(self):
         return self.mask is not None
 
-    def _generate_image_fractions(self, img, overlap=0, return_coordinates=False):
+    def _generate_image_fractions(self, img, overlap=0, return_coordinates=False, tile_size_px=None):
         """
         Generate image fractions (tiles) with optional overlap.
 
@@ -132,19 +297,23 @@ class Criterion:
             img (numpy.ndarray): The input image.
             overlap (float): Proportion of overlap between tiles (0 - no overlap, 1 - complete overlap).
             return_coordinates (bool): Whether to return tile coordinates.
+            tile_size_px (int): Tile size (self.tile_size_px if None).
 
         Yields:
             numpy.ndarray: A generated tile from the image.
             list: [x_start, y_start, tile_width, tile_height] if return_coordinates is True.
         """
-        for x in np.arange(0, img.shape[0] - self.tile_size_px + 1, int(self.tile_size_px * (1 - overlap))):
-            for y in np.arange(0, img.shape[1] - self.tile_size_px + 1, int(self.tile_size_px * (1 - overlap))):
+        if tile_size_px is None:
+            tile_size_px = self.tile_size_px
+        step = self._tile_step(overlap, tile_size_px)
+        for x in np.arange(0, img.shape[0] - tile_size_px + 1, step):
+            for y in np.arange(0, img.shape[1] - tile_size_px + 1, step):
                 xi = int(x)
                 yi = int(y)
                 if return_coordinates:
-                    yield [xi, yi, self.tile_size_px, self.tile_size_px]
+                    yield [xi, yi, tile_size_px, tile_size_px]
                 else:
-                    yield img[xi: xi + self.tile_size_px, yi: yi + self.tile_size_px]
+                    yield img[xi: xi + tile_size_px, yi: yi + tile_size_px]
 
     def _crop_image_with_border(self, img, return_coordinates=False):
         """
@@ -158,7 +327,7 @@ class Criterion:
             numpy.ndarray: The cropped image.
             list: [x_start, y_start, cropped_width, cropped_height] if return_coordinates is True.
         """
-        border = self.settings('criterion_calculation', self.criterion_name, 'border')
+        border = self._get_criterion_settings()['border']
 
         self.border_x = int(img.shape[0] * border)
         self.border_y = int(img.shape[1] * border)
@@ -170,6 +339,31 @@ class Criterion:
                               self.border_y: self.border_y + img.shape[1] - 2 * self.border_y]
             return cropped_img
 
+    def log_tiles(self, images, pixel_size, generate_map=False):
+        """
+        Tiles of each image as evaluated by the calculation - list of [x_start, y_start, tile_width, tile_height]
+        (border included) per image, empty for lines or if tiling is not applied. The criterion state is not changed
+        (it is called from the finalizing thread).
+        """
+        criterion_settings = self._get_criterion_settings()
+        overlap = self._overlap(criterion_settings)
+        tiles = []
+        for img in images:
+            image_tiles = []
+            if len(img.shape) == 2 and min(img.shape) > 1 and criterion_settings['tile_size'] > 0:
+                tile_size_px = self._tile_size_px(pixel_size)
+                # no bordering if resolution map generated
+                border = 0 if generate_map else criterion_settings['border']
+                border_x = int(img.shape[0] * border)
+                border_y = int(img.shape[1] * border)
+                if tile_size_px > 0:
+                    img_with_border = img[border_x: img.shape[0] - border_x, border_y: img.shape[1] - border_y]
+                    for tile in self._generate_image_fractions(img_with_border, overlap, return_coordinates=True,
+                                                               tile_size_px=tile_size_px):
+                        image_tiles.append([tile[0] + border_y, tile[1] + border_x, tile[2], tile[3]])
+            tiles.append(image_tiles)
+        return tiles
+
     def __call__(self, image, line_number=None, slice_number=None, separate_thread=False, **kwargs):
         """
         It measures selected resolution criterion on image.
@@ -181,58 +375,211 @@ class Criterion:
         """
 
 
-        self.pixel_size = image.pixel_size
+        # images and pixel size are passed to the calculation - the criterion state is used by the calling thread only
+        pixel_size = image.pixel_size
+        images = self._prepare_images(image, line_number)
 
+        if separate_thread:
+            self._submit(images, pixel_size, slice_number, kwargs)
+        else:
+            self.pixel_size = pixel_size
+            resolution = self._calculate(images, pixel_size, slice_number, **kwargs)
+            # log
+            tiles = self.log_tiles(images, pixel_size, kwargs.get('generate_map', False))
+            Logger.create_log_criterion(self, images, tiles, slice_number)
+            return resolution
+
+    def _prepare_images(self, image, line_number=None):
+        """ Images for criterion calculation (masked regions or the entire image/line) """
         if line_number is not None:
             image = image[:, line_number]
 
-        self.crit_images = [image]  # only one image if not masking
+        crit_images = [image]  # only one image if not masking
 
         if self.mask is not None:
-            self.crit_images = self.mask.get_masked_images(image, line_number)
+            crit_images = self.mask.get_masked_images(image, line_number)
 
-            if self.crit_images is None:
+            if crit_images is None:
                 logging.error('Not enough masked regions for resolution calculation - masking omitted!')
-                self.crit_images = [image]  # calculate resolution on entire image
+                crit_images = [image]  # calculate resolution on entire image
+        return crit_images
 
-        if separate_thread:
-            t = Thread(target=self._calculate, args=[slice_number], kwargs=kwargs)
-            t.start()
-            self._threads.append(t)
+    def evaluate_lines(self, image, line_numbers):
+        """
+        Criterion of each selected image line (image[:, line_number]).
+        All lines are evaluated by one call of <criterion>_lines. If the criterion does not support it or the mask
+        is used, lines are evaluated one by one. Finalize function and log are not called.
+
+        :return: array of criterion values (the same order as line_numbers)
+        """
+        self.pixel_size = image.pixel_size
+        line_numbers = np.asarray(line_numbers, dtype=int)
+        if len(line_numbers) == 0:
+            return np.zeros(0)
+        if self.criterion_lines_func is not None and self.mask is None:
+            try:
+                lines = np.asarray(image)[:, line_numbers].T  # one line per row
+                cache, key = self._cache_key([lines], self.pixel_size, {}, 'lines')
+                if cache is not None:
+                    result = cache.get(key)
+                    if result is not None:
+                        return result[0]
+                values = np.asarray(self.criterion_lines_func(lines, self.pixel_size, self._get_criterion_settings()),
+                                    dtype=np.float64)
+                if cache is not None:
+                    cache.put(key, (values,))
+                return values
+            except Exception as e:
+                logging.warning("Batched line criterion calculation failed. Calculating line by line. " + repr(e))
+
+        values = []
+        for line_number in line_numbers:
+            try:
+                values.append(self._compute_cached(self._prepare_images(image, line_number))[0])
+            except Exception as e:
+                logging.warning(f"Criterion calculation error on line {line_number}. " + repr(e))
+                values.append(np.nan)
+        return np.array(values, dtype=np.float64)
+
+    def _submit(self, images, pixel_size, slice_number, kwargs):
+        """
+        Submit the calculation to the shared executor (see criterion_executor). The calculation runs on a detached
+        criterion (the state of this criterion is not changed). The finalize function and log are called in this
+        process in order of submission.
+        """
+        executor, executor_type = get_executor()
+        shared_images = None
+        cache, key, cached_result = None, None, None
+        criterion_name, criterion_settings = self._detached_state()
+        if executor_type == 'process':
+            # the worker process has no access to the cache - it is checked here and filled on finalizing
+            cache, key = self._cache_key(images, pixel_size, kwargs)
+            cached_result = cache.get(key) if cache is not None else None
+        if cached_result is not None:
+            future = Future()
+            future.set_result((cached_result, 0.))
+            cache = None
+        elif executor_type == 'process':
+            # the images are passed by shared memory (no pickling of image data)
+            shared_images = [SharedImage(image) for image in images]
+            # the worker process has no settings - the FFT backend selected here is used
+            fft_backend = get_fft_backend()
+            future = executor.submit(_compute_detached, criterion_name, criterion_settings, shared_images,
+                                     pixel_size, kwargs, (fft_backend.name, fft_backend.workers))
         else:
-            resolution = self._calculate(slice_number, **kwargs)
-            # log
-            Logger.create_log_criterion(self, slice_number)
-            return resolution
+            future = executor.submit(self._compute_timed, criterion_settings, images, pixel_size, kwargs)
+        self._tasks.append((future, slice_number, kwargs, images, pixel_size, shared_images, (cache, key)))
+        future.add_done_callback(lambda f: self._finalize_done())
+
+    def _compute_timed(self, criterion_settings, images, pixel_size, kwargs):
+        """ Calculation in the executor thread (detached criterion, shared cache). Returns (result, CPU time) """
+        cpu_start = time.thread_time()
+        cache, key = self._cache_key(images, pixel_size, kwargs)
+        result = cache.get(key) if cache is not None else None
+        if result is None:
+            criterion = Criterion(self.criterion_name, criterion_settings=criterion_settings)
+            criterion.pixel_size = pixel_size
+            result = criterion._compute(images, **kwargs)
+            if cache is not None:
+                cache.put(key, result)
+        return result, time.thread_time() - cpu_start
+
+    def _finalize_done(self):
+        """ Finalize all finished calculations from the beginning of the queue (keeps the order of submission) """
+        with self._finalize_lock:
+            while len(self._tasks) > 0 and self._tasks[0][0].done():
+                future, slice_number, kwargs, images, pixel_size, shared_images, (cache, key) = self._tasks.popleft()
+                if shared_images is not None:
+                    for shared_image in shared_images:
+                        shared_image.release()
+                try:
+                    result, cpu_time = future.result()
+                except Exception as e:
+                    logging.error('Resolution calculation failed. ' + repr(e))
+                    self._finalize_failed(slice_number, kwargs)
+                    continue
+                if cache is not None:
+                    cache.put(key, result)
+                try:
+                    # cpu_time - CPU time of the calculation (the finalize function does not run in its thread)
+                    self._finalize(result[0], slice_number, dict(kwargs, cpu_time=cpu_time), images, pixel_size)
+                except Exception as e:
+                    logging.error('Resolution finalizing failed. ' + repr(e))
+
+    def _finalize_failed(self, slice_number, kwargs):
+        """ The failed calculation is passed to the finalize function as None (no criterion) - nobody waits for it """
+        if self.finalize_thread_func is not None:
+            try:
+                self.finalize_thread_func(None, slice_number, **kwargs)
+            except Exception as e:
+                logging.error('Resolution finalizing failed. ' + repr(e))
+
+    def _calculate(self, images, pixel_size, slice_number, **kwargs):
+        result = self._compute_cached(images, **kwargs)
+        self._finalize(result[0], slice_number, kwargs, images, pixel_size)
+        return result
+
+    def _finalize(self, resolution, slice_number, kwargs, images, pixel_size):
+        # pointer to external function
+        if self.finalize_thread_func is not None:
+            self.finalize_thread_func(resolution, slice_number,  **kwargs)
+        # log (tile geometry of the finalized images)
+        tiles = self.log_tiles(images, pixel_size, kwargs.get('generate_map', False))
+        Logger.create_log_criterion(self, images, tiles, slice_number)
 
-    def _calculate(self, slice_number, **kwargs):
+    def _cache_key(self, images, pixel_size, kwargs, *extra):
+        """
+        Shared criterion cache and key of the calculation (image digests, criterion name, criterion settings digest,
+        pixel size and map/best tile arguments). (None, None) if the cache is disabled or the criterion is detached.
+        """
+        if self.settings is None:
+            return None, None
+        cache = get_criterion_cache()
+        if cache is None:
+            return None, None
+        key = (self.criterion_name, settings_digest(self._get_criterion_settings()), pixel_size,
+               bool(kwargs.get('generate_map', False)), bool(kwargs.get('return_best_tile', False)),
+               tuple(image_digest(image) for image in images)) + extra
+        return cache, key
+
+    def _compute_cached(self, images, **kwargs):
+        """ _compute with the result cache (repeated evaluation of the same images returns the cached result) """
+        cache, key = self._cache_key(images, self.pixel_size, kwargs)
+        if cache is None:
+            return self._compute(images, **kwargs)
+        result = cache.get(key)
+        if result is not None:
+            logging.debug(f'Criterion {self.criterion_name}: cached result used (hits: {cache.hits}, '
+                          f'misses: {cache.misses})')
+            return result
+        result = self._compute(images, **kwargs)
+        cache.put(key, result)
+        return result
+
+    def _compute(self, images, **kwargs):
+        """ Resolution of images (masked regions). Returns (resolution,) [+ map] [+ best tile] """
         # resolution from different masked regions
         logging.info('Resolution calculation started')
         region_resolutions = []
 
         if 'generate_map' in kwargs and kwargs['generate_map'] == True:
             if 'return_best_tile' in kwargs and kwargs['return_best_tile'] == True:
-                res, map, tile = self._tiles_resolution(self.crit_images[0], **kwargs)
+                res, map, tile = self._tiles_resolution(images[0], **kwargs)
             else:
-                res, map = self._tiles_resolution(self.crit_images[0], **kwargs)
+                res, map = self._tiles_resolution(images[0], **kwargs)
 
             region_resolutions.append(res)
         else:
             if 'return_best_tile' in kwargs and kwargs['return_best_tile'] == True:
                 raise ValueError('Best tile is returned only with map generation')
 
-            for i, image in enumerate(self.crit_images):
+            for i, image in enumerate(images):
                 # region resolution
                 region_resolutions.append(self._tiles_resolution(image, **kwargs))
 
         region_resolutions = np.array(region_resolutions)
         region_resolutions = region_resolutions[~np.isnan(region_resolutions)]  # remove NaN
         resolution = float(self.final_regions_resolution(region_resolutions))
-        # pointer to external function
-        if self.finalize_thread_func is not None:
-            self.finalize_thread_func(resolution, slice_number,  **kwargs)
-        # log
-        Logger.create_log_criterion(self, slice_number)
 
         result = (resolution,)
         if 'generate_map' in kwargs and kwargs['generate_map'] == True:
@@ -242,6 +589,21 @@ class Criterion:
         return result
 
     def join_all_threads(self):
-        """ Wait until all resolution calculations are finished """
-        [thread.join() for thread in self._threads]
-        self._threads = []
+        """ Wait until all resolution calculations are finished (and finalized) """
+        wait([task[0] for task in list(self._tasks)])
+        self._finalize_done()
+
+
+def _compute_detached(criterion_name, criterion_settings, shared_images, pixel_size, kwargs, fft_backend):
+    """ Calculation in the worker process. fft_backend - (name, workers). Returns (result, CPU time) """
+    cpu_start = time.thread_time()
+    set_fft_backend(*fft_backend)
+    criterion = Criterion(criterion_name, criterion_settings=criterion_settings)
+    criterion.pixel_size = pixel_size
+    with ExitStack() as stack:
+        images = [stack.enter_context(shared_image.attach()) for shared_image in shared_images]
+        result = criterion._compute(images, **kwargs)
+        # copy arrays (best tile is view of the shared memory) and release all views before detaching
+        result = tuple(np.array(x) if isinstance(x, np.ndarray) else x for x in result)
+        del images, criterion
+    return result, time.thread_time() - cpu_start
@@ -1,9 +1,17 @@
+import functools
 import logging
+import math
 
+from scipy import fft as scipy_fft
 from scipy.ndimage import gaussian_filter
 import numpy as np
 
-from fibsem_maestro.FRC.frc import frc
+from fibsem_maestro.FRC.frc import frc, frc_batch
+from fibsem_maestro.tools.fft_backend import get_fft_backend
+
+GAUSS_TRUNCATE = 6  # gaussian kernel radius (in sigmas)
+FFT_COST = 1.  # cost of the FFT filtering (per padded pixel and log2 of pixel count) relative to the spatial filter
+               # (per pixel and kernel tap). The FFT path is used if it is cheaper
 
 
 def gauss_filter(x, px_size, detail):
@@ -16,9 +24,138 @@ def gauss_filter(x, px_size, detail):
     :return: The filtered array.
 
     """
+    sigma = gauss_sigma(px_size, detail)
+    return gaussian_filter(x.astype(np.float32), sigma, mode='nearest', truncate=GAUSS_TRUNCATE)
+
+
+def gauss_filter_batch(tiles, px_size, detail, filtered_ndim=2):
+    """
+    Applies a Gaussian filter to each tile of the stack (..., h, w). Tiles are filtered independently
+    (the same result as gauss_filter applied to each tile).
+
+    :param filtered_ndim: Number of the last axes that are filtered (2 - tiles, 1 - lines)
+    """
+    sigma = gauss_sigma(px_size, detail)
+    sigmas = [0] * (np.ndim(tiles) - filtered_ndim) + [sigma] * filtered_ndim  # no filtering across tiles
+    return gaussian_filter(tiles.astype(np.float32), sigmas, mode='nearest', truncate=GAUSS_TRUNCATE)
+
+
+def gauss_sigma(px_size, detail):
+    """ Sigma (px) of the gaussian filter that removes details smaller than detail (m) """
     px = detail / px_size
-    sigma = 1 / (2 * np.pi * (1 / px))
-    return gaussian_filter(x.astype(np.float32), sigma, mode='nearest', truncate=6)
+    return 1 / (2 * np.pi * (1 / px))
+
+
+def _gauss_radius(sigma):
+    """ Kernel radius of gaussian_filter """
+    return int(GAUSS_TRUNCATE * float(sigma) + 0.5)
+
+
+def _gauss_transfer_1d(sigma, freq):
+    """ Frequency response of the sampled (truncated, normalized) kernel used by gaussian_filter """
+    radius = _gauss_radius(sigma)
+    x = np.arange(1, radius + 1)
+    weights = np.exp(-0.5 * x ** 2 / sigma ** 2)
+    norm = 1 + 2 * np.sum(weights)
+    return (1 + 2 * np.cos(2 * np.pi * freq[:, np.newaxis] * x[np.newaxis, :]) @ weights) / norm
+
+
+@functools.lru_cache(maxsize=32)
+def dog_transfer(shape, sigma_low, sigma_high):
+    """
+    Transfer function of the difference of gaussians (gauss(sigma_high) - gauss(sigma_low)) in the rfftn
+    half-space of the array of shape. Cached (float32).
+    """
+    freqs = [np.fft.fftfreq(n) for n in shape[:-1]] + [np.fft.rfftfreq(shape[-1])]
+    transfer_high = np.ones([len(f) for f in freqs])
+    transfer_low = np.ones([len(f) for f in freqs])
+    for axis, f in enumerate(freqs):  # the kernel is separable
+        axis_shape = [-1 if i == axis else 1 for i in range(len(shape))]
+        transfer_high = transfer_high * _gauss_transfer_1d(sigma_high, f).reshape(axis_shape)
+        transfer_low = transfer_low * _gauss_transfer_1d(sigma_low, f).reshape(axis_shape)
+    transfer = (transfer_high - transfer_low).astype(np.float32)
+    transfer.setflags(write=False)
+    return transfer
+
+
+def _fft_dog_faster(shape, sigmas):
+    """ Compare the estimated cost of spatial and FFT filtering of the array shape by both sigmas """
+    radius = _gauss_radius(max(sigmas))
+    pixels = math.prod(shape)
+    padded = math.prod(n + 2 * radius for n in shape)
+    spatial_cost = pixels * len(shape) * sum(2 * _gauss_radius(s) + 1 for s in sigmas)
+    fft_cost = FFT_COST * padded * math.log2(max(padded, 2))
+    return fft_cost < spatial_cost
+
+
+def dog_filter_fft(x, sigma_low, sigma_high, filtered_axes):
+    """
+    gaussian_filter(x, sigma_high) - gaussian_filter(x, sigma_low) calculated by one FFT.
+    The borders are padded by edge values (like mode='nearest') by kernel radius, so the circular convolution
+    does not mix the opposite borders.
+    """
+    radius = _gauss_radius(max(sigma_low, sigma_high))
+    pad = [(radius, radius) if axis in filtered_axes else (0, 0) for axis in range(np.ndim(x))]
+    padded = np.pad(x.astype(np.float32, copy=False), pad, mode='edge')
+    fft_shape = tuple(scipy_fft.next_fast_len(padded.shape[axis], real=True) for axis in filtered_axes)
+    fft = get_fft_backend()
+    spectrum = fft.rfftn(padded, s=fft_shape, axes=filtered_axes)
+    spectrum *= dog_transfer(fft_shape, sigma_low, sigma_high)
+    result = fft.irfftn(spectrum, s=fft_shape, axes=filtered_axes)
+    crop = tuple(slice(radius, radius + x.shape[axis]) if axis in filtered_axes else slice(None)
+                 for axis in range(np.ndim(x)))
+    return result[crop]
+
+
+def dog_filter(x, px_size, detail, filtered_ndim=None):
+    """
+    Difference of gaussians (band-passed image): gauss_filter(detail[1]) - gauss_filter(detail[0]).
+    Spatial or FFT implementation is selected by estimated cost (large sigma and image favour FFT).
+
+    :param filtered_ndim: Only the last filtered_ndim axes are filtered (stack of tiles or lines), all if None.
+    """
+    sigmas = (gauss_sigma(px_size, detail[0]), gauss_sigma(px_size, detail[1]))
+    if filtered_ndim is None:
+        filtered_ndim = np.ndim(x)
+    filtered_axes = tuple(range(np.ndim(x) - filtered_ndim, np.ndim(x)))
+    if _fft_dog_faster(tuple(np.shape(x)[axis] for axis in filtered_axes), sigmas):
+        return dog_filter_fft(np.asarray(x), sigmas[0], sigmas[1], filtered_axes)
+    if filtered_ndim < np.ndim(x):
+        return (gauss_filter_batch(x, px_size, detail[1], filtered_ndim)
+                - gauss_filter_batch(x, px_size, detail[0], filtered_ndim))
+    return gauss_filter(x, px_size, detail[1]) - gauss_filter(x, px_size, detail[0])
+
+
+def window_grid(length, window, step):
+    """ Start positions of the windows (window px, shifted by step px) that fit into the axis of length """
+    return np.arange(0, length - window + 1, step)
+
+
+def _window_sums_axis(x, window, step, axis):
+    """
+    Sums of x along the axis in the windows on the grid (integral image evaluated only on the window edges).
+    The blocks between edges are summed by reduceat and accumulated - no full-size cumulative sum is stored.
+    """
+    length = x.shape[axis]
+    starts = window_grid(length, window, step)
+    edges = np.unique(np.concatenate([starts, starts + window]))
+    blocks = np.add.reduceat(x, edges[edges < length], axis=axis, dtype=np.float64)
+    if edges[-1] < length:
+        blocks = np.delete(blocks, -1, axis=axis)  # block from the last edge to the end of the axis
+    zero_shape = list(blocks.shape)
+    zero_shape[axis] = 1
+    integral = np.concatenate([np.zeros(zero_shape), np.cumsum(blocks, axis=axis)], axis=axis)
+    return (np.take(integral, np.searchsorted(edges, starts + window), axis=axis)
+            - np.take(integral, np.searchsorted(edges, starts), axis=axis))
+
+
+def window_mean(x, window, step):
+    """
+    Mean of each window x[i * step: i * step + window, j * step: j * step + window] of the image (last 2 axes).
+    Windows can overlap (step < window). Returns array (number of windows in axis 0, number of windows in axis 1)
+    """
+    sums = _window_sums_axis(_window_sums_axis(x, window, step, -2), window, step, -1)
+    return sums / window ** 2
 
 
 def bandpass_criterion(img, settings) -> float:
@@ -28,10 +165,9 @@ def bandpass_criterion(img, settings) -> float:
     :param img: The input image.
     :return: Criterion.
     """
-    img_low = gauss_filter(img, img.pixel_size, settings['detail'][0])
-    img_high = gauss_filter(img, img.pixel_size, settings['detail'][1])
+    band = dog_filter(img, img.pixel_size, settings['detail'])
 
-    result = np.mean(abs(img_high - img_low))  # mean of absolute images
+    result = np.mean(abs(band))  # mean of absolute images
     return result
 
 
@@ -42,13 +178,102 @@ def bandpass_var_criterion(img, settings) -> float:
     :param img: The input image.
     :return: Criterion.
     """
-    img_low = gauss_filter(img, img.pixel_size, settings['detail'][0])
-    img_high = gauss_filter(img, img.pixel_size, settings['detail'][1])
+    band = dog_filter(img, img.pixel_size, settings['detail'])
 
-    result = np.var(img_high - img_low)
+    result = np.var(band)
     return result
 
 
+def bandpass_criterion_batch(tiles, pixel_size, settings):
+    """ bandpass_criterion of each tile in the stack (..., h, w). Returns array (...) """
+    band = dog_filter(tiles, pixel_size, settings['detail'], filtered_ndim=2)
+    return np.mean(abs(band), axis=(-2, -1))
+
+
+def bandpass_criterion_lines(lines, pixel_size, settings):
+    """ bandpass_criterion of each line (row) of the 2D array. Returns array (number of lines) """
+    band = dog_filter(lines, pixel_size, settings['detail'], filtered_ndim=1)
+    return np.mean(abs(band), axis=-1)
+
+
+def bandpass_criterion_map(img, pixel_size, settings, window, step):
+    """
+    bandpass_criterion of each window of the image (see window_mean). The image is filtered at once (windows are
+    not filtered separately - no window border effects) and the window means are calculated by integral image.
+    Returns array (windows in axis 0, windows in axis 1)
+    """
+    band = dog_filter(np.asarray(img), pixel_size, settings['detail'])
+    np.abs(band, out=band)
+    return window_mean(band, window, step)
+
+
+def bandpass_var_criterion_batch(tiles, pixel_size, settings):
+    """ bandpass_var_criterion of each tile in the stack (..., h, w). Returns array (...) """
+    band = dog_filter(tiles, pixel_size, settings['detail'], filtered_ndim=2)
+    return np.var(band, axis=(-2, -1))
+
+
+def bandpass_var_criterion_lines(lines, pixel_size, settings):
+    """ bandpass_var_criterion of each line (row) of the 2D array. Returns array (number of lines) """
+    band = dog_filter(lines, pixel_size, settings['detail'], filtered_ndim=1)
+    return np.var(band, axis=-1)
+
+
+def bandpass_var_criterion_map(img, pixel_size, settings, window, step):
+    """ bandpass_var_criterion of each window of the image (var = E[x^2] - E[x]^2), see bandpass_criterion_map """
+    band = dog_filter(np.asarray(img), pixel_size, settings['detail'])
+    mean = window_mean(band, window, step)
+    np.square(band, out=band)
+    return np.maximum(window_mean(band, window, step) - mean ** 2, 0)
+
+
+def _detail_key(detail):
+    """ Hashable detail (low, high) for band caches """
+    return float(detail[0]), float(detail[1])
+
+
+@functools.lru_cache(maxsize=64)
+def fft_band_1d(length, pixel_size, detail):
+    """
+    Indices of the detail band in the rfft of the line (positive frequencies between 1/detail[0] and 1/detail[1]).
+    Cached - it depends only on the line length, pixel size and detail.
+    """
+    freq = np.fft.rfftfreq(length, pixel_size)
+    band = (freq > 0) & (freq < 1 / detail[1]) & (freq > 1 / detail[0])
+    if length % 2 == 0:
+        band[-1] = False  # Nyquist frequency is negative in fftfreq (it was never in the band)
+    band_i = np.flatnonzero(band)
+    band_i.setflags(write=False)
+    return band_i
+
+
+@functools.lru_cache(maxsize=64)
+def fft_band_2d(shape, pixel_size, detail):
+    """
+    Detail band of the 2D spectrum in the rfft2 half-plane.
+
+    :return: flat indices of the band in the rfft2 output and weights of these frequencies (2 if the frequency
+    stands for itself and its conjugate-symmetric counterpart, 1 for the 0 and Nyquist columns). Cached.
+    """
+    freq1 = np.fft.fftfreq(shape[0], pixel_size)  # get x freq axis
+    freq2 = np.fft.rfftfreq(shape[1], pixel_size)  # get y freq axis (half-plane)
+    freq = np.sqrt(freq1[:, np.newaxis] ** 2 + freq2[np.newaxis, :] ** 2)  # make freq matrix
+
+    high_frequency = 1 / detail[1]  # highest detail frequency
+    low_frequency = 1 / detail[0]  # lowest detail frequency
+    band = (freq > 0) & (freq <= high_frequency) & (freq >= low_frequency)
+
+    weights = np.full(freq.shape, 2.)
+    weights[:, 0] = 1
+    if shape[1] % 2 == 0:
+        weights[:, -1] = 1
+    band_i = np.flatnonzero(band)
+    band_weights = weights.ravel()[band_i]
+    band_i.setflags(write=False)
+    band_weights.setflags(write=False)
+    return band_i, band_weights
+
+
 def fft_criterion(img, settings):
     """
     :param img: The image data. It can be either a 1-dimensional array representing an image line
@@ -60,41 +285,21 @@ def fft_criterion(img, settings):
     the specified range and returns the sum of the amplitudes of the remaining frequencies.
     """
 
-    def fft_criterion1d():
-        img0 = img - np.mean(img)  # remove 0 frequency
-        fft_line = np.fft.fft(img0)  # fft
-
-        freq = np.fft.fftfreq(len(img), img.pixel_size)  # get freq axis
-        fft_line = fft_line[freq > 0]  # remove negative frequencies
-        freq = freq[freq > 0]  # remove negative frequencies from freq axis
+    # 0 frequency is never in the band - the mean does not need to be removed
+    detail = _detail_key(settings['detail'])
 
-        # filter frequencies
-        band_i = np.where((freq < 1 / settings['detail'][1]) & (freq > 1 / settings['detail'][0]))[0]
+    def fft_criterion1d():
+        fft_line = get_fft_backend().rfft(np.asarray(img))  # fft (positive frequencies)
+        band_i = fft_band_1d(len(img), img.pixel_size, detail)
         # sum of amplitudes of all filtered frequencies
         result = np.sum(abs(fft_line[band_i]))
         return result
 
     def fft_criterion_2d():
-        img0 = img - np.mean(img)  # remove 0 frequency
-        fft_img = np.fft.fft2(img0)  # fft
-
-        freq1 = np.fft.fftfreq(fft_img.shape[0], img.pixel_size)  # get x freq axis
-        freq2 = np.fft.fftfreq(fft_img.shape[1], img.pixel_size)  # get y freq axis
-
-        freq1 = np.repeat(freq1[:, np.newaxis], freq2.shape[0], axis=1)
-        freq2 = np.repeat(freq2[:, np.newaxis], freq1.shape[0], axis=1).T
-        freq = np.sqrt(freq1 ** 2 + freq2 ** 2)  # make freq matrix
-
-        high_frequency = 1 / settings['detail'][1]  # highest detail frequency
-        low_frequency = 1 / settings['detail'][0] # lowest detail frequency
-
-        # make freq filter
-        freq[freq > high_frequency] = 0
-        freq[freq < low_frequency] = 0
-        freq[freq > 0] = 1
-
-        fft_img *= freq  # filter freq
-        result = np.sum(abs(fft_img))
+        fft_img = get_fft_backend().rfft2(np.asarray(img))  # half-plane fft (the other half is conjugate-symmetric)
+        band_i, band_weights = fft_band_2d(img.shape, img.pixel_size, detail)
+        # sum of amplitudes of filtered frequencies of the full spectrum
+        result = np.dot(abs(fft_img.ravel()[band_i]), band_weights)
         return result
 
     if np.ndim(img) == 1:
@@ -105,10 +310,30 @@ def fft_criterion(img, settings):
         raise NotImplementedError('Only 1D and 2D images are currently supported for focus criterion.')
 
 
+def fft_criterion_batch(tiles, pixel_size, settings):
+    """ fft_criterion of each tile in the stack (..., h, w). Returns array (...) """
+    fft_tiles = get_fft_backend().rfft2(tiles, axes=(-2, -1))  # 0 frequency is not in the band (no mean removal)
+    band_i, band_weights = fft_band_2d(tuple(tiles.shape[-2:]), pixel_size, _detail_key(settings['detail']))
+    fft_tiles = fft_tiles.reshape(fft_tiles.shape[:-2] + (-1,))
+    return abs(fft_tiles[..., band_i]) @ band_weights
+
+
+def fft_criterion_lines(lines, pixel_size, settings):
+    """ fft_criterion of each line (row) of the 2D array. Returns array (number of lines) """
+    fft_lines = get_fft_backend().rfft(lines, axis=-1)  # fft (positive frequencies)
+    band_i = fft_band_1d(lines.shape[-1], pixel_size, _detail_key(settings['detail']))
+    return np.sum(abs(fft_lines[..., band_i]), axis=-1)
+
+
 def frc_criterion(img, settings):
     try:
         res = frc(img, img.pixel_size)
     except Exception as e:
         logging.warning("FRC error on current tile. " + repr(e))
         return np.nan
-    return res
\ No newline at end of file
+    return res
+
+
+def frc_criterion_batch(tiles, pixel_size, settings):
+    """ frc_criterion of each tile in the stack (..., h, w). Returns array (...), NaN if FRC fails on the tile """
+    return frc_batch(tiles, pixel_size)
@@ -0,0 +1,124 @@
+import hashlib
+import json
+import logging
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from fibsem_maestro.settings import Settings, SettingsView
+
+try:
+    import xxhash  # optional - faster image digest
+except ImportError:
+    xxhash = None
+
+
+def image_digest(image):
+    """ Fast digest of image data (xxh3 if xxhash is installed, blake2b otherwise). Shape and dtype included """
+    array = np.ascontiguousarray(image)
+    hasher = xxhash.xxh3_128() if xxhash is not None else hashlib.blake2b(digest_size=16)
+    hasher.update(f'{array.shape}{array.dtype.str}'.encode())
+    hasher.update(memoryview(array).cast('B'))
+    return hasher.digest()
+
+
+def settings_digest(criterion_settings):
+    """ Digest of criterion settings (dict or SettingsView) """
+    if isinstance(criterion_settings, SettingsView):
+        criterion_settings = criterion_settings.to_dict()
+    text = json.dumps(criterion_settings, sort_keys=True, default=str)
+    return hashlib.blake2b(text.encode(), digest_size=16).digest()
+
+
+def _result_nbytes(result):
+    return sum(x.nbytes for x in result if isinstance(x, np.ndarray)) + 64 * len(result)
+
+
+def _copy_result(result):
+    """ Arrays of the result are copied (cached result is not modified by the caller, best tile view is released) """
+    return tuple(np.array(x) if isinstance(x, np.ndarray) else x for x in result)
+
+
+class CriterionCache:
+    """
+    LRU cache of criterion results. Key - image digests, criterion name, criterion settings digest and the
+    calculation arguments. The least recently used results are removed if the size limit is exceeded.
+    """
+    def __init__(self, max_mb):
+        self.max_mb = max_mb
+        self.hits = 0
+        self.misses = 0
+        self._size = 0  # bytes
+        self._results = OrderedDict()  # key: (result, size)
+        self._lock = threading.Lock()
+
+    @property
+    def size_mb(self):
+        return self._size / 2 ** 20
+
+    def __len__(self):
+        return len(self._results)
+
+    def get(self, key):
+        """ Cached result (copy) or None """
+        with self._lock:
+            item = self._results.get(key)
+            if item is None:
+                self.misses += 1
+                return None
+            self._results.move_to_end(key)
+            self.hits += 1
+        return _copy_result(item[0])
+
+    def put(self, key, result):
+        result = _copy_result(result)
+        size = _result_nbytes(result)
+        with self._lock:
+            if key in self._results:
+                self._size -= self._results.pop(key)[1]
+            if size > self.max_mb * 2 ** 20:
+                return
+            self._results[key] = (result, size)
+            self._size += size
+            self._evict()
+
+    def resize(self, max_mb):
+        with self._lock:
+            self.max_mb = max_mb
+            self._evict()
+
+    def _evict(self):
+        while self._size > self.max_mb * 2 ** 20 and len(self._results) > 0:
+            _, (_, size) = self._results.popitem(last=False)
+            self._size -= size
+
+    def clear(self):
+        with self._lock:
+            self._results.clear()
+            self._size = 0
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'entries': len(self), 'size_mb': self.size_mb,
+                'max_mb': self.max_mb}
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_criterion_cache():
+    """ Cache shared by all criteria (general.criterion_cache_mb). None if the cache is disabled (0) """
+    global _cache
+    max_mb = Settings()('general', 'criterion_cache_mb') or 0
+    if max_mb <= 0:
+        return None
+    with _cache_lock:
+        if _cache is None:
+            _cache = CriterionCache(max_mb)
+            logging.info(f'Criterion cache: {max_mb} MB')
+        elif _cache.max_mb != max_mb:
+            _cache.resize(max_mb)
+        return _cache
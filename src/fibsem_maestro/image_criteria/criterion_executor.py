@@ -0,0 +1,111 @@
+import logging
+import threading
+from concurrent.futures import Executor, Future, ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import contextmanager
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from fibsem_maestro.settings import Settings
+from fibsem_maestro.tools.support import Image
+
+EXECUTOR_TYPES = ('inline', 'thread', 'process')
+
+
+class InlineExecutor(Executor):
+    """ Executor that runs the task immediately in the caller thread (debugging, single core) """
+    def submit(self, fn, /, *args, **kwargs):
+        future = Future()
+        try:
+            future.set_result(fn(*args, **kwargs))
+        except BaseException as e:
+            future.set_exception(e)
+        return future
+
+
+def create_executor(executor_type, workers):
+    """ Create executor by name (inline, thread, process) with fixed number of workers """
+    workers = max(1, int(workers))
+    if executor_type == 'inline':
+        return InlineExecutor()
+    if executor_type == 'thread':
+        return ThreadPoolExecutor(max_workers=workers, thread_name_prefix='criterion')
+    if executor_type == 'process':
+        return ProcessPoolExecutor(max_workers=workers)
+    raise ValueError(f'Unknown criterion executor {executor_type}. Possible values: {", ".join(EXECUTOR_TYPES)}')
+
+
+_executor = None
+_executor_config = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    """
+    Executor shared by all criteria (general.criterion_executor, general.criterion_workers).
+    The executor is recreated if the settings were changed - the tasks submitted to the old one are finished.
+    """
+    global _executor, _executor_config
+    settings = Settings()
+    executor_type = settings('general', 'criterion_executor') or 'thread'
+    workers = settings('general', 'criterion_workers') or 2
+    with _executor_lock:
+        if _executor is None or _executor_config != (executor_type, workers):
+            if _executor is not None:
+                _executor.shutdown(wait=False)
+            _executor = create_executor(executor_type, workers)
+            _executor_config = (executor_type, workers)
+            logging.info(f'Criterion executor: {executor_type} ({workers} workers)')
+        return _executor, executor_type
+
+
+def shutdown_executor():
+    """ Finish all tasks and stop the shared executor """
+    global _executor, _executor_config
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown(wait=True)
+        _executor = None
+        _executor_config = None
+
+
+class SharedImage:
+    """
+    Image copied to the shared memory block. Only the block name, shape, dtype and pixel size are pickled, so the
+    image is passed to the worker process without serialization of the data.
+    The block is owned (and unlinked) by the process that created it.
+    """
+    def __init__(self, image):
+        array = np.asarray(image)
+        self.shape = array.shape
+        self.dtype = array.dtype
+        self.pixel_size = getattr(image, 'pixel_size', None)
+        self._shm = shared_memory.SharedMemory(create=True, size=max(1, array.nbytes))
+        np.ndarray(self.shape, dtype=self.dtype, buffer=self._shm.buf)[...] = array
+        self.name = self._shm.name
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_shm'] = None
+        return state
+
+    @contextmanager
+    def attach(self):
+        """ Image view of the shared block (valid only inside the with block) """
+        shm = shared_memory.SharedMemory(name=self.name)
+        try:
+            array = np.ndarray(self.shape, dtype=self.dtype, buffer=shm.buf)
+            yield Image(array, self.pixel_size)
+            del array
+        finally:
+            try:
+                shm.close()
+            except BufferError:  # view is still referenced (e.g. by exception traceback), closed on process exit
+                logging.debug(f'Shared image {self.name} is still in use.')
+
+    def release(self):
+        """ Free the shared block (owner only) """
+        if self._shm is not None:
+            self._shm.close()
+            self._shm.unlink()
+            self._shm = None
@@ -6,8 +6,10 @@ import yaml
 from matplotlib import pyplot as plt
 from matplotlib.patches import Rectangle
 
+from fibsem_maestro.autofunctions.af_history import AfHistory
 from fibsem_maestro.microscope_control.microscope import GlobalMicroscope
-from fibsem_maestro.tools.support import fold_filename, ScanningArea
+from fibsem_maestro.microscope_control.snapshot import LOG_FIELDS
+from fibsem_maestro.tools.support import fold_filename, Point, ScanningArea
 from fibsem_maestro.settings import Settings
 
 settings = Settings()
@@ -64,33 +66,30 @@ class FibLog(BasicLogger):
 
 class CriterionLog(BasicLogger):
     image_index = 1  # index that is incremented in each figure save (prevention of file rewrite)
-    def __init__(self, criterion, slice_number, log_dir):
+    def __init__(self, criterion, slice_number, log_dir, images, tiles):
+        """ images - evaluated images, tiles - evaluated tiles of each image (see Criterion.log_tiles) """
         super().__init__(slice_number, log_dir)
         self.criterion = criterion
 
-        for i, image in enumerate(self.criterion.crit_images):
-            self.save_log_subimage(image, i)  # Input image with drew tiles
+        for i, (image, image_tiles) in enumerate(zip(images, tiles)):
+            self.save_log_subimage(image, image_tiles, i)  # Input image with drew tiles
 
-    def tile_log_image(self, img):
-        tile_size = settings('criterion_calculation', self.criterion.criterion_name, 'tile_size')
+    def tile_log_image(self, img, tiles):
         """ Create image with inpaint rectangles that represent tiling"""
         fig, ax = showimg(img)
-        # if tile size = 0, not apply tilling
-        if tile_size > 0:
-            tiles = self.criterion._generate_image_fractions(self.criterion.img_with_border, return_coordinates=True)
-            # Create a Rectangle patch for each tile and add it to the axes
-            for tile in tiles:
-                rect = Rectangle((tile[0]+self.criterion.border_y, tile[1]+self.criterion.border_x), tile[2], tile[3],
-                                         linewidth=1, edgecolor='r',
-                                         facecolor='none')
-                ax.add_patch(rect)
+        # Create a Rectangle patch for each tile and add it to the axes
+        for tile in tiles:
+            rect = Rectangle((tile[0], tile[1]), tile[2], tile[3],
+                             linewidth=1, edgecolor='r',
+                             facecolor='none')
+            ax.add_patch(rect)
         return fig
 
-    def save_log_subimage(self, image, index):
+    def save_log_subimage(self, image, tiles, index):
         """ Input image with drew tiles """
         # save log image only if it is not line
         if len(image.shape) == 2 and min(image.shape) > 1:
-            fig = self.tile_log_image(image)
+            fig = self.tile_log_image(image, tiles)
             try:
                 fig.savefig(os.path.join(self.filename,f'criterion_{self.criterion.criterion_name}_image_{index}_({CriterionLog.image_index}).png'))
                 plt.close(fig)
@@ -170,11 +169,34 @@ class AutofocusLog(BasicLogger):
         criterion_values = list(self.af.criterion_values.values())
         maxi = np.argmax(criterion_values)  # maximal value of criterion
 
+        if isinstance(swept_values[0], Point):  # 2D sweeping (criterion map)
+            return self.surface_image(swept_values, criterion_values)
+
         fig = plt.figure()
         plt.plot(swept_values, criterion_values, 'r.')
 
         plt.axvline(x=swept_values[int(np.ceil(len(swept_values) / 2))], color='lightblue')  # make horizontal line in the middle (last value)
         plt.axvline(x=swept_values[maxi], color='b')  # make horizontal line on the position of maximal value
+        fit_curve = getattr(self.af, 'fit_curve', None)
+        if fit_curve is not None:  # fitted model and its peak
+            plt.plot(fit_curve[0], fit_curve[1], 'g-')
+            plt.axvline(x=self.af.final_af_value, color='g')
+
+        plt.tight_layout()
+        plt.title('Focus criterion')
+        return fig
+
+    def surface_image(self, swept_values, criterion_values):
+        """ Criterion of 2D swept values (colour), the best swept value (blue) and the final value (green) """
+        xy = np.array([value.to_array() for value in swept_values])
+        maxi = np.argmax(criterion_values)
+
+        fig = plt.figure()
+        plt.scatter(xy[:, 0], xy[:, 1], c=criterion_values, cmap='viridis')
+        plt.colorbar()
+        plt.plot(xy[maxi, 0], xy[maxi, 1], 'bx')
+        if isinstance(self.af.final_af_value, Point):
+            plt.plot(self.af.final_af_value.x, self.af.final_af_value.y, 'g+')
 
         plt.tight_layout()
         plt.title('Focus criterion')
@@ -294,37 +316,33 @@ class Logger:
 
 
     @staticmethod
-    def log_microscope_settings():
-        Logger.log_params['electron_wd'] = Logger._electron.working_distance
-        Logger.log_params['electron_beam_shift_x'] = Logger._electron.beam_shift_x
-        Logger.log_params['electron_beam_shift_y'] = Logger._electron.beam_shift_y
-        Logger.log_params['electron_stigmator_x'] = Logger._electron.stigmator_x
-        Logger.log_params['electron_stigmator_y'] = Logger._electron.stigmator_y
-        Logger.log_params['electron_contrast'] = Logger._electron.detector_contrast
-        Logger.log_params['electron_brightness'] = Logger._electron.detector_brightness
-        position = Logger._microscope.position
-        Logger.log_params['stage_x'] = position.x
-        Logger.log_params['stage_y'] = position.y
-        Logger.log_params['stage_z'] = position.z
-        Logger.log_params['ion_beam_shift_x'] = Logger._ion.beam_shift_x
-        Logger.log_params['ion_beam_shift_y'] = Logger._ion.beam_shift_y
+    def log_microscope_settings(snapshot=None):
+        """ Log microscope settings from snapshot (MicroscopeSnapshot). If None, the snapshot is read """
+        if snapshot is None or not all(field in snapshot for field in LOG_FIELDS):
+            snapshot = Logger._microscope.snapshot(LOG_FIELDS)
+        Logger.log_params.update(snapshot.log_params())
 
     @staticmethod
-    def save_log(slice_number=None):
-        """Save yaml dict log to file"""
+    def save_log(slice_number=None, log_params=None):
+        """Save yaml dict log to file (log_params - copy of Logger.log_params, default is actual Logger.log_params)"""
         log_dir = settings('dirs', 'log')
         if slice_number is None:
             filename = Logger.yaml_log_filaname
         else:
             filename = fold_filename(log_dir, slice_number, 'log_dict.yaml')
 
+        if log_params is None:
+            log_params = Logger.log_params
+
         with open(filename, 'w') as f:
-            yaml.dump(Logger.log_params, f, default_flow_style=False)
+            yaml.dump(log_params, f, default_flow_style=False)
 
     @staticmethod
     def create_log_af(af):
         log_dir = settings('dirs', 'log')
         Logger.log_af = AutofocusLog(af, Logger._slice_number, log_dir)
+        if len(af.criterion_values) > 0:  # af finished successfully
+            AfHistory().record(af, Logger._slice_number)
 
     @staticmethod
     def create_log_template_matching(tm):
@@ -332,12 +350,13 @@ class Logger:
         Logger.log_template_matching = TemplateMatchingLog(tm, Logger._slice_number, log_dir)
 
     @staticmethod
-    def create_log_criterion(crit, slice_number=None):
+    def create_log_criterion(crit, images, tiles, slice_number=None):
+        """ images - evaluated images, tiles - evaluated tiles of each image (see Criterion.log_tiles) """
         if slice_number is None:
             slice_number = Logger._slice_number
 
         log_dir = settings('dirs', 'log')
-        Logger.log_criteria.append(CriterionLog(crit, slice_number, log_dir))
+        Logger.log_criteria.append(CriterionLog(crit, slice_number, log_dir, images, tiles))
 
     @staticmethod
     def create_log_fib(fib):
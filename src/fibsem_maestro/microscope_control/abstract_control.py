@@ -1,8 +1,29 @@
+import copy
+import logging
 import math
 from abc import ABC, abstractmethod
+from contextlib import nullcontext
+from fibsem_maestro.microscope_control.snapshot import MicroscopeSnapshot
 from fibsem_maestro.tools.support import StagePosition, ScanningArea
 
-class BeamControl(ABC):
+
+class WriteNotifier:
+    """
+    Notify write handlers about setting of public attributes (properties). It is used for invalidation of cached
+    microscope state (SettingsState).
+    """
+    def __setattr__(self, name, value):
+        super().__setattr__(name, value)
+        if not name.startswith('_'):
+            for handler in self.__dict__.get('_write_handlers', ()):
+                handler(name)
+
+    def add_write_handler(self, handler):
+        """ Handler is called with the attribute name on each attribute setting """
+        self.__dict__.setdefault('_write_handlers', []).append(handler)
+
+
+class BeamControl(WriteNotifier, ABC):
     """
     This is an abstract base class providing an interface for controlling a beam (can be electron or ion) in a microscope.
 
@@ -22,8 +43,13 @@ class BeamControl(ABC):
         resolution: Getter and setter for the resolution of the image.
         hfw: Getter and setter for the horizontal field width.
         pixel_size: Getter for the pixel size of the image from the microscope.
+        batch: Context manager for batching of the property reads and writes (no batching by default).
     """
 
+    def batch(self):
+        """ Reads inside the batch can be cached and writes deferred to the end of batch """
+        return nullcontext(self)
+
     @property
     @abstractmethod
     def working_distance(self):
@@ -278,7 +304,7 @@ class BeamControl(ABC):
     def limits(self, var):
         pass
 
-class MicroscopeControl(ABC):
+class MicroscopeControl(WriteNotifier, ABC):
     """
     This is an abstract base class designated for controlling a microscope.
 
@@ -292,8 +318,44 @@ class MicroscopeControl(ABC):
 
     Methods:
         position - Getter and setter for the position of the microscope stage.
+        batch - Context manager for batching of the stage and beams reads and writes (no batching by default).
+        snapshot - Read selected settings in one pass.
     """
 
+    def batch(self):
+        """ Reads inside the batch can be cached and writes deferred to the end of batch """
+        return nullcontext(self)
+
+    def invalidate_view(self):
+        """ The active view/device is not known (changed outside this class) """
+        pass
+
+    def snapshot(self, fields):
+        """
+        Read settings in one pass (one batch).
+
+        :param fields: List of setting names. Beam settings are prefixed by beam name (e.g. electron_beam.stigmator).
+        :return: MicroscopeSnapshot. The value is None if it cannot be read.
+        """
+        values = {}
+        with self.batch():
+            for setting in fields:
+                try:
+                    if '.' in setting:
+                        # inner attribute -> beam setting
+                        [beam, setting_attribute] = setting.split('.')
+                        value = getattr(getattr(self, beam), setting_attribute)
+                    else:
+                        # simple attribute
+                        value = getattr(self, setting)
+                    value = copy.deepcopy(value)  # snapshot must not be changed by the value owner
+                except Exception as e:
+                    logging.error(f'The value {setting} cannot be read from microscope. Setting to None.')
+                    logging.error(repr(e))
+                    value = None
+                values[setting] = value
+        return MicroscopeSnapshot(values)
+
     @property
     @abstractmethod
     def position(self):
@@ -1,5 +1,7 @@
 import logging
+import threading
 import time
+from contextlib import contextmanager
 
 from fibsem_maestro.microscope_control.abstract_control import MicroscopeControl, StagePosition, BeamControl
 from fibsem_maestro.tools.support import Point, Image, ScanningArea
@@ -20,17 +22,137 @@ try:
 except ImportError:
     from fibsem_maestro.microscope_control.virtual_control import VirtualMicroscope
     from fibsem_maestro.microscope_control.virtual_control import StagePosition as StagePositionAS, \
-        ImagingDevice, BeamType
+        ImagingDevice, BeamType, ImageFileFormat, PatternScanDirection, Point as PointAS, GrabFrameSettings, \
+        AdornedImage
 
     logging.warning("AS library could not be imported. Virtual mode used.")
     virtual_mode = True
 
-class AutoscriptMicroscopeControl(MicroscopeControl):
-    def __init__(self, ip_address="localhost"):
+def _set_value(as_object):
+    """ Setter of AS value (as_object.value = value) """
+    def setter(value):
+        as_object.value = value
+    return setter
+
+
+def _same_value(a, b):
+    """ Compare values read from AS (AS Point is compared by coordinates) """
+    if hasattr(a, 'x') and hasattr(a, 'y') and hasattr(b, 'x') and hasattr(b, 'y'):
+        return a.x == b.x and a.y == b.y
+    return a == b
+
+
+class RpcCache:
+    """
+    Read cache and write batching of AS calls.
+
+    Inside the batch (see batch()), the values read from the microscope are cached and the writes are deferred and
+    coalesced - only the last value of each property is sent and the values equal to the known microscope values are
+    not sent at all. The deferred writes are sent before any action (grab frame, blank...) and on the end of the batch.
+    The batch is applied only to the thread that opened it. Outside the batch, each access is one AS call.
+    """
+    def _init_rpc_cache(self):
+        self._cache = {}  # key -> value read from (or written to) microscope
+        self._pending = {}  # key -> (setter, value) of deferred writes
+        self._batch_depth = 0
+        self._batch_thread = None
+        self._rpc_count = 0
+        self._cache_hits = 0
+
+    @property
+    def rpc_count(self):
+        """ Number of AS calls """
+        return self._rpc_count
+
+    @property
+    def cache_hits(self):
+        """ Number of AS calls saved by cache and write coalescing """
+        return self._cache_hits
+
+    def _in_batch(self):
+        return self._batch_depth > 0 and self._batch_thread == threading.get_ident()
+
+    @contextmanager
+    def batch(self):
+        """ Batch of reads and writes (see RpcCache). Errors of deferred writes are raised on the end of batch """
+        if self._batch_depth > 0 and self._batch_thread != threading.get_ident():
+            yield self  # batch opened by other thread - no batching in this thread
+            return
+        self._batch_thread = threading.get_ident()
+        if self._batch_depth == 0:
+            self._batch_started()
+        self._batch_depth += 1
+        try:
+            yield self
+        finally:
+            self._batch_depth -= 1
+            if self._batch_depth == 0:
+                self._cache = {}
+                self._batch_thread = None
+                self.flush()
+
+    def _batch_started(self):
+        """ Called on the beginning of the outermost batch """
+        pass
+
+    def _read(self, key, getter):
+        if self._in_batch() and key in self._cache:
+            self._cache_hits += 1
+            return self._cache[key]
+        value = getter()
+        self._rpc_count += 1
+        if self._in_batch():
+            self._cache[key] = value
+        return value
+
+    def _write(self, key, value, setter):
+        if not self._in_batch():
+            setter(value)
+            self._rpc_count += 1
+            return
+        if key not in self._pending and key in self._cache and _same_value(self._cache[key], value):
+            self._cache_hits += 1  # microscope has the value already
+            return
+        if key in self._pending:
+            self._cache_hits += 1  # coalesced with previous write
+        self._cache[key] = value
+        self._pending[key] = (setter, value)
+
+    def _invalidate(self, key=None):
+        """ Remove the key (or all keys if None) from read cache """
+        if key is None:
+            self._cache = {}
+        else:
+            self._cache.pop(key, None)
+
+    def flush(self):
+        """ Send deferred writes. All writes are tried, the first error is raised """
+        if self._batch_depth > 0 and not self._in_batch():
+            return  # writes of the batch opened by other thread
+        pending = self._pending
+        self._pending = {}
+        error = None
+        for key, (setter, value) in pending.items():
+            try:
+                setter(value)
+                self._rpc_count += 1
+            except Exception as e:
+                logging.error(f'Deferred setting of {key} to {value} failed. ' + repr(e))
+                self._cache.pop(key, None)
+                if error is None:
+                    error = e
+        if error is not None:
+            raise error
+
+
+class AutoscriptMicroscopeControl(RpcCache, MicroscopeControl):
+    def __init__(self, ip_address="localhost", virtual=False):
         """ Connect to AS server
-        ip_address: ip address of the microscope."""
-        if virtual_mode:
-            self._microscope = VirtualMicroscope()
+        ip_address: ip address of the microscope.
+        virtual: use virtual microscope even if AS library is available."""
+        self._init_rpc_cache()
+        if virtual_mode or virtual:
+            self._microscope = self.create_virtual_microscope()
             self.is_virtual = True
         else:
             # microscope connection
@@ -44,14 +166,54 @@ class AutoscriptMicroscopeControl(MicroscopeControl):
                 self._microscope.connect(ip_address)
                 logging.info(f'Connecting to {ip_address}')
 
-        self._electron_beam = ElectronBeam(self._microscope)
-        self._ion_beam = IonBeam(self._microscope)
+        self._shared_state = {'modality': None}  # actual modality shared by both beams
+        self._electron_beam = ElectronBeam(self._microscope, self._shared_state)
+        self._ion_beam = IonBeam(self._microscope, self._shared_state)
+
+    @contextmanager
+    def batch(self):
+        """ Batch of stage reads and both beams reads/writes (see RpcCache) """
+        with RpcCache.batch(self), self._electron_beam.batch(), self._ion_beam.batch():
+            yield self
+
+    def invalidate_view(self):
+        """ The active view/device is not known - the next beam access activates it """
+        self._shared_state['modality'] = None
+
+    @property
+    def rpc_count(self):
+        """ Number of AS calls (stage and both beams) """
+        return self._rpc_count + self._electron_beam.rpc_count + self._ion_beam.rpc_count
+
+    @property
+    def cache_hits(self):
+        return self._cache_hits + self._electron_beam.cache_hits + self._ion_beam.cache_hits
+
+    @staticmethod
+    def create_virtual_microscope():
+        """ Virtual microscope. It replays recorded acquisition if the replay directory is set (see replay settings)"""
+        from fibsem_maestro.microscope_control.virtual_control import VirtualMicroscope
+        from fibsem_maestro.settings import Settings
+        settings = Settings()
+        latencies = {'stage': settings('replay', 'latency_stage'),
+                     'beam_shift': settings('replay', 'latency_beam_shift'),
+                     'patterning': settings('replay', 'latency_patterning'),
+                     'grab_frame': settings('replay', 'latency_grab_frame')}
+        latencies = {k: v for k, v in latencies.items() if v is not None}  # missing settings -> no latency
+        return VirtualMicroscope(replay_dir=settings('replay', 'directory') or None,
+                                 latencies=latencies,
+                                 scan_time_factor=settings('replay', 'scan_time_factor') or 0,
+                                 loop=bool(settings('replay', 'loop')))
+
+    def _read_position(self):
+        self._microscope.specimen.stage.unlink()
+        self._rpc_count += 1  # unlink
+        return self._microscope.specimen.stage.current_position
 
     @property
     def position(self):
         """Get stage position"""
-        self._microscope.specimen.stage.unlink()
-        p = StagePosition.from_stage_position_as(self._microscope.specimen.stage.current_position)
+        p = StagePosition.from_stage_position_as(self._read('position', self._read_position))
         logging.debug(f"Getting stage position: {p.to_dict()}...")
         return p  # Convert AS stage pos to standard stage pos
 
@@ -61,6 +223,8 @@ class AutoscriptMicroscopeControl(MicroscopeControl):
         self._microscope.specimen.stage.unlink()
         goal_as = goal.to_stage_position_as()
         self._microscope.specimen.stage.absolute_move(goal_as)
+        self._rpc_count += 2
+        self._invalidate('position')  # stage does not reach exactly the goal
         logging.debug(f"Moving stage to {goal.to_dict()}...")
     @property
     def relative_position(self):
@@ -70,6 +234,8 @@ class AutoscriptMicroscopeControl(MicroscopeControl):
     def relative_position(self, goal: StagePosition):
         logging.debug(f"Moving stage to {goal.to_dict()} (relative) ...")
         self._microscope.specimen.stage.relative_move(goal.to_stage_position_as())
+        self._rpc_count += 1
+        self._invalidate('position')
 
     @property
     def electron_beam(self) -> BeamControl:
@@ -90,21 +256,30 @@ class AutoscriptMicroscopeControl(MicroscopeControl):
         return self._ion_beam
 
 
-class ElectronBeam(BeamControl):
+class VirtualMicroscopeControl(AutoscriptMicroscopeControl):
+    """ Control of the virtual microscope (it can replay recorded acquisition without hardware) """
+    def __init__(self, ip_address=None):
+        super().__init__(ip_address, virtual=True)
+
+
+class ElectronBeam(RpcCache, BeamControl):
     """ Implementation of Microscope Beam. The class is universal for electrons and ions"""
 
-    def __init__(self, microscope):
+    def __init__(self, microscope, shared_state=None):
         """
         Constructor for the Beam class.
 
         :param microscope: A concrete instance of a microscope control object.
-        :param modality: Must be eb (electron beam) or ib (ion beam).
+        :param shared_state: Dict shared by both beams (actual modality).
         """
+        self._init_rpc_cache()
+        self._shared_state = shared_state if shared_state is not None else {'modality': None}
         self._scanning_area = None  # reduced area. If none, reduced area is not applied
         self._microscope = microscope
         self._beam = self._microscope.beams.electron_beam
         self._modality = 'eb'
         self._beam_type = BeamType.ELECTRON
+        self.image_writer = None  # asynchronous image saving (ImageWriter). If None, image is saved in grab_frame
 
         # default values
         self._line_integration = 1
@@ -113,6 +288,44 @@ class ElectronBeam(BeamControl):
         self._standard_resolutions = ([1024, 884], [1536, 1024], [2048, 1768], [3072, 2048], [4096, 3536], [512, 442],
                                       [6144, 4096], [768, 512])  # available resolutions supported in standard mode
 
+    def _read_point(self, name):
+        """ Read AS point property (stigmator, lens_alignment, beam_shift) """
+        return self._read(name, lambda: getattr(self._beam, name).value)
+
+    def _write_point(self, name, x, y):
+        """ Write AS point property. In batch, the writes of x and y are coalesced to one call """
+        self._write(name, PointAS(x, y), _set_value(getattr(self._beam, name)))
+
+    def _get_detector_value(self, name):
+        self.select_modality()  # activate right quad
+        return getattr(self._microscope.detector, name).value
+
+    def _set_detector_value(self, name, value):
+        self.select_modality()  # activate right quad
+        getattr(self._microscope.detector, name).value = value
+
+    def _get_source_tilt(self):
+        self.select_modality()  # activate right quad
+        return self._beam.source_tilt.value
+
+    def _set_source_tilt(self, value):
+        self.select_modality()  # activate right quad
+        self._beam.source_tilt.value = value
+
+    def _batch_started(self):
+        # the view could be changed outside the batch (raw client, operator) - the first access in batch activates it
+        self._shared_state['modality'] = None
+
+    def _activate(self, view, device):
+        """ Set active view and device. In batch, it is skipped if the modality is already active """
+        if self._in_batch() and self._shared_state['modality'] == self._modality:
+            self._cache_hits += 2
+            return
+        self._microscope.imaging.set_active_view(view)
+        self._microscope.imaging.set_active_device(device)
+        self._rpc_count += 2
+        self._shared_state['modality'] = self._modality
+
     @property
     def working_distance(self):
         """
@@ -120,7 +333,7 @@ class ElectronBeam(BeamControl):
 
         :return: The beam working distance.
         """
-        wd = self._beam.working_distance.value
+        wd = self._read('working_distance', lambda: self._beam.working_distance.value)
         logging.debug(f"Getting working distance ({self._modality}): {wd}")
         return wd
 
@@ -132,7 +345,7 @@ class ElectronBeam(BeamControl):
         This method is used to set the working distance of the beam in the microscope.        
         """
         logging.debug(f"Setting working distance ({self._modality}): {wd}")
-        self._beam.working_distance.set_value_no_degauss(wd)
+        self._write('working_distance', wd, self._beam.working_distance.set_value_no_degauss)
 
     @property
     def stigmator_x(self):
@@ -141,7 +354,7 @@ class ElectronBeam(BeamControl):
 
         :return: The x-coordinate value of the beam stigmator.
         """
-        value = self._beam.stigmator.value.x
+        value = self._read_point('stigmator').x
         logging.debug(f"Getting stigmator x ({self._modality}): {value}")
         return value
 
@@ -151,7 +364,7 @@ class ElectronBeam(BeamControl):
         Setter method for the stigmator_x property.
         """
         logging.debug(f"Setting stigmator x ({self._modality}): {value}")
-        self._beam.stigmator.value = PointAS(value, self.stigmator_y)
+        self._write_point('stigmator', value, self.stigmator_y)
 
     @property
     def stigmator_y(self):
@@ -160,7 +373,7 @@ class ElectronBeam(BeamControl):
 
         :return: The y-coordinate value of the beam stigmator.
         """
-        value = self._beam.stigmator.value.y
+        value = self._read_point('stigmator').y
         logging.debug(f"Getting stigmator y ({self._modality}): {value}")
         return value
 
@@ -172,11 +385,11 @@ class ElectronBeam(BeamControl):
         :return: The current value of the stigmator_y.
         """
         logging.debug(f"Setting stigmator y ({self._modality}): {value}")
-        self._beam.stigmator.value = PointAS(self.stigmator_x, value)
+        self._write_point('stigmator', self.stigmator_x, value)
 
     @property
     def stigmator(self) -> Point:
-        value_as = self._beam.stigmator.value
+        value_as = self._read_point('stigmator')
         value = Point.from_point_as(value_as)
         logging.debug(f"Getting stigmator ({self._modality}): {value.to_dict()}")
         return value
@@ -186,7 +399,7 @@ class ElectronBeam(BeamControl):
         if not isinstance(p, Point):
             raise TypeError('Expected a Point instance')
         logging.debug(f"Setting stigmator ({self._modality}): {p.to_dict()}")
-        self._beam.stigmator.value = PointAS(p.x, p.y)
+        self._write_point('stigmator', p.x, p.y)
 
     @property
     def lens_alignment_x(self):
@@ -194,7 +407,7 @@ class ElectronBeam(BeamControl):
 
         :return: The x-coordinate of the lens alignment value of the beam.
         """
-        value = self._beam.lens_alignment.value.x
+        value = self._read_point('lens_alignment').x
         logging.debug(f"Getting lens alignment x ({self._modality}): {value}")
         return value
 
@@ -208,7 +421,7 @@ class ElectronBeam(BeamControl):
 
         """
         logging.debug(f"Setting lens alignment x ({self._modality}): {value}")
-        self._beam.lens_alignment.value = PointAS(value, self.lens_alignment_y)
+        self._write_point('lens_alignment', value, self.lens_alignment_y)
 
     @property
     def lens_alignment_y(self):
@@ -217,7 +430,7 @@ class ElectronBeam(BeamControl):
 
         :return: The y-axis value of the lens alignment for the beam.
         """
-        value = self._beam.lens_alignment.value.y
+        value = self._read_point('lens_alignment').y
         logging.debug(f"Getting lens alignment y ({self._modality}): {value}")
         return value
 
@@ -230,11 +443,11 @@ class ElectronBeam(BeamControl):
         :return: None
         """
         logging.debug(f"Setting lens alignment y ({self._modality}): {value}")
-        self._beam.lens_alignment.value = PointAS(self.lens_alignment_y, value)
+        self._write_point('lens_alignment', self.lens_alignment_x, value)
 
     @property
     def lens_alignment(self):
-        value_as = self._beam.lens_alignment.value
+        value_as = self._read_point('lens_alignment')
         value = Point.from_point_as(value_as)
         logging.debug(f"Getting lens alignment ({self._modality}): {value.to_dict()}")
         return value
@@ -244,12 +457,12 @@ class ElectronBeam(BeamControl):
         if not isinstance(point, Point):
             raise TypeError('Expected a Point instance')
         logging.debug(f"Setting lens alignment ({self._modality}): {point.to_dict()}")
-        self._beam.lens_alignment.value = PointAS(point.x, point.y)
+        self._write_point('lens_alignment', point.x, point.y)
 
     @property
     def beam_shift_x(self):
         """Get the x value of the beam shift."""
-        value = self._beam.beam_shift.value.x
+        value = self._read_point('beam_shift').x
         logging.debug(f"Getting beam shift x ({self._modality}): {value}")
         return value
 
@@ -257,12 +470,12 @@ class ElectronBeam(BeamControl):
     def beam_shift_x(self, value):
         """Set the x value of the beam shift."""
         logging.debug(f"Setting beam shift x ({self._modality}): {value}")
-        self._beam.beam_shift.value = PointAS(value, self.beam_shift_y)
+        self._write_point('beam_shift', value, self.beam_shift_y)
 
     @property
     def beam_shift_y(self):
         """Get the y value of the beam shift."""
-        value = self._beam.beam_shift.value.y
+        value = self._read_point('beam_shift').y
         logging.debug(f"Getting beam shift y ({self._modality}): {value}")
         return value
 
@@ -270,11 +483,11 @@ class ElectronBeam(BeamControl):
     def beam_shift_y(self, value):
         """Set the y value of the beam shift."""
         logging.debug(f"Setting beam shift y ({self._modality}): {value}")
-        self._beam.beam_shift.value = PointAS(self.beam_shift_x, value)
+        self._write_point('beam_shift', self.beam_shift_x, value)
 
     @property
     def beam_shift(self):
-        value_as = self._beam.beam_shift.value
+        value_as = self._read_point('beam_shift')
         value = Point.from_point_as(value_as)
         logging.debug(f"Getting beam shift ({self._modality}): {value.to_dict()}")
         return value
@@ -284,78 +497,80 @@ class ElectronBeam(BeamControl):
         if not isinstance(point, Point):
             raise TypeError('Expected a Point instance')
         logging.debug(f"Setting beam shift ({self._modality}): {point.to_dict()}")
-        self._beam.beam_shift.value = PointAS(point.x, point.y)
+        self._write_point('beam_shift', point.x, point.y)
 
     @property
     def detector_contrast(self):
         """Get the contrast of the detector."""
-        self.select_modality()  # activate right quad
-        value = self._microscope.detector.contrast.value
+        value = self._read('detector_contrast', lambda: self._get_detector_value('contrast'))
         logging.debug(f"Getting detector contrast ({self._modality}): {value}")
         return value
 
     @detector_contrast.setter
     def detector_contrast(self, value):
         """Set the contrast of the detector."""
-        self.select_modality()  # activate right quad
         logging.debug(f"Setting detector contrast ({self._modality}) to: {value}")
-        self._microscope.detector.contrast.value = value
+        self._write('detector_contrast', value, lambda v: self._set_detector_value('contrast', v))
 
     @property
     def detector_brightness(self):
         """Get the brightness of the detector."""
-        self.select_modality()  # activate right quad
-        value = self._microscope.detector.brightness.value
+        value = self._read('detector_brightness', lambda: self._get_detector_value('brightness'))
         logging.debug(f"Getting detector brightness ({self._modality}): {value}")
         return value
 
     @detector_brightness.setter
     def detector_brightness(self, value):
         """Set the brightness of the detector."""
-        self.select_modality()  # activate right quad
         logging.debug(f"Setting detector brightness ({self._modality}) to: {value}")
-        self._microscope.detector.brightness.value = value
+        self._write('detector_brightness', value, lambda v: self._set_detector_value('brightness', v))
 
     @property
     def source_tilt(self):
         """Get the source tilt"""
-        self.select_modality()  # activate right quad
-        value = self._beam.source_tilt.value
+        value = self._read('source_tilt', self._get_source_tilt)
         logging.debug(f"Getting source tilt ({self._modality}): {value}")
         return value
 
     @source_tilt.setter
     def source_tilt(self, value):
         """Set the source tilt"""
-        self.select_modality()  # activate right quad
         logging.debug(f"Setting source tilt ({self._modality}) to: {value}")
-        self._beam.source_tilt.value= value
+        self._write('source_tilt', value, self._set_source_tilt)
 
     def blank(self):
         """
         Blank the beam.
         """
+        self.flush()
         self.select_modality()  # activate right quad
         logging.debug(f"Blanking beam ({self._modality}).")
         self._beam.blank()
+        self._rpc_count += 1
 
     def unblank(self):
         """
         Unblank the beam.
         """
+        self.flush()
         self.select_modality()
         logging.debug(f"Unblanking beam ({self._modality}).")
         self._beam.unblank()
+        self._rpc_count += 1
 
     def start_acquisition(self):
         logging.debug(f"Starting acquisition ({self._modality})...")
+        self.flush()
         self.select_modality()  # activate right quad
         self._microscope.imaging.start_acquisition()
+        self._rpc_count += 1
 
     def stop_acquisition(self):
         logging.debug(f"Stopping acquisition ({self._modality})...")
+        self.flush()
         self.select_modality()  # activate right quad
         self._microscope.imaging.stop_acquisition()
+        self._rpc_count += 1
 
     def select_modality(self):
         """
@@ -366,8 +581,7 @@ class ElectronBeam(BeamControl):
         The Electron Beam mode is always in Quad 1, while the Ion Beam mode is always in Quad 2.
 
         """
-        self._microscope.imaging.set_active_view(1)
-        self._microscope.imaging.set_active_device(ImagingDevice.ELECTRON_BEAM)
+        self._activate(1, ImagingDevice.ELECTRON_BEAM)
 
     def grab_frame(self, file_name=None):
         """
@@ -378,6 +592,7 @@ class ElectronBeam(BeamControl):
         Returns:
             Frame data
         """
+        self.flush()
         self.select_modality()  # activate right quad
         logging.debug(f"Grabbing frame ({self._modality}).")
 
@@ -391,13 +606,17 @@ class ElectronBeam(BeamControl):
         logging.info(f"Acquiring image..")
         logging.info(f'Bit depth: {self.bit_depth}, resolution: {self.resolution}, pixel_size: {self.pixel_size}, '
                      f'LI: {self._line_integration}, scanning_area: {self.scanning_area}, dwell: {self.dwell_time}, '
-                     f'WD: {self._beam.working_distance.value}')
+                     f'WD: {self.working_distance}')
 
         try:
+            self._rpc_count += 1
             grabbed_image = self._microscope.imaging.grab_frame(img_settings)
             logging.info(f"Image grabbed.")
             if file_name is not None:
-                grabbed_image.save(file_name)
+                if self.image_writer is not None:
+                    self.image_writer.write(grabbed_image, file_name)  # saved in the writer thread
+                else:
+                    grabbed_image.save(file_name)
             image = Image.from_as(grabbed_image)
         except Exception as e:
             logging.info('Grabbing frame to disk. ' + repr(e))
@@ -405,6 +624,7 @@ class ElectronBeam(BeamControl):
                 file_name = 'temp.tiff'
                 logging.warning('File name was not provided. The image will be saved to temp.tiff')
             self._microscope.imaging.grab_frame_to_disk(file_name, ImageFileFormat.TIFF, img_settings)
+            self._rpc_count += 1
             logging.info(f"Image grabbed to disk.")
             img = AdornedImage.load(file_name)
             logging.debug(f"Image loaded from disk.")
@@ -418,9 +638,11 @@ class ElectronBeam(BeamControl):
         Returns:
             Current image data
         """
+        self.flush()
         self.select_modality()  # activate right quad
         logging.debug(f"Getting image ({self._modality}).")
         img = self._microscope.imaging.get_image()
+        self._rpc_count += 1
         image = Image.from_as(img)
         if crop_to_scanning_area and self.scanning_area is not None:
             left_top, size = self.scanning_area.to_img_coordinates(image.shape)
@@ -432,6 +654,7 @@ class ElectronBeam(BeamControl):
     def rectangle_milling(self, app_file: str, leftop, size, fov, depth: float, direction: str):
         center_x = leftop.x - fov[0]/2 + size[0]/2
         center_y = -leftop.y + fov[1]/2
+        self.flush()
         try:
             if 'ccs' in str.lower(app_file):
                 pattern_fn = self._microscope.patterning.create_cleaning_cross_section
@@ -503,7 +726,7 @@ class ElectronBeam(BeamControl):
         Returns:
             float: The beam dwell time
         """
-        value = self._beam.scanning.dwell_time.value
+        value = self._read('dwell_time', lambda: self._beam.scanning.dwell_time.value)
         logging.debug(f"Getting dwell time ({self._modality}): {value}.")
         return value
 
@@ -515,7 +738,7 @@ class ElectronBeam(BeamControl):
         Args:
             dwell_time (float): The new dwell time
         """
-        self._beam.scanning.dwell_time.value = dwell_time
+        self._write('dwell_time', dwell_time, _set_value(self._beam.scanning.dwell_time))
         logging.debug(f"Setting dwell time to ({self._modality}): {dwell_time}.")
 
     @property
@@ -526,7 +749,7 @@ class ElectronBeam(BeamControl):
         Returns:
             int: The bit depth of the image
         """
-        value = self._beam.scanning.bit_depth
+        value = self._read('bit_depth', lambda: self._beam.scanning.bit_depth)
         logging.debug(f"Getting bit depth ({self._modality}): {value}.")
         return value
 
@@ -539,7 +762,7 @@ class ElectronBeam(BeamControl):
             depth (int): The new bit depth (8 or 16)
         """
         assert depth == 8 or depth == 16
-        self._beam.scanning.bit_depth = depth
+        self._write('bit_depth', depth, lambda v: setattr(self._beam.scanning, 'bit_depth', v))
         logging.debug(f"Setting bit depth to ({self._modality}): {depth}.")
 
     @property
@@ -550,8 +773,8 @@ class ElectronBeam(BeamControl):
         Returns:
             tuple: The resolution of the image
         """
-        r = str(self._beam.scanning.resolution.value)
         if self._extended_resolution is None:
+            r = str(self._read('resolution', lambda: self._beam.scanning.resolution.value))
             logging.debug(f"Getting standard resolution ({self._modality}): {r}.")
             return [int(x) for x in r.split('x')]
         else:
@@ -570,7 +793,7 @@ class ElectronBeam(BeamControl):
         for r in self._standard_resolutions:
             if int(round(resolution[0])) == r[0] and int(round(resolution[1])) == r[1]:
                 logging.debug(f"Setting standard resolution to ({self._modality}): {value}.")
-                self._beam.scanning.resolution.value = value
+                self._write('resolution', value, _set_value(self._beam.scanning.resolution))
                 return
         logging.debug(f"Setting extended resolution to ({self._modality}): {value}.")
         self._extended_resolution = resolution
@@ -587,7 +810,7 @@ class ElectronBeam(BeamControl):
         Returns:
             float: The horizontal pixel values
         """
-        value = self._beam.horizontal_field_width.value
+        value = self._read('horizontal_field_width', lambda: self._beam.horizontal_field_width.value)
         logging.debug(f"Getting hfw ({self._modality}): {value}.")
         return value
 
@@ -600,7 +823,7 @@ class ElectronBeam(BeamControl):
             value (float): The new horizontal field value
         """
         logging.debug(f"Setting hfw to ({self._modality}): {value}.")
-        self._beam.horizontal_field_width.value = value
+        self._write('horizontal_field_width', value, _set_value(self._beam.horizontal_field_width))
 
     @property
     def vertical_field_width(self):
@@ -658,7 +881,7 @@ class ElectronBeam(BeamControl):
         Returns:
             float: The angle in radians
         """
-        sr = self._beam.scanning.rotation.value
+        sr = self._read('scan_rotation', lambda: self._beam.scanning.rotation.value)
         logging.debug(f"Getting scanning rotation ({self._modality}): {sr}.")
         return sr
 
@@ -670,7 +893,7 @@ class ElectronBeam(BeamControl):
         Args:
             scanrot (float): The new scan rotation value
         """
-        self._beam.scanning.rotation.value = scanrot
+        self._write('scan_rotation', scanrot, _set_value(self._beam.scanning.rotation))
 
     @property
     def scanning_area(self):
@@ -682,18 +905,24 @@ class ElectronBeam(BeamControl):
         # copy dwell and resolution to reduced area scanning mode
         backup_dwell = self.dwell_time
         backup_res = self.resolution
+        self.flush()  # scanning mode change is applied to the actual settings
 
         if value is None or (value.height == 1 and value.width == 1) or value.height == 0 or value.width == 0:  # scanning area = FoV or 0
             logging.debug(f"Disabling scanning area({self._modality}).")
             self._beam.scanning.mode.set_full_frame()  # used for acquisition started by start_acquisition()
+            self._rpc_count += 1
             self._scanning_area = None
         else:
             logging.debug(f"Setting scanning area to ({self._modality}): {value}.")
             # used for acquisition started by start_acquisition()
             self._beam.scanning.mode.set_reduced_area(left=value.leftop.x, top=value.leftop.y,
                                                       width=value.width, height=value.height)
+            self._rpc_count += 1
             self._scanning_area = value
 
+        # the mode change can change dwell and resolution on microscope
+        self._invalidate('dwell_time')
+        self._invalidate('resolution')
         self.dwell_time = backup_dwell
         self.resolution = backup_res
 
@@ -728,8 +957,8 @@ class ElectronBeam(BeamControl):
 
 
 class IonBeam(ElectronBeam):
-    def __init__(self,microscope):
-        super().__init__(microscope)
+    def __init__(self, microscope, shared_state=None):
+        super().__init__(microscope, shared_state)
         self._beam = self._microscope.beams.ion_beam
         self._modality = 'ib'
         self._beam_type = BeamType.ION
@@ -743,8 +972,7 @@ class IonBeam(ElectronBeam):
         The Electron Beam mode is always in Quad 1, while the Ion Beam mode is always in Quad 2.
 
         """
-        self._microscope.imaging.set_active_view(2)
-        self._microscope.imaging.set_active_device(ImagingDevice.ION_BEAM)
+        self._activate(2, ImagingDevice.ION_BEAM)
 
     @property
     def working_distance(self):
@@ -753,7 +981,7 @@ class IonBeam(ElectronBeam):
 
         :return: The beam working distance.
         """
-        wd = self._beam.working_distance.value
+        wd = self._read('working_distance', lambda: self._beam.working_distance.value)
         logging.debug(f"Getting working distance ({self._modality}): {wd}")
         return wd
 
@@ -766,7 +994,7 @@ class IonBeam(ElectronBeam):
         WD of ion beam is set differently the e beam.
         """
         logging.debug(f"Setting working distance ({self._modality}): {wd}")
-        self._beam.working_distance.value = wd
+        self._write('working_distance', wd, _set_value(self._beam.working_distance))
 
     @ property
     def beam_shift_to_stage_move(self):
@@ -4,7 +4,9 @@ import os
 from scipy.spatial import distance
 
 from fibsem_maestro.tools.support import StagePosition, Point, ScanningArea
-from fibsem_maestro.microscope_control.autoscript_control import AutoscriptMicroscopeControl
+from fibsem_maestro.microscope_control.autoscript_control import AutoscriptMicroscopeControl, VirtualMicroscopeControl
+from fibsem_maestro.tools.image_writer import ImageWriter
+from fibsem_maestro.microscope_control.settings import SettingsState
 from fibsem_maestro.settings import Settings
 
 class GlobalMicroscope:
@@ -32,6 +34,8 @@ def create_microscope():
 
     if library.lower() == 'autoscript':
         microscope_base = AutoscriptMicroscopeControl
+    elif library.lower() == 'virtual':
+        microscope_base = VirtualMicroscopeControl
     else:
         raise ValueError(f"Invalid microscope control type: {library}")
 
@@ -60,6 +64,17 @@ def create_microscope():
             self.stage_trial_counter = stage_trial_setting.value
             stage_trial_setting.add_handler(self.update_stage_trial_counter)
 
+            # asynchronous saving of acquired images (0 - images are saved synchronously in grab_frame)
+            image_writer_queue_size = self.settings('acquisition', 'image_writer_queue_size')
+            self.image_writer = ImageWriter(image_writer_queue_size) if image_writer_queue_size else None
+            self.electron_beam.image_writer = self.image_writer
+            self.ion_beam.image_writer = self.image_writer
+
+            # last applied values of microscope settings (unchanged settings are not sent to microscope)
+            # the view reads actual tolerance values
+            self.settings_state = SettingsState(self.settings('microscope', 'settings_tolerance', return_view=True))
+            self.settings_state.register(self)
+
         def update_stage_trial_counter(self, value):
             self.stage_trial_counter = value
 
@@ -165,22 +180,23 @@ def create_microscope():
             self.beam.unblank()
 
         def apply_beam_settings(self, image_settings):
-            if 'bit_depth' in image_settings:
-                self.beam.bit_depth = image_settings['bit_depth']
-            if 'field_of_view' in image_settings:# and self.electron_beam.extended_resolution:
-                self.beam.horizontal_field_width = image_settings['field_of_view'][0]
-                self.beam.vertical_field_width = image_settings['field_of_view'][1]
-            # call pixel size from Beam class, set correct resolution
-            if 'pixel_size' in image_settings:# and self.electron_beam.extended_resolution:
-                self.beam.pixel_size = float(image_settings['pixel_size'])
-            if 'images_line_integration' in image_settings:
-                self.beam.line_integration = image_settings['images_line_integration']
-            if 'dwell' in image_settings:
-                self.beam.dwell_time = image_settings['dwell']
-            if 'imaging_area' in image_settings:
-                self.beam.scanning_area = ScanningArea.from_dict(image_settings['imaging_area'])
-            else:
-                self.beam.scanning_area = None
+            with self.beam.batch():  # coalesced writes, hfw and resolution are not read back
+                if 'bit_depth' in image_settings:
+                    self.beam.bit_depth = image_settings['bit_depth']
+                if 'field_of_view' in image_settings:# and self.electron_beam.extended_resolution:
+                    self.beam.horizontal_field_width = image_settings['field_of_view'][0]
+                    self.beam.vertical_field_width = image_settings['field_of_view'][1]
+                # call pixel size from Beam class, set correct resolution
+                if 'pixel_size' in image_settings:# and self.electron_beam.extended_resolution:
+                    self.beam.pixel_size = float(image_settings['pixel_size'])
+                if 'images_line_integration' in image_settings:
+                    self.beam.line_integration = image_settings['images_line_integration']
+                if 'dwell' in image_settings:
+                    self.beam.dwell_time = image_settings['dwell']
+                if 'imaging_area' in image_settings:
+                    self.beam.scanning_area = ScanningArea.from_dict(image_settings['imaging_area'])
+                else:
+                    self.beam.scanning_area = None
 
         def acquire_image(self, slice_number=None):
             """
@@ -193,7 +209,7 @@ def create_microscope():
             :return: The acquired image.
             """
             imaging_settings_name = self.settings('acquisition', 'image_name')
-            imaging_settings = self.settings('image', imaging_settings_name)
+            imaging_settings = self.settings('image', imaging_settings_name, return_view=True)
             data_dir =  self.settings('dirs', 'output_images')
 
             self.apply_beam_settings(imaging_settings)
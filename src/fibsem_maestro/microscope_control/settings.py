@@ -1,56 +1,217 @@
 import logging
+import os
+import threading
+
 import yaml
 
 from fibsem_maestro.microscope_control.abstract_control import MicroscopeControl
 from fibsem_maestro.tools.support import Point, StagePosition, ScanningArea
 
 
-def save_settings(microscope: MicroscopeControl, settings: list, path):
-    # populate settings dict with settings names and their values read from microscope
-    settings_dict = {}
-    for setting in reversed(settings): # position used to be the firs in the list - it must be last in dict in order to be processed first (stage position affect wd)
-        try:
-            if '.' in setting:
-                # inner attribute -> beam setting
-                [beam, setting_attribute] = setting.split('.')
-                value = getattr(getattr(microscope, beam), setting_attribute)
-            else:
-                # simple attribute
-                value = getattr(microscope, setting)
-        except Exception as e:
-            logging.error(f'The value {setting} cannot be read from microscope. Setting to None.')
-            logging.error(repr(e))
-            value = None
-
-        settings_dict[setting] = value
-    # write to file
+# properties that are changed by setting of another property
+_DEPENDENT_PROPERTIES = {'relative_position': ['position'],
+                         'stigmator_x': ['stigmator'], 'stigmator_y': ['stigmator'],
+                         'lens_alignment_x': ['lens_alignment'], 'lens_alignment_y': ['lens_alignment'],
+                         'beam_shift_x': ['beam_shift'], 'beam_shift_y': ['beam_shift'],
+                         'stigmator': ['stigmator_x', 'stigmator_y'],
+                         'lens_alignment': ['lens_alignment_x', 'lens_alignment_y'],
+                         'beam_shift': ['beam_shift_x', 'beam_shift_y'],
+                         'pixel_size': ['resolution'],
+                         'resolution': ['pixel_size'],
+                         'horizontal_field_width': ['pixel_size', 'vertical_field_width'],
+                         'scanning_area': ['dwell_time', 'resolution']}
+
+
+class SettingsState:
+    """
+    Last applied (or read) values of microscope settings.
+
+    load_settings skips the settings whose value is the same as the known microscope value (within the tolerance),
+    so no RPC is sent. Every property setting on the microscope or beam invalidates the known value
+    (see WriteNotifier), so only values that were not changed since the last apply/read are skipped.
+    """
+    def __init__(self, tolerances=None):
+        """
+        :param tolerances: dict setting name (e.g. electron_beam.working_distance) or property name
+        (e.g. working_distance) -> tolerance. Exact comparison is used if not defined.
+        """
+        self.tolerances = tolerances if tolerances is not None else {}
+        self._values = {}
+        self._lock = threading.Lock()
+        self.applied = 0  # number of settings sent to microscope
+        self.skipped = 0  # number of settings not sent (RPC saved)
+
+    def register(self, microscope):
+        """ Register write handlers to microscope and its beams """
+        microscope.add_write_handler(lambda name: self.invalidate(name))
+        microscope.electron_beam.add_write_handler(lambda name: self.invalidate('electron_beam.' + name))
+        microscope.ion_beam.add_write_handler(lambda name: self.invalidate('ion_beam.' + name))
+
+    def tolerance(self, setting):
+        if setting in self.tolerances:
+            return self.tolerances[setting]
+        return self.tolerances.get(setting.split('.')[-1], 0)
+
+    def update(self, setting, value):
+        """ Store known microscope value """
+        if value is None:
+            return
+        with self._lock:
+            self._values[setting] = value
+
+    def invalidate(self, setting):
+        """ Forget the value of the setting (and dependent settings) """
+        prefix, _, name = setting.rpartition('.')
+        prefix = prefix + '.' if prefix else ''
+        with self._lock:
+            self._values.pop(setting, None)
+            for dependent in _DEPENDENT_PROPERTIES.get(name, []):
+                self._values.pop(prefix + dependent, None)
+
+    def clear(self):
+        with self._lock:
+            self._values = {}
+
+    def is_applied(self, setting, value):
+        """ True if the microscope has the value already """
+        with self._lock:
+            if setting not in self._values:
+                return False
+            known_value = self._values[setting]
+        return _values_equal(known_value, value, self.tolerance(setting))
+
+
+def _values_equal(a, b, tolerance):
+    """ Compare values (numbers, Point, StagePosition, ScanningArea, lists) with tolerance """
+    if isinstance(a, (int, float)) and isinstance(b, (int, float)) and not isinstance(a, bool):
+        return abs(a - b) <= tolerance
+    if type(a) != type(b):
+        return False
+    if isinstance(a, (list, tuple)):
+        return len(a) == len(b) and all(_values_equal(x, y, tolerance) for x, y in zip(a, b))
+    if hasattr(a, '__dict__'):
+        return vars(a).keys() == vars(b).keys() and \
+            all(_values_equal(v, vars(b)[k], tolerance) for k, v in vars(a).items())
+    return a == b
+
+
+_settings_file_cache = {}  # path -> (mtime, size, settings dict)
+
+
+def _cache_settings_file(path, settings_dict):
+    stat = os.stat(path)
+    _settings_file_cache[os.path.abspath(path)] = (stat.st_mtime_ns, stat.st_size, settings_dict)
+
+
+def _read_settings_file(path):
+    """ Parse settings file. The parsed dict is cached until the file is changed """
+    stat = os.stat(path)
+    cached = _settings_file_cache.get(os.path.abspath(path))
+    if cached is not None and cached[0] == stat.st_mtime_ns and cached[1] == stat.st_size:
+        return cached[2]
+    with open(path, "r") as f:
+        settings_dict = yaml.safe_load(f)
+    _cache_settings_file(path, settings_dict)
+    return settings_dict
+
+
+def invalidate_settings_state(microscope: MicroscopeControl):
+    """
+    Forget all known microscope values. Must be called after the microscope is changed by the raw client
+    (sputtering, manufacturer autofunctions...) - these changes are not seen by write handlers.
+    """
+    state = getattr(microscope, 'settings_state', None)
+    if state is not None:
+        state.clear()
+        logging.debug('Known microscope settings cleared.')
+    microscope.invalidate_view()  # active view can be changed too
+
+
+def read_snapshot(microscope: MicroscopeControl, fields):
+    """ Read settings snapshot from microscope. The read values are stored as the known microscope state """
+    snapshot = microscope.snapshot(fields)
+    # read values are the actual microscope state
+    state = getattr(microscope, 'settings_state', None)
+    if state is not None:
+        for setting, value in snapshot.values.items():
+            state.update(setting, value)
+    return snapshot
+
+
+def read_settings(microscope: MicroscopeControl, settings: list, snapshot=None):
+    """
+    Read selected settings from microscope. Return dict (setting name -> value)
+    If snapshot (MicroscopeSnapshot) is passed and its values were not changed since, it is used instead of reading.
+    """
+    fields = list(reversed(settings))  # position used to be the firs in the list - it must be last in dict in order to be processed first (stage position affect wd)
+    if snapshot is None or not snapshot.is_current(fields, getattr(microscope, 'settings_state', None)):
+        snapshot = read_snapshot(microscope, fields)
+    else:
+        logging.debug('Microscope settings taken from snapshot.')
+    return snapshot.to_dict(fields)
+
+
+def write_settings(settings_dict: dict, path):
+    """ Write settings dict (from read_settings) to file """
     with open(path, 'w') as f:
         yaml.dump(settings_dict, f)
+    _cache_settings_file(path, settings_dict)  # no need to parse the file on loading
+
+
+def save_settings(microscope: MicroscopeControl, settings: list, path, snapshot=None):
+    settings_dict = read_settings(microscope, settings, snapshot)
+    # write to file
+    write_settings(settings_dict, path)
 
 
 def load_settings(microscope: MicroscopeControl, path):
+    """
+    Apply settings from file to microscope.
+    If the microscope has settings_state, only changed settings are applied.
+    Return number of skipped settings (saved RPCs).
+    """
     # read settings from file
-    with open(path, "r") as f:
-        settings_dict = yaml.safe_load(f)
+    settings_dict = _read_settings_file(path)
+    state = getattr(microscope, 'settings_state', None)
+    skipped = 0
 
     # apply each setting to the microscope
-    for setting, value in settings_dict.items():
-        try:
-            if '.' in setting:
-                # beam settings
-                substrings = setting.split('.')
-                beam = getattr(microscope, substrings[0])
-                if not hasattr(beam, substrings[1]):
-                    logging.warning(f'The setting {setting} is not microscope property, saving as stand alone property')
-                setattr(beam, substrings[1], value)
-            else:
-                if not hasattr(microscope, setting):
-                    logging.warning(f'The setting {setting} is not microscope property, saving as stand alone property')
-                # direct microscope settings
-                setattr(microscope, setting, value)
-        except Exception as e:
-            logging.error(f'The value {setting} cannot be set to {value} in microscope')
-            logging.error(repr(e))
+    # the writes are batched - the coalesced writes are sent on the end of batch
+    try:
+        with microscope.batch():
+            for setting, value in settings_dict.items():
+                if state is not None and state.is_applied(setting, value):
+                    logging.debug(f'The setting {setting} is not changed. Skipped.')
+                    skipped += 1
+                    continue
+                try:
+                    if '.' in setting:
+                        # beam settings
+                        substrings = setting.split('.')
+                        beam = getattr(microscope, substrings[0])
+                        if not hasattr(beam, substrings[1]):
+                            logging.warning(f'The setting {setting} is not microscope property, saving as stand alone property')
+                        setattr(beam, substrings[1], value)
+                    else:
+                        if not hasattr(microscope, setting):
+                            logging.warning(f'The setting {setting} is not microscope property, saving as stand alone property')
+                        # direct microscope settings
+                        setattr(microscope, setting, value)
+                    if state is not None:
+                        state.update(setting, value)
+                        state.applied += 1
+                except Exception as e:
+                    logging.error(f'The value {setting} cannot be set to {value} in microscope')
+                    logging.error(repr(e))
+    except Exception as e:
+        logging.error('Settings cannot be applied to microscope. ' + repr(e))
+        if state is not None:
+            state.clear()  # the microscope state is unknown
+
+    if state is not None:
+        state.skipped += skipped
+        logging.info(f'{skipped} of {len(settings_dict)} settings unchanged - not sent to microscope')
+    return skipped
 
 
 def point_constructor(loader, node):
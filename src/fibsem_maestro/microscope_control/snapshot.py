@@ -0,0 +1,76 @@
+import time
+from dataclasses import dataclass, field
+from types import MappingProxyType
+from typing import Any, Mapping
+
+# fields needed by Logger.log_microscope_settings
+LOG_FIELDS = ('electron_beam.working_distance', 'electron_beam.beam_shift', 'electron_beam.stigmator',
+              'electron_beam.detector_contrast', 'electron_beam.detector_brightness', 'position',
+              'ion_beam.beam_shift')
+
+
+@dataclass(frozen=True)
+class MicroscopeSnapshot:
+    """
+    Immutable record of microscope state read in one pass (see MicroscopeControl.snapshot).
+    Values are stored by setting name (e.g. position, electron_beam.working_distance). Value is None if it
+    cannot be read.
+    """
+    values: Mapping[str, Any]
+    timestamp: float = field(default_factory=time.time)
+
+    def __post_init__(self):
+        object.__setattr__(self, 'values', MappingProxyType(dict(self.values)))
+
+    def __getitem__(self, setting):
+        return self.values[setting]
+
+    def __contains__(self, setting):
+        return setting in self.values
+
+    def get(self, setting, default=None):
+        return self.values.get(setting, default)
+
+    @property
+    def fields(self):
+        return tuple(self.values.keys())
+
+    def to_dict(self, fields=None):
+        """ Settings dict (setting name -> value) of selected fields (all if None) """
+        if fields is None:
+            fields = self.fields
+        return {setting: self.values[setting] for setting in fields}
+
+    def is_current(self, fields, state):
+        """
+        True if snapshot contains all fields and the values were not changed since the snapshot.
+        The known microscope state (SettingsState) is required, without it the snapshot is never current.
+        """
+        if state is None:
+            return False
+        return all(setting in self.values and self.values[setting] is not None
+                   and state.is_applied(setting, self.values[setting]) for setting in fields)
+
+    def log_params(self):
+        """ Microscope values in Logger.log_params format """
+        params = {}
+        wd = self.get('electron_beam.working_distance')
+        if wd is not None:
+            params['electron_wd'] = wd
+        for setting, name in [('electron_beam.beam_shift', 'electron_beam_shift'),
+                              ('electron_beam.stigmator', 'electron_stigmator'),
+                              ('ion_beam.beam_shift', 'ion_beam_shift')]:
+            point = self.get(setting)
+            if point is not None:
+                params[name + '_x'] = point.x
+                params[name + '_y'] = point.y
+        for setting, name in [('electron_beam.detector_contrast', 'electron_contrast'),
+                              ('electron_beam.detector_brightness', 'electron_brightness')]:
+            if self.get(setting) is not None:
+                params[name] = self.get(setting)
+        position = self.get('position')
+        if position is not None:
+            params['stage_x'] = position.x
+            params['stage_y'] = position.y
+            params['stage_z'] = position.z
+        return params
@@ -1,9 +1,16 @@
+import glob
+import logging
+import os
+import time
 from enum import Enum
-import matplotlib.image as mpimg
-from fibsem_maestro.tools.support import Image
+
+import numpy as np
 
 """ Provides fake classes for virtual control
-The classes act like AS classes"""
+The classes act like AS classes.
+The virtual microscope can replay recorded acquisition (replay directory) - see ImageSource """
+
+DEFAULT_HFW = 5e-5  # horizontal field width of the virtual beams [m]
 
 
 class ImagingDevice(Enum):
@@ -14,6 +21,13 @@ class BeamType(Enum):
     ELECTRON = 1
     ION = 2
 
+class ImageFileFormat(Enum):
+    TIFF = 1
+
+class PatternScanDirection(Enum):
+    BOTTOM_TO_TOP = 1
+    TOP_TO_BOTTOM = 2
+
 class StagePosition:
     """ Fake stage position. It save all arguments in the constructor to attributes """
     def __init__(self, **kwargs):
@@ -21,57 +35,327 @@ class StagePosition:
             setattr(self, key, value)
 
 
+class Point:
+    """ Fake AS Point """
+    def __init__(self, x=0, y=0):
+        self.x = x
+        self.y = y
+
+
+class Rectangle:
+    """ Fake AS Rectangle (reduced area) """
+    def __init__(self, left=0, top=0, width=1, height=1):
+        self.left = left
+        self.top = top
+        self.width = width
+        self.height = height
+
+
+class GrabFrameSettings:
+    """ Fake AS GrabFrameSettings """
+    def __init__(self, resolution=None, dwell_time=None, bit_depth=None, line_integration=None, reduced_area=None):
+        self.resolution = resolution
+        self.dwell_time = dwell_time
+        self.bit_depth = bit_depth
+        self.line_integration = line_integration
+        self.reduced_area = reduced_area
+
+
+def _tiff_pixel_size(tif):
+    """ Pixel size from TIFF metadata (saved by fake AdornedImage or by AS). None if not found """
+    shaped_metadata = tif.shaped_metadata
+    if shaped_metadata and 'pixel_size' in shaped_metadata[0]:
+        return float(shaped_metadata[0]['pixel_size'])
+    fei_metadata = tif.fei_metadata
+    if fei_metadata and 'PixelWidth' in fei_metadata.get('Scan', {}):
+        return float(fei_metadata['Scan']['PixelWidth'])
+    return None
+
+
+class AdornedImage:
+    """ Fake AS AdornedImage. Data are in AS order (rows, columns) """
+    beam_hfw = None  # HFW (VirtualValue) of the virtual electron beam - pixel size of loaded images without metadata
+
+    def __init__(self, data, pixel_size):
+        self.data = data
+        self.metadata = EmptyClass()
+        self.metadata.binary_result = EmptyClass()
+        self.metadata.binary_result.pixel_size = Point(pixel_size, pixel_size)
+
+    def save(self, file_name):
+        import tifffile
+        # pixel size is stored in the metadata (see load)
+        tifffile.imwrite(file_name, self.data, metadata={'pixel_size': self.metadata.binary_result.pixel_size.x})
+
+    @staticmethod
+    def load(file_name):
+        """ The pixel size is read from the TIFF metadata. If it is not stored, it is calculated from the beam HFW """
+        import tifffile
+        with tifffile.TiffFile(file_name) as tif:
+            data = tif.asarray()
+            pixel_size = _tiff_pixel_size(tif)
+        if pixel_size is None:
+            hfw = AdornedImage.beam_hfw.value if AdornedImage.beam_hfw is not None else DEFAULT_HFW
+            pixel_size = hfw / data.shape[-1]
+        return AdornedImage(data, pixel_size)
+
+
 class EmptyClass:
     """Empty class for fake classes in AS Microscope instance"""
     def __getattr__(self, attr):
         raise AttributeError(f"Simulation object has no attribute {attr}. You need to set it first!")
 
 
+class VirtualValue:
+    """ Fake AS value (e.g. working_distance.value). Setting of the value takes latency seconds. """
+    def __init__(self, value=0, latency=0):
+        self._value = value
+        self.latency = latency
+
+    @property
+    def value(self):
+        return self._value
+
+    @value.setter
+    def value(self, value):
+        if self.latency > 0:
+            time.sleep(self.latency)
+        self._value = value
+
+
+class ImageSource:
+    """
+    Images served by the virtual microscope.
+
+    Replay directory contains recorded images slice_#####.tif (electron images of each slice). The optional
+    sub-directories driftcorr and fib contain driftcorr (and other auxiliary) electron frames and FIB fiducial frames
+    with the same file names. The slice pointer is moved to the next recorded slice after each milling.
+    If the directory is not set, random images are generated.
+    """
+    def __init__(self, directory=None, loop=False):
+        self.directory = directory
+        self.loop = loop
+        self.slice_index = 0
+        self.slices = []
+        if directory:
+            self.slices = sorted(glob.glob(os.path.join(directory, 'slice_[0-9][0-9][0-9][0-9][0-9].tif')))
+            if len(self.slices) == 0:
+                raise FileNotFoundError(f'No recorded slices (slice_#####.tif) found in {directory}')
+            logging.info(f'Replay of {len(self.slices)} slices from {directory}')
+        self._cache = {}  # file name -> data (only the last slice is cached)
+
+    def next_slice(self):
+        """ Move to the next recorded slice (called on the end of milling) """
+        self.slice_index += 1
+        if self.slice_index >= len(self.slices) > 0:
+            if self.loop:
+                self.slice_index = 0
+            else:
+                self.slice_index = len(self.slices) - 1
+                logging.warning('Replay: the last recorded slice reached')
+
+    def _load(self, file_name):
+        if file_name not in self._cache:
+            import tifffile
+            self._cache = {k: v for k, v in self._cache.items() if os.path.basename(k) == os.path.basename(file_name)}
+            self._cache[file_name] = tifffile.imread(file_name)
+        return self._cache[file_name]
+
+    def _candidates(self, device):
+        """ Recorded frames usable for the imaging device (ordered by priority) """
+        if len(self.slices) == 0:
+            return []
+        slice_file = self.slices[self.slice_index]
+        name = os.path.basename(slice_file)
+        if device == ImagingDevice.ION_BEAM:
+            # FIB frame of the slice or the first recorded FIB frame. Electron image if FIB frames are not recorded
+            candidates = [os.path.join(self.directory, 'fib', name)]
+            candidates += sorted(glob.glob(os.path.join(self.directory, 'fib', 'slice_*.tif')))[:1]
+            candidates = [c for c in candidates if os.path.exists(c)][:1]
+            if len(candidates) == 0:
+                candidates = [slice_file]
+        else:
+            candidates = [c for c in [os.path.join(self.directory, 'driftcorr', name), slice_file]
+                          if os.path.exists(c)]
+        return candidates
+
+    def frame(self, device, resolution, bit_depth=8):
+        """
+        Get frame with required resolution ([width, height]).
+        The recorded frame with the same resolution is preferred, otherwise the first candidate is resampled.
+        """
+        width, height = resolution
+        candidates = self._candidates(device)
+        if len(candidates) == 0:
+            dtype = np.uint16 if bit_depth == 16 else np.uint8
+            return np.random.randint(0, np.iinfo(dtype).max, size=(height, width), dtype=dtype)
+
+        data = None
+        for candidate in candidates:
+            data = self._load(candidate)
+            if data.shape == (height, width):
+                return data
+        data = self._load(candidates[0])
+        rows = np.linspace(0, data.shape[0] - 1, height).astype(int)
+        columns = np.linspace(0, data.shape[1] - 1, width).astype(int)
+        return data[rows][:, columns]
+
+
 class VirtualMicroscope:
-    """ Fake AS Microscope class """
-    def __init__(self):
+    """
+    Fake AS Microscope class.
+
+    :param replay_dir: Directory with recorded slices (see ImageSource). Random images are used if None.
+    :param latencies: Simulated latencies dict (stage, beam_shift, patterning, grab_frame) in seconds.
+    :param scan_time_factor: Grab frame takes scan_time_factor * (pixels * dwell * line integration) in addition.
+    :param loop: Start the replay again on the end of recorded slices.
+    """
+    def __init__(self, replay_dir=None, latencies=None, scan_time_factor=0, loop=False):
         self.is_virtual = True
+        self.latencies = {'stage': 0, 'beam_shift': 0, 'patterning': 0, 'grab_frame': 0}
+        if latencies is not None:
+            self.latencies.update(latencies)
+        self.scan_time_factor = scan_time_factor
+        self.image_source = ImageSource(replay_dir, loop)
+        self._active_device = ImagingDevice.ELECTRON_BEAM
+        self._last_image = {}  # device -> last grabbed image
+
         self.specimen = EmptyClass()
         self.specimen.stage = EmptyClass()
+        self.specimen.stage.current_position = StagePosition(x=0., y=0., z=0., r=0., t=0.)
         self.specimen.stage.absolute_move = self.specimen_stage_absolute_move
+        self.specimen.stage.relative_move = self.specimen_stage_relative_move
+        self.specimen.stage.unlink = lambda: None
         self.beams = EmptyClass()
-        self.beams.electron_beam = VirtualMicroscopeBeam()
-        self.beams.ion_beam = VirtualMicroscopeBeam()
+        self.beams.electron_beam = VirtualMicroscopeBeam(self.latencies['beam_shift'])
+        self.beams.ion_beam = VirtualMicroscopeBeam(self.latencies['beam_shift'])
         self.detector = EmptyClass()
-        self.detector.contrast = EmptyClass()
-        self.detector.brightness = EmptyClass()
+        self.detector.contrast = VirtualValue(0.5)
+        self.detector.brightness = VirtualValue(0.5)
         self.imaging = EmptyClass()
-        self.imaging.grab_frame = lambda : None
-        self.imaging.get_image = lambda: None
+        self.imaging.grab_frame = self.imaging_grab_frame
+        self.imaging.grab_frame_to_disk = self.imaging_grab_frame_to_disk
+        self.imaging.get_image = self.imaging_get_image
         self.imaging.set_active_view = lambda x: None
-        self.imaging.set_active_device = lambda x: None
+        self.imaging.set_active_device = self.imaging_set_active_device
+        self.imaging.start_acquisition = lambda: None
+        self.imaging.stop_acquisition = lambda: None
+        self.patterning = VirtualPatterning(self)
+        AdornedImage.beam_hfw = self.beams.electron_beam.horizontal_field_width
 
     def specimen_stage_absolute_move(self, goal):
-        self.specimen.stage.current_position = goal
+        time.sleep(self.latencies['stage'])
+        position = self.specimen.stage.current_position
+        self.specimen.stage.current_position = StagePosition(
+            **{k: getattr(goal, k) if getattr(goal, k, None) is not None else getattr(position, k)
+               for k in ['x', 'y', 'z', 'r', 't']})
+
+    def specimen_stage_relative_move(self, goal):
+        time.sleep(self.latencies['stage'])
+        position = self.specimen.stage.current_position
+        self.specimen.stage.current_position = StagePosition(
+            **{k: getattr(position, k) + (getattr(goal, k, None) or 0) for k in ['x', 'y', 'z', 'r', 't']})
+
+    def imaging_set_active_device(self, device):
+        # compare by name - AS enumeration can be used too
+        self._active_device = ImagingDevice[device.name]
+
+    @property
+    def active_beam(self):
+        if self._active_device == ImagingDevice.ION_BEAM:
+            return self.beams.ion_beam
+        return self.beams.electron_beam
+
+    def imaging_grab_frame(self, settings=None):
+        beam = self.active_beam
+        resolution = settings.resolution if settings is not None and settings.resolution is not None \
+            else beam.scanning.resolution.value
+        resolution = [int(x) for x in str(resolution).split('x')]
+        bit_depth = settings.bit_depth if settings is not None and settings.bit_depth is not None \
+            else beam.scanning.bit_depth
+        dwell = settings.dwell_time if settings is not None and settings.dwell_time is not None \
+            else beam.scanning.dwell_time.value
+        line_integration = settings.line_integration if settings is not None and settings.line_integration \
+            else 1
+
+        time.sleep(self.latencies['grab_frame'] +
+                   self.scan_time_factor * resolution[0] * resolution[1] * dwell * line_integration)
+        data = self.image_source.frame(self._active_device, resolution, bit_depth)
+        image = AdornedImage(data, beam.horizontal_field_width.value / resolution[0])
+        self._last_image[self._active_device] = image
+        return image
+
+    def imaging_grab_frame_to_disk(self, file_name, file_format=None, settings=None):
+        self.imaging_grab_frame(settings).save(file_name)
+
+    def imaging_get_image(self):
+        if self._active_device not in self._last_image:
+            return self.imaging_grab_frame()
+        return self._last_image[self._active_device]
+
+
+class VirtualPattern:
+    """ Fake AS pattern """
+    def __init__(self, center_x, center_y, width, height, depth):
+        self.center_x = center_x
+        self.center_y = center_y
+        self.width = width
+        self.height = height
+        self.depth = depth
+        self.scan_direction = None
+
+
+class VirtualPatterning:
+    """ Fake AS Microscope.patterning class. Each run moves the replay to the next slice. """
+    def __init__(self, microscope):
+        self._microscope = microscope
+        self.patterns = []
+        self.create_rectangle = self._create_pattern
+        self.create_cleaning_cross_section = self._create_pattern
+        self.create_regular_cross_section = self._create_pattern
+        self.set_default_beam_type = lambda x: None
+        self.set_default_application_file = lambda x: None
+
+    def _create_pattern(self, center_x, center_y, width, height, depth):
+        pattern = VirtualPattern(center_x, center_y, width, height, depth)
+        self.patterns.append(pattern)
+        return pattern
+
+    def clear_patterns(self):
+        self.patterns = []
+
+    def run(self):
+        time.sleep(self._microscope.latencies['patterning'])
+        self._microscope.image_source.next_slice()
 
 
 class VirtualMicroscopeBeam():
     """ Fake AS Microscope.electron_beam class and Microscope.ion_beam class """
-    def __init__(self):
+    def __init__(self, beam_shift_latency=0):
         self.is_virtual = True
-        self.working_distance = EmptyClass()
-        self.working_distance.value = 0
+        self.working_distance = VirtualValue(4e-3)
         self.working_distance.set_value_no_degauss = self.working_distance_set_value_no_degauss
-        self.stigmator = EmptyClass()
-        self.lens_alignment = EmptyClass()
-        self.beam_shift = EmptyClass()
+        self.stigmator = VirtualValue(Point(0, 0))
+        self.lens_alignment = VirtualValue(Point(0, 0))
+        self.beam_shift = VirtualValue(Point(0, 0), beam_shift_latency)
+        self.source_tilt = VirtualValue(Point(0, 0))
         self.scanning = EmptyClass()
-        self.scanning.dwell_time = EmptyClass()
-        self.scanning.bit_depth = EmptyClass()
-        self.resolution = EmptyClass()
-        self.horizontal_field_width = EmptyClass()
-        self.vertical_field_width = EmptyClass()
+        self.scanning.dwell_time = VirtualValue(1e-6)
+        self.scanning.bit_depth = 8
+        self.scanning.resolution = VirtualValue('1536x1024')
+        self.scanning.rotation = VirtualValue(0.)
+        self.scanning.mode = EmptyClass()
+        self.scanning.mode.set_full_frame = lambda: None
+        self.scanning.mode.set_reduced_area = lambda left, top, width, height: None
+        self.horizontal_field_width = VirtualValue(DEFAULT_HFW)
+        self.vertical_field_width = VirtualValue(DEFAULT_HFW)
+        self.blanked = False
 
     def working_distance_set_value_no_degauss(self, value):
         self.working_distance.value = value
 
-    def get_image(self):
-        image = mpimg.imread('oxford.jpg')
-        image = Image(image, 10e-9)  # pixel size 10e-9
-        return image
+    def blank(self):
+        self.blanked = True
 
+    def unblank(self):
+        self.blanked = False
@@ -6,6 +6,7 @@ from colorama import Fore
 
 from fibsem_maestro.microscope_control.settings import load_settings, save_settings
 from fibsem_maestro.microscope_control.microscope import GlobalMicroscope
+from fibsem_maestro.tools.checkpoint import image_to_state, image_from_state
 from fibsem_maestro.tools.image_tools import template_matching, template_matching_subpixel, shift_sift
 from fibsem_maestro.tools.support import ScanningArea, Point, Image
 from fibsem_maestro.logger import Logger
@@ -31,7 +32,8 @@ class Milling:
         # set microscope
         try:
             logging.info('Microscope setting loading (fib)')
-            load_settings(self._microscope, os.path.join(settings_dir, settings_file))
+            skipped = load_settings(self._microscope, os.path.join(settings_dir, settings_file))
+            Logger.log_params['fib_settings_skipped'] = skipped  # number of saved RPCs
             self._microscope.beam = self._microscope.ion_beam  # set ion as default beam
             print(Fore.GREEN + 'Microscope fib settings applied')
         except Exception as e:
@@ -167,6 +169,23 @@ class Milling:
     def reset_position(self):
         self.position = 0
 
+    def get_state(self):
+        """ State for checkpoint. Milling and fiducial areas are included (they are changed by fiducial update) """
+        return {'position': self.position,
+                'fiducial_template': image_to_state(self._fiducial_template),
+                'fiducial_source_image_resolution': self._fiducial_source_image_resolution,
+                'similarity': self._similarity,
+                'milling_area': self.settings('milling', 'milling_area'),
+                'fiducial_area': self.settings('milling', 'fiducial_area')}
+
+    def set_state(self, state):
+        self.position = state['position']
+        self._fiducial_template = image_from_state(state['fiducial_template'])
+        self._fiducial_source_image_resolution = state['fiducial_source_image_resolution']
+        self._similarity = state['similarity']
+        self.settings.set('milling', 'milling_area', value=state['milling_area'])
+        self.settings.set('milling', 'fiducial_area', value=state['fiducial_area'])
+
     def milling(self, slice_number: int, milling_depth: float, shift_x=0, shift_y=0, shift_y_px=0):
         slice_distance = self.settings('milling', 'slice_distance')
         direction = self.settings('milling', 'direction')
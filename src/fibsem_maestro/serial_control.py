@@ -1,6 +1,7 @@
 import concurrent.futures
 import logging
 import os
+import time
 
 from PySide6.QtCore import QThreadPool
 from colorama import Fore, init as colorama_init
@@ -14,11 +15,16 @@ from fibsem_maestro.image_criteria.criteria import Criterion
 from fibsem_maestro.mask.masking import MaskingModel
 from fibsem_maestro.drift_correction.template_matching import TemplateMatchingDriftCorrection
 from fibsem_maestro.microscope_control.microscope import GlobalMicroscope, create_microscope
-from fibsem_maestro.microscope_control.settings import load_settings, save_settings
+from fibsem_maestro.microscope_control.settings import load_settings, save_settings, read_settings, write_settings, \
+    read_snapshot, invalidate_settings_state
+from fibsem_maestro.microscope_control.snapshot import LOG_FIELDS
 from fibsem_maestro.milling.milling import Milling
+from fibsem_maestro.tools.checkpoint import CheckpointWriter, CHECKPOINT_FILE, load_checkpoint
 from fibsem_maestro.tools.dirs_management import make_dirs
 from fibsem_maestro.tools.email_attention import send_email
+from fibsem_maestro.tools.pipeline import SlicePipeline
 from fibsem_maestro.tools.support import Point
+from fibsem_maestro.tools.timing import StageTimer, timed
 from fibsem_maestro.logger import Logger
 from fibsem_maestro.settings import Settings
 
@@ -52,8 +58,11 @@ class SerialControl:
         self._stopping_flag = False
         self.image = None  # actual image
         self.image_resolution = 0  # initial image resolution = 0 # initial image res
+        self.snapshot = None  # microscope state before acquisition (MicroscopeSnapshot) - shared by log and settings
         self.future = None  # thread for acquisition running
         self.settings = Settings()
+        self.timer = StageTimer()  # timing of cycle stages
+        self._checkpoint_writer = CheckpointWriter()  # per-slice checkpoint written in background
 
         self._microscope = self.initialize_microscope()
         self._electron = self._microscope.electron_beam
@@ -71,6 +80,7 @@ class SerialControl:
         self._criterion_resolution = self.initialize_criterion_resolution()
         self._criterion_resolution.finalize_thread_func = self.finalize_calculate_resolution
         self._drift_correction = self.initialize_drift_correction()
+        self._pipeline = self.initialize_pipeline()
 
         self.threadpool = QThreadPool()
         self.running = False
@@ -158,6 +168,21 @@ class SerialControl:
             print(Fore.RED + 'No drift correction found')
         return drift_correction
 
+    def initialize_pipeline(self):
+        """ Pipeline for post-processing of the acquired slice (it runs in parallel with the next slice milling) """
+        queue_size = self.settings('acquisition', 'pipeline_queue_size')
+        pipeline = SlicePipeline(queue_size=queue_size if queue_size is not None else 2)
+        pipeline.add_stage('resolution', self._pipeline_resolution)
+        pipeline.add_stage('sem_settings', self._pipeline_sem_settings)
+        pipeline.add_stage('log', self._pipeline_log, depends_on=['resolution'])
+        return pipeline
+
+    @property
+    def pipelined(self):
+        """ Pipelined mode - slice post-processing runs in parallel with the next slice """
+        return bool(self.settings('acquisition', 'pipelined'))
+
+    @timed('check_af_on_acquired_image')
     def check_af_on_acquired_image(self, slice_number):
         # autofunction on acquired image
         aaf = self._autofunctions.active_autofunction
@@ -167,6 +192,7 @@ class SerialControl:
                 # here, the attempts should be tested but poke do not comply attempts
                 self._autofunctions.remove_active_af()  # remove if finished
 
+    @timed('wait_for_calculation')
     def wait_for_af_criterion_calculation(self):
         aaf = self._autofunctions.active_autofunction
         if aaf is not None and isinstance(aaf, StepAutoFunction):
@@ -178,8 +204,90 @@ class SerialControl:
         Logger.log_params['resolution'] = self.image_resolution
         print(Fore.GREEN + f'Calculated resolution: {self.image_resolution}')
 
-        Logger.save_log(slice_number)  # save log dict
+        if 'timing_start' in kwargs:
+            # CPU time of the calculation is measured by the criterion executor
+            self.timer.record('calculate_resolution', time.perf_counter() - kwargs['timing_start'],
+                              kwargs.get('cpu_time', 0.), slice_number)
+
+        # in pipelined mode, the log is saved by the pipeline log stage
+        if not kwargs.get('pipelined', False):
+            Logger.save_log(slice_number)  # save log dict
+
+    def _pipeline_resolution(self, job):
+        """ Pipeline stage - resolution calculation """
+        try:
+            with self.timer.stage('calculate_resolution', job.slice_number):
+                # self.finalize_calculate_resolution is called on the end
+                result = self._criterion_resolution(job.data['image'], slice_number=job.slice_number,
+                                                    pipelined=True)
+        except Exception as e:
+            print(Fore.RED + 'Resolution measurement failed')
+            self.image_resolution = 0
+            raise e
+        return result[0]
+
+    def _pipeline_sem_settings(self, job):
+        """ Pipeline stage - writing of microscope settings read after acquisition """
+        if job.data['sem_settings'] is not None:
+            with self.timer.stage('save_sem_settings', job.slice_number):
+                write_settings(job.data['sem_settings'], job.data['sem_settings_path'])
+            print(Fore.GREEN + 'Microscope settings saved')
+
+    def _pipeline_log(self, job):
+        """ Pipeline stage - saving of log dict (it waits for resolution stage) """
+        log_params = job.data['log_params']
+        log_params['resolution'] = job.results['resolution']
+        Logger.save_log(job.slice_number, log_params)
+
+    @timed('submit_to_pipeline')
+    def submit_to_pipeline(self, slice_number):
+        """
+        Read microscope settings (it needs microscope) and pass the rest of slice post-processing to the pipeline.
+        It blocks if the pipeline queue is full.
+        """
+        sem_settings_dir = self.settings('dirs', 'project')
+        sem_settings_file = self.settings('general', 'sem_settings_file')
+        variables_to_save = self.settings('general', 'variables_to_save')
 
+        try:
+            sem_settings = read_settings(self._microscope, variables_to_save, self.snapshot)
+        except Exception as e:
+            logging.error('Microscope settings reading error! ' + repr(e))
+            print(Fore.RED + 'Microscope settings saving failed!')
+            sem_settings = None
+            self.error_handler(e)
+
+        self._pipeline.submit(slice_number,
+                              image=self.image,
+                              sem_settings=sem_settings,
+                              sem_settings_path=os.path.join(sem_settings_dir, sem_settings_file),
+                              log_params=dict(Logger.log_params))  # copy - next slice changes log_params
+
+    @timed('wait_for_pipeline')
+    def wait_for_pipeline(self, stage=None):
+        """ Wait for pipeline (or only for one stage) and handle errors raised in the pipeline """
+        for stage_name, e in self._pipeline.wait(stage):
+            logging.error(f'Slice post-processing ({stage_name}) error. ' + repr(e))
+            self.error_handler(e)
+
+    def check_resolution_threshold(self):
+        """ Stop and wait for user if the resolution is too bad """
+        resolution_threshold = self.settings('acquisition', 'resolution_threshold')
+
+        if self.image_resolution is not None:
+            if self.image_resolution > resolution_threshold:
+                try:
+                    send_email("Maestro alert!",
+                               f"Resolution {self.image_resolution} is too bad! (>{resolution_threshold})"
+                               f"Acquisition stopped!")
+                except Exception as e:
+                    logging.error("Sending email error. " + repr(e))
+
+                print(f"Resolution {self.image_resolution} is too bad. (>{resolution_threshold})")
+                print("Perform manual inspection and press enter")
+                input()
+
+    @timed('milling')
     def milling(self, slice_number):
         """ Cut slice (with drift correction by fiducial)  """
         try:
@@ -194,13 +302,15 @@ class SerialControl:
         try:
             # go to self.finalize_calculate_resolution on thread finishing
             self.image_resolution = self._criterion_resolution(self.image, slice_number=slice_number,
-                                                               separate_thread=True)
+                                                               separate_thread=True,
+                                                               timing_start=time.perf_counter())
         except Exception as e:
             logging.error('Image resolution calculation error. Setting resolution to 0.'+repr(e))
             print(Fore.RED + 'Resolution measurement failed')
             self.image_resolution = 0
             self.error_handler(e)
 
+    @timed('correction')
     def correction(self):
         """ WD and Y correction"""
         wd_correction = self.settings('acquisition', 'wd_correction')
@@ -227,6 +337,7 @@ class SerialControl:
             print(Fore.RED + 'Y correction failed!')
             self.error_handler(e)
 
+    @timed('autofunction')
     def autofunction(self, slice_number):
         """" Autofunctions handling """
         try:
@@ -252,6 +363,7 @@ class SerialControl:
             print(Fore.RED + 'Autofunction error!')
             self.error_handler(e)
 
+    @timed('acquire')
     def acquire(self, slice_number):
         """ Acquire and save image """
         try:
@@ -262,6 +374,64 @@ class SerialControl:
             print(Fore.RED + 'Image acquisition failed!')
             self.error_handler(e)
 
+        # errors of images saved in background
+        if self._microscope.image_writer is not None:
+            self.handle_image_writer_errors(self._microscope.image_writer.pop_errors())
+
+    def get_state(self, slice_number):
+        """ State of acquisition after the slice (checkpoint) """
+        state = {'serial_control': {'slice_number': slice_number,
+                                    'image_resolution': self.image_resolution},
+                 'milling': self._milling.get_state(),
+                 'autofunctions': self._autofunctions.get_state()}
+        if self._drift_correction is not None:
+            state['drift_correction'] = self._drift_correction.get_state()
+        return state
+
+    def set_state(self, state):
+        self.image_resolution = state['serial_control']['image_resolution']
+        self._milling.set_state(state['milling'])
+        self._autofunctions.set_state(state['autofunctions'])
+        if self._drift_correction is not None and 'drift_correction' in state:
+            self._drift_correction.set_state(state['drift_correction'])
+
+    @timed('checkpoint')
+    def save_checkpoint(self, slice_number):
+        """ Save checkpoint of the completed slice (written in background). Failed checkpoint does not stop run """
+        if not self.settings('acquisition', 'checkpoint'):
+            return
+        for e in self._checkpoint_writer.flush():  # errors of the previous checkpoint
+            print(Fore.RED + 'Checkpoint saving failed! ' + repr(e))
+        try:
+            checkpoint_path = os.path.join(self.settings('dirs', 'project'), CHECKPOINT_FILE)
+            self._checkpoint_writer.save(self.get_state(slice_number), checkpoint_path)
+        except Exception as e:
+            logging.error('Checkpoint creation failed! ' + repr(e))
+            print(Fore.RED + 'Checkpoint creation failed! ' + repr(e))
+
+    def resume(self, run_dir):
+        """ Restore acquisition state from the checkpoint in run_dir (project dir) and continue with the next slice """
+        checkpoint = load_checkpoint(os.path.join(run_dir, CHECKPOINT_FILE))
+        if os.path.abspath(run_dir) != os.path.abspath(self.settings('dirs', 'project')):
+            self.change_dir_settings(run_dir)
+        self.set_state(checkpoint)
+        slice_number = checkpoint['serial_control']['slice_number'] + 1
+        print(Fore.YELLOW + f'Acquisition resumed from checkpoint. Next slice: {slice_number}')
+        logging.info(f'Acquisition resumed from checkpoint {run_dir}. Next slice: {slice_number}')
+        self.run(slice_number, reset_state=False)
+
+    def handle_image_writer_errors(self, errors):
+        for file_name, e in errors:
+            print(Fore.RED + f'Image saving failed! {file_name}')
+            self.error_handler(e)
+
+    def flush_images(self):
+        """ Wait until all acquired images are saved. Returns list of (file name, exception) of failed writes """
+        if self._microscope.image_writer is not None:
+            return self._microscope.image_writer.flush()
+        return []
+
+    @timed('drift_correction')
     def drift_correction(self, slice_number):
         """ Drift correction handling """
         if self._drift_correction is not None:
@@ -275,6 +445,7 @@ class SerialControl:
                 print(Fore.RED + 'Application of drift correction failed!')
                 self.error_handler(e)
 
+    @timed('load_sem_settings')
     def load_sem_settings(self):
         """ Load microscope settings from file and set microscope """
         sem_settings_dir = self.settings('dirs', 'project')
@@ -282,7 +453,8 @@ class SerialControl:
         # set microscope
         try:
             logging.info('Microscope setting loading')
-            load_settings(microscope=self._microscope, path=os.path.join(sem_settings_dir, sem_settings_file))
+            skipped = load_settings(microscope=self._microscope, path=os.path.join(sem_settings_dir, sem_settings_file))
+            Logger.log_params['sem_settings_skipped'] = skipped  # number of saved RPCs
             self._microscope.beam = self._electron  # set electron as default beam
             print(Fore.GREEN + 'Microscope settings applied')
         except Exception as e:
@@ -290,6 +462,23 @@ class SerialControl:
             print(Fore.RED + 'Application of microscope settings failed!')
             self.error_handler(e)
 
+    @timed('snapshot')
+    def take_snapshot(self):
+        """
+        Read microscope state (log fields and variables to save) in one pass.
+        The snapshot is reused by settings saving if the values are not changed after the snapshot.
+        """
+        variables_to_save = self.settings('general', 'variables_to_save')
+        fields = list(LOG_FIELDS) + [v for v in reversed(variables_to_save) if v not in LOG_FIELDS]
+        try:
+            self.snapshot = read_snapshot(self._microscope, fields)
+        except Exception as e:
+            logging.error('Microscope state reading error! ' + repr(e))
+            self.snapshot = None
+            self.error_handler(e)
+        return self.snapshot
+
+    @timed('save_sem_settings')
     def save_sem_settings(self):
         sem_settings_dir = self.settings('dirs', 'project')
         sem_settings_file = self.settings('general', 'sem_settings_file')
@@ -300,7 +489,8 @@ class SerialControl:
         try:
             save_settings(microscope=self._microscope,
                           settings=settings_to_save,
-                          path=os.path.join(sem_settings_dir, sem_settings_file))
+                          path=os.path.join(sem_settings_dir, sem_settings_file),
+                          snapshot=self.snapshot)
             print(Fore.GREEN + 'Microscope settings saved')
         except Exception as e:
             logging.error('Microscope settings saving error! ' + repr(e))
@@ -308,15 +498,17 @@ class SerialControl:
             self.error_handler(e)
 
     def stop(self):
-        self.stopping.stopping_flag = True
+        self.stopping.stopping_flag = True  # pending images are saved by run_async on the end of acquisition
 
-    def run(self, start_slice_number):
+    def run(self, start_slice_number, reset_state=True):
+        """ Start acquisition. If reset_state is False, af scheduler and steps are kept (resume) """
         if not self.running:
             # init
-            self._autofunctions.scheduler = []
-            for af in self._autofunctions.autofunctions:
-                if hasattr(af, '_step_number'):
-                    af._step_number = 0
+            if reset_state:
+                self._autofunctions.scheduler = []
+                for af in self._autofunctions.autofunctions:
+                    if hasattr(af, '_step_number'):
+                        af._step_number = 0
 
             # fire start event
             for event_start in self.event_acquisition_start:
@@ -334,12 +526,33 @@ class SerialControl:
     def run_async(self, start_slice_number):
         slice_number = start_slice_number
         self.running = True
+        self.timer.reset()
         while self.cycle(slice_number):
             self.running = True
-            logging.info(f'---Slice {slice_number} completed ---')
+            slice_time = self.timer.end_slice()
+            logging.info(f'---Slice {slice_number} completed ({slice_time:.1f} s) ---')
+            self.save_timing()
+            self.save_checkpoint(slice_number)
             slice_number += 1
+        self.wait_for_pipeline()  # finish post-processing of the last slice
+        self.handle_image_writer_errors(self.flush_images())
+        for e in self._checkpoint_writer.flush():
+            print(Fore.RED + 'Checkpoint saving failed! ' + repr(e))
+        self.save_timing()
         self.running = False
 
+    def save_timing(self):
+        """ Save timing report (p50/p95 of each stage, slices per hour) to log dir """
+        log_dir = self.settings('dirs', 'log')
+        extra = {}
+        if self._microscope.image_writer is not None:
+            extra['image_writer'] = self._microscope.image_writer.statistics()
+        if hasattr(self._microscope, 'rpc_count'):
+            extra['microscope_calls'] = {'rpc_count': self._microscope.rpc_count,
+                                         'cache_hits': self._microscope.cache_hits}
+        self.timer.save(os.path.join(log_dir, 'timing.yaml'), extra)
+
+    @timed('sputter')
     def sputter(self):
         sputtering_enabled = self.settings('acquisition', 'sputter')
         if sputtering_enabled:
@@ -352,7 +565,11 @@ class SerialControl:
                 logging.error('Sputtering error ' + repr(e))
                 print(Fore.RED + 'Sputtering failed!')
                 self.error_handler(e)
+            finally:
+                # sputtering moves stage, changes WD and ion settings by raw client
+                invalidate_settings_state(self.microscope)
 
+    @timed('sputter_restore')
     def sputter_restore(self):
         sputtering_enabled = self.settings('acquisition', 'sputter')
         if sputtering_enabled:
@@ -364,14 +581,18 @@ class SerialControl:
                 logging.error('Sputtering restore error ' + repr(e))
                 print(Fore.RED + 'Sputtering restore failed!')
                 self.error_handler(e)
+            finally:
+                invalidate_settings_state(self.microscope)
 
     def cycle(self, slice_number):
         imaging_enabled = self.settings('acquisition', 'imaging_enabled')
-        resolution_threshold = self.settings('acquisition', 'resolution_threshold')
+        pipelined = self.pipelined
         print(Fore.YELLOW + f'Current slice number: {slice_number}')
         logging.info(f'Current slice number: {slice_number}')
 
         Logger.init(slice_number)
+        self.timer.start_slice(slice_number)
+        self.snapshot = None
 
         self._microscope.beam = self._microscope.ion_beam  # switch to ions
         self.milling(slice_number)  # FIB milling (slicing)
@@ -379,23 +600,12 @@ class SerialControl:
             return False
 
         if imaging_enabled:
-            # wait for resolution calculation if needed anf AF main imaging criterion calculation
-            self._criterion_resolution.join_all_threads()
+            if not pipelined:
+                # wait for resolution calculation if needed anf AF main imaging criterion calculation
+                self._criterion_resolution.join_all_threads()
+                self.check_resolution_threshold()
             self.wait_for_af_criterion_calculation()
 
-            if self.image_resolution is not None:
-                if self.image_resolution > resolution_threshold:
-                    try:
-                        send_email("Maestro alert!",
-                                   f"Resolution {self.image_resolution} is too bad! (>{resolution_threshold})"
-                                   f"Acquisition stopped!")
-                    except Exception as e:
-                        logging.error("Sending email error. " + repr(e))
-
-                    print(f"Resolution {self.image_resolution} is too bad. (>{resolution_threshold})")
-                    print("Perform manual inspection and press enter")
-                    input()
-
             if self.stopping():
                 return False
 
@@ -405,6 +615,8 @@ class SerialControl:
                 return False
 
             self._microscope.beam = self._microscope.electron_beam  # switch to electrons
+            if pipelined:
+                self.wait_for_pipeline('sem_settings')  # settings file of the previous slice must be written
             self.load_sem_settings()  # load settings and set microscope
             if self.stopping():
                 return False
@@ -416,10 +628,17 @@ class SerialControl:
             if self.stopping():
                 return False
 
+            if pipelined:
+                # resolution of the previous slice is needed for autofunctions
+                self.wait_for_pipeline()
+                self.check_resolution_threshold()
+                if self.stopping():
+                    return False
+
             self.autofunction(slice_number)  # auto-functions handling
             if self.stopping():
                 return False
-            Logger.log_microscope_settings()  # save microscope settings
+            Logger.log_microscope_settings(self.take_snapshot())  # save microscope settings
             self.acquire(slice_number)  # acquire image
             if self.stopping():
                 return False
@@ -433,10 +652,14 @@ class SerialControl:
            # self.auto_contrast_brightness(slice_number)
             if self.stopping():
                 return False
-            # resolution calculation
-            self.calculate_resolution(slice_number)
+            if pipelined:
+                # resolution calculation, settings and log saving in the pipeline (parallel with next milling)
+                self.submit_to_pipeline(slice_number)
+            else:
+                # resolution calculation
+                self.calculate_resolution(slice_number)
 
-            self.save_sem_settings()
+                self.save_sem_settings()
 
             self.sputter_restore()
             if self.stopping():
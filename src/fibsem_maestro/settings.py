@@ -1,8 +1,13 @@
 import copy
+import threading
+from collections.abc import Mapping, Sequence
 
 import yaml
 import logging
 
+_MISSING = object()  # marker of not defined setting
+
+
 class Setting:
     def __init__(self, value):
         self._value = value
@@ -24,6 +29,61 @@ class Setting:
         self.value_change_handlers.append(handler)
         logging.debug(f'Setting handler to {self._value} added')
 
+class SettingsView(Mapping):
+    """
+    Read-only view of the settings section (dict).
+    Values are read from the Setting objects on access, so no dict reconstruction is needed.
+    """
+    def __init__(self, structure):
+        self._structure = structure
+
+    def __getitem__(self, key):
+        return _view(self._structure[key])
+
+    def __iter__(self):
+        return iter(self._structure)
+
+    def __len__(self):
+        return len(self._structure)
+
+    def to_dict(self):
+        """ Plain (mutable) copy of the values """
+        return Settings._get_values(self._structure)
+
+    def __repr__(self):
+        return f'SettingsView({self.to_dict()})'
+
+
+class SettingsListView(Sequence):
+    """ Read-only view of the settings list (e.g. list of image settings) """
+    def __init__(self, structure):
+        self._structure = structure
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [_view(x) for x in self._structure[index]]
+        return _view(self._structure[index])
+
+    def __len__(self):
+        return len(self._structure)
+
+    def to_list(self):
+        """ Plain (mutable) copy of the values """
+        return Settings._get_values(self._structure)
+
+    def __repr__(self):
+        return f'SettingsListView({self.to_list()})'
+
+
+def _view(structure):
+    """ Value of the Setting or read-only view of the settings structure """
+    if isinstance(structure, dict):
+        return SettingsView(structure)
+    if isinstance(structure, list):
+        return SettingsListView(structure)
+    return structure.value
+
+
 class Settings:
     """ Settings singleton handles all settings (load/save from/to file, manage assertions...)"""
 
@@ -31,6 +91,10 @@ class Settings:
     _settings = None
     _settings_comments = None
     _default_filename = None
+    _path_cache = {}  # tuple of keys -> resolved setting structure (dict, list or Setting)
+    _name_index = {}  # id of settings list -> {name: item}
+    _cache_generation = 0  # incremented on each invalidation (prevents caching of stale paths)
+    _cache_lock = threading.Lock()
 
     # Singleton construction
     def __new__(cls, *args, **kwargs):
@@ -51,34 +115,96 @@ class Settings:
         Parameters:
         - *args: tuple containing keys to retrieve settings from nested dictionary.
         - return_object: bool to indicate whether to return the setting object itself or its value.
+        - return_view: bool to return read-only view (SettingsView) of the settings section instead of the dict copy.
 
         Return Type:
         - Depends on the value of get_object parameter. If get_object is True, returns the setting object. Otherwise, returns the value of the setting.
 
         """
+        if 'return_comment' in kwargs and kwargs['return_comment']:
+            setting = self._settings
+            comment = self._settings_comments
+            for setting_key in args:
+                try:
+                    # If current setting is list of settings, search by name. Otherwise search by dict key
+                    if isinstance(setting, list):
+                        setting = self._find_in_list(setting_key, setting)
+                    else:
+                        setting = setting[setting_key]
+                        if comment is not None:
+                            if setting_key in comment.keys():
+                                comment = comment[setting_key]
+                except KeyError:
+                    logging.error(f'{setting_key} is not defined in settings!')
+                    return None
+            return Settings._get_values(setting), comment
+
+        setting = self._resolve(args)
+        if setting is _MISSING or setting is None:  # not defined or 'none' item
+            return None
+        if 'return_object' in kwargs and kwargs['return_object']:
+            return setting
+        if 'return_view' in kwargs and kwargs['return_view']:
+            return _view(setting)
+        if isinstance(setting, Setting):
+            return setting.value
+        return Settings._get_values(setting)
+
+    def _resolve(self, args):
+        """ Find setting structure by keys. Resolved paths are cached """
+        try:
+            return self._path_cache[args]
+        except KeyError:
+            pass
+        generation = self._cache_generation
         setting = self._settings
-        comment = self._settings_comments
         for setting_key in args:
             try:
                 # If current setting is list of settings, search by name. Otherwise search by dict key
                 if isinstance(setting, list):
-                    setting = Settings._find_by_name(setting_key, setting)
+                    setting = self._find_in_list(setting_key, setting)
                 else:
                     setting = setting[setting_key]
-                    if comment is not None:
-                        if setting_key in comment.keys():
-                            comment = comment[setting_key]
             except KeyError:
                 logging.error(f'{setting_key} is not defined in settings!')
-                return None
-        if 'return_object' in kwargs and kwargs['return_object']:
-            return setting
-        else:
-            value = Settings._get_values(setting)
-            if 'return_comment' in kwargs and kwargs['return_comment']:
-                return value, comment
-            else:
-                return value
+                return _MISSING
+        with self._cache_lock:
+            if generation == self._cache_generation:  # settings structure was not changed during resolving
+                self._path_cache[args] = setting
+        return setting
+
+    def _find_in_list(self, dict_name, setting):
+        """ Find the item in the settings list by name (indexed version of _find_by_name) """
+        if dict_name == 'none':
+            return None
+        index = self._name_index.get(id(setting))
+        if index is None:
+            index = self._build_name_index(setting)
+        try:
+            return index[dict_name]
+        except KeyError as e:
+            logging.error(f'Setting {dict_name} not found!')
+            raise IndexError(f'Setting {dict_name} not found!') from e
+
+    def _build_name_index(self, setting):
+        index = {}
+        for item in setting:
+            if isinstance(item, dict) and 'name' in item:
+                index.setdefault(item['name'].value, item)  # the first item is used (like _find_by_name)
+                # renaming of the item invalidates index
+                if not getattr(item['name'], 'indexed', False):
+                    item['name'].indexed = True
+                    item['name'].add_handler(lambda value: self.invalidate_cache())
+        with self._cache_lock:
+            self._name_index[id(setting)] = index
+        return index
+
+    def invalidate_cache(self):
+        """ Clear cached paths and name indexes (called on change of settings structure) """
+        with self._cache_lock:
+            Settings._cache_generation += 1
+            Settings._path_cache = {}
+            Settings._name_index = {}
 
     def __call__(self, *args, **kwargs):
         return self.get(*args, **kwargs)
@@ -218,13 +344,14 @@ class Settings:
         for setting_key in args[:-1]:
             # If current setting is list of settings, search by name. Otherwise, search by dict key
             if isinstance(setting, list):
-                setting = Settings._find_by_name(setting_key, setting)
+                setting = self._find_in_list(setting_key, setting)
             else:
                 setting = setting[setting_key]
 
         if args[-1] in setting.keys():
             if isinstance(setting[args[-1]], list):
                 setting[args[-1]] = Setting(value)
+                self.invalidate_cache()  # structure replaced
             else:
                 setting[args[-1]].value = value
             logging.debug(f'Setting value {args} to {value}')
@@ -248,6 +375,7 @@ class Settings:
         if isinstance(setting, list):
             Settings._replace_values_with_object(value)
             setting.append(value)
+            self.invalidate_cache()
         else:
             logging.error(f'{setting_key} is not list and cannot be append')
 
@@ -264,8 +392,9 @@ class Settings:
             except KeyError:
                 logging.error(f'{setting_key} is not defined in settings!')
                 return None
-        setting_to_remove = Settings._find_by_name(value['name'], setting)
+        setting_to_remove = self._find_in_list(value['name'], setting)
         setting.remove(setting_to_remove)
+        self.invalidate_cache()
 
     def load(self, filename: str):
             """ Load settings from YAML file"""
@@ -275,6 +404,7 @@ class Settings:
                     self._settings = yaml.safe_load(yamlfile)
                     logging.info(f'Settings file {filename} successfully loaded')
                     Settings._replace_values_with_object(self._settings)
+                    self.invalidate_cache()
             except Exception as e:
                 logging.error("Settings loading error: " + repr(e))
 
@@ -292,6 +422,7 @@ class Settings:
                     new_settings = yaml.safe_load(yamlfile)
                     logging.info(f'Settings file {filename} successfully loaded')
                     Settings._update_object(self._settings, new_settings)
+                    self.invalidate_cache()
             except Exception as e:
                 logging.error("Settings loading error: " + repr(e))
 
@@ -0,0 +1,122 @@
+import logging
+import os
+import pickle
+import threading
+import time
+
+import numpy as np
+
+from fibsem_maestro.tools.support import Image
+
+CHECKPOINT_FILE = 'checkpoint.pkl'
+CHECKPOINT_VERSION = 1
+
+
+def image_to_state(image):
+    """ Image (np.ndarray subclass) loses pixel size in pickle - convert it to dict """
+    if image is None:
+        return None
+    return {'data': np.asarray(image), 'pixel_size': image.pixel_size}
+
+
+def image_from_state(state):
+    if state is None:
+        return None
+    return Image(state['data'], state['pixel_size'])
+
+
+def write_checkpoint(data: bytes, path):
+    """ Write serialized checkpoint atomically (temporary file, fsync, rename) """
+    temporary_name = path + '.part'
+    with open(temporary_name, 'wb') as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temporary_name, path)
+
+
+def load_checkpoint(path):
+    """ Load checkpoint dict """
+    with open(path, 'rb') as f:
+        checkpoint = pickle.load(f)
+    if checkpoint.get('version') != CHECKPOINT_VERSION:
+        raise ValueError(f'Unsupported checkpoint version {checkpoint.get("version")} (expected {CHECKPOINT_VERSION})')
+    return checkpoint
+
+
+class CheckpointWriter:
+    """
+    Background writer of checkpoints.
+
+    The state is serialized in the caller thread (consistent copy of the state), the file is written by the writer
+    thread. Only the latest checkpoint matters - if the previous one is not written yet, it is replaced.
+    """
+    def __init__(self):
+        self._pending = None  # (data, path)
+        self._writing = False
+        self._condition = threading.Condition()
+        self._thread = None
+        self._errors = []
+        self.checkpoints_written = 0
+        self.last_write_time = None  # duration of the last write (s)
+
+    def _start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._worker, daemon=True, name='checkpoint_writer')
+            self._thread.start()
+
+    def save(self, state: dict, path):
+        """ Serialize state and write it in background """
+        checkpoint = dict(state, version=CHECKPOINT_VERSION, timestamp=time.time())
+        data = pickle.dumps(checkpoint, protocol=pickle.HIGHEST_PROTOCOL)
+        self._start()
+        with self._condition:
+            if self._pending is not None:
+                logging.debug('Unsaved checkpoint replaced by the newer one.')
+            self._pending = (data, path)
+            self._condition.notify_all()
+
+    def _worker(self):
+        while True:
+            with self._condition:
+                self._condition.wait_for(lambda: self._pending is not None)
+                item = self._pending
+                self._pending = None
+                self._writing = True
+            if item == 'stop':
+                with self._condition:
+                    self._writing = False
+                    self._condition.notify_all()
+                break
+            data, path = item
+            start = time.perf_counter()
+            try:
+                write_checkpoint(data, path)
+                self.last_write_time = time.perf_counter() - start
+                self.checkpoints_written += 1
+                logging.debug(f'Checkpoint {path} saved in {self.last_write_time:.2f} s')
+            except Exception as e:
+                logging.error(f'Checkpoint {path} saving failed. ' + repr(e))
+                with self._condition:
+                    self._errors.append(e)
+            with self._condition:
+                self._writing = False
+                self._condition.notify_all()
+
+    def flush(self):
+        """ Wait until the last checkpoint is written. Return list of errors since the last flush """
+        with self._condition:
+            self._condition.wait_for(lambda: self._pending is None and not self._writing)
+            errors = self._errors
+            self._errors = []
+        return errors
+
+    def stop(self):
+        errors = self.flush()
+        if self._thread is not None:
+            with self._condition:
+                self._pending = 'stop'
+                self._condition.notify_all()
+            self._thread.join()
+            self._thread = None
+        return errors
@@ -30,6 +30,8 @@ def findfile(data_dir):
     list_files = glob.glob(f"{data_dir}\\*.tif")
     # Iterate through each string in the list
     for s in list_files:
+        if s.endswith('.part.tif'):
+            continue  # image is being written (ImageWriter)
         # Use re.search to find the match in the string
         match = re.search(r'slice_(\d+)', s)
 
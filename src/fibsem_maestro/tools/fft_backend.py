@@ -0,0 +1,179 @@
+import logging
+import os
+import threading
+
+import numpy as np
+from scipy import fft as scipy_fft
+
+from fibsem_maestro.settings import Settings
+
+FFT_BACKENDS = ('numpy', 'scipy', 'pyfftw')
+
+
+class NumpyFFT:
+    """ numpy.fft (single thread) """
+    name = 'numpy'
+
+    def __init__(self, workers=1):
+        self.workers = workers
+
+    def rfft(self, x, axis=-1):
+        return np.fft.rfft(x, axis=axis)
+
+    def rfft2(self, x, axes=(-2, -1)):
+        return np.fft.rfft2(x, axes=axes)
+
+    def fft2(self, x, axes=(-2, -1)):
+        return np.fft.fft2(x, axes=axes)
+
+    def rfftn(self, x, s=None, axes=None):
+        return np.fft.rfftn(x, s=s, axes=axes)
+
+    def irfftn(self, x, s=None, axes=None):
+        return np.fft.irfftn(x, s=s, axes=axes)
+
+    def __repr__(self):
+        return f'{self.name} ({self.workers} workers)'
+
+
+class ScipyFFT(NumpyFFT):
+    """ scipy.fft - multidimensional transforms are parallelized over workers (negative - all cores) """
+    name = 'scipy'
+
+    def rfft(self, x, axis=-1):
+        return scipy_fft.rfft(x, axis=axis, workers=self.workers)
+
+    def rfft2(self, x, axes=(-2, -1)):
+        return scipy_fft.rfft2(x, axes=axes, workers=self.workers)
+
+    def fft2(self, x, axes=(-2, -1)):
+        return scipy_fft.fft2(x, axes=axes, workers=self.workers)
+
+    def rfftn(self, x, s=None, axes=None):
+        return scipy_fft.rfftn(x, s=s, axes=axes, workers=self.workers)
+
+    def irfftn(self, x, s=None, axes=None):
+        return scipy_fft.irfftn(x, s=s, axes=axes, workers=self.workers)
+
+
+class PyFFTW(NumpyFFT):
+    """
+    pyFFTW (optional dependency). Plans are built once per transform, shape, dtype and axes and cached (per thread -
+    the plan owns aligned input and output buffers). The output is copied out of the plan buffer.
+    """
+    name = 'pyfftw'
+
+    def __init__(self, workers=1):
+        import pyfftw  # raises ImportError if not installed
+        self._pyfftw = pyfftw
+        if workers < 1:
+            workers = os.cpu_count()
+        super().__init__(workers)
+        self._local = threading.local()
+
+    def _plan(self, builder, x, **kwargs):
+        plans = getattr(self._local, 'plans', None)
+        if plans is None:
+            plans = self._local.plans = {}
+        key = (builder, x.shape, x.dtype.str) + tuple(sorted((k, str(v)) for k, v in kwargs.items()))
+        plan = plans.get(key)
+        if plan is None:
+            buffer = self._pyfftw.empty_aligned(x.shape, dtype=x.dtype)
+            plan = getattr(self._pyfftw.builders, builder)(buffer, threads=self.workers,
+                                                           planner_effort='FFTW_MEASURE', **kwargs)
+            plans[key] = plan
+        return plan(x).copy()
+
+    def rfft(self, x, axis=-1):
+        return self._plan('rfft', np.asarray(x), axis=axis)
+
+    def rfft2(self, x, axes=(-2, -1)):
+        return self._plan('rfft2', np.asarray(x), axes=axes)
+
+    def fft2(self, x, axes=(-2, -1)):
+        x = np.asarray(x)
+        if not np.iscomplexobj(x):
+            x = x.astype(np.complex64 if x.dtype == np.float32 else np.complex128)
+        return self._plan('fft2', x, axes=axes)
+
+    def rfftn(self, x, s=None, axes=None):
+        return self._plan('rfftn', np.asarray(x), s=s, axes=axes)
+
+    def irfftn(self, x, s=None, axes=None):
+        return self._plan('irfftn', np.asarray(x), s=s, axes=axes)
+
+
+def create_fft_backend(name, workers=1):
+    """ FFT backend by name (numpy, scipy, pyfftw). pyfftw falls back to scipy if it is not installed """
+    if name == 'numpy':
+        return NumpyFFT(1)
+    if name == 'scipy':
+        return ScipyFFT(workers)
+    if name == 'pyfftw':
+        try:
+            return PyFFTW(workers)
+        except ImportError:
+            logging.warning('pyFFTW is not installed. Scipy FFT backend used.')
+            return ScipyFFT(workers)
+    raise ValueError(f'Unknown FFT backend {name}. Possible values: {", ".join(FFT_BACKENDS)}')
+
+
+_backend = None
+_backend_generation = None  # Settings generation of the current backend (the backend is recreated on settings load)
+_backend_lock = threading.Lock()
+
+
+def _reset_fft_backend(value=None):
+    global _backend
+    _backend = None
+
+
+def _add_reset_handler(setting):
+    """ Register _reset_fft_backend to the setting once (the backend is rebuilt after each change) """
+    if _reset_fft_backend not in setting.value_change_handlers:
+        setting.add_handler(_reset_fft_backend)
+
+
+def _backend_from_settings():
+    settings = Settings()
+    try:
+        name_setting = settings('general', 'fft_backend', return_object=True)
+        workers_setting = settings('general', 'fft_workers', return_object=True)
+    except Exception:  # settings not loaded (e.g. worker process)
+        return NumpyFFT()
+    if name_setting is None:
+        return NumpyFFT()
+    # refresh backend on every change!
+    _add_reset_handler(name_setting)
+    workers = 1
+    if workers_setting is not None:
+        _add_reset_handler(workers_setting)
+        workers = workers_setting.value
+    backend = create_fft_backend(name_setting.value, workers)
+    logging.info(f'FFT backend: {backend}')
+    return backend
+
+
+def get_fft_backend():
+    """ FFT backend selected in settings (general.fft_backend, general.fft_workers). numpy if not set """
+    global _backend, _backend_generation
+    backend = _backend
+    if backend is not None and _backend_generation == Settings._cache_generation:
+        return backend
+    with _backend_lock:
+        if _backend is None or _backend_generation != Settings._cache_generation:
+            _backend_generation = Settings._cache_generation
+            _backend = _backend_from_settings()
+        return _backend
+
+
+def set_fft_backend(name, workers=1):
+    """
+    Select FFT backend explicitly (until the next settings change). The current backend is kept if it is the same
+    (e.g. pyfftw plans are not rebuilt if it is set before each calculation in the worker process).
+    """
+    global _backend, _backend_generation
+    with _backend_lock:
+        if _backend is None or _backend.name != name or _backend.workers != workers:
+            _backend = create_fft_backend(name, workers)
+        _backend_generation = Settings._cache_generation
@@ -0,0 +1,128 @@
+import logging
+import os
+import queue
+import threading
+import time
+from collections import deque
+
+import numpy as np
+
+
+class ImageWriter:
+    """
+    Asynchronous image writer.
+
+    Images are saved by one writer thread. The queue is bounded - write blocks if the queue is full (backpressure).
+    Each image is saved to a temporary file, flushed to disk (fsync) and renamed to the final name, so the partially
+    written image never appears under the final name.
+    Supported images: objects with save(file_name) method (AS AdornedImage) and Image (saved by tifffile).
+    """
+    def __init__(self, queue_size=4, history=100):
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._thread = None
+        self._errors = []  # (file name, exception)
+        self._lock = threading.Lock()
+        self.latencies = deque(maxlen=history)  # write latencies (s) - time of saving
+        self.queue_waits = deque(maxlen=history)  # time between write and start of saving (s)
+        self.blocked_time = 0  # total time of blocking caused by the full queue (s)
+        self.images_written = 0
+
+    def _start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._worker, daemon=True, name='image_writer')
+            self._thread.start()
+
+    def write(self, image, file_name):
+        """ Put image to the queue. It blocks if the queue is full """
+        self._start()
+        start = time.perf_counter()
+        self._queue.put((image, file_name, time.perf_counter()))
+        blocked = time.perf_counter() - start
+        if blocked > 0.01:
+            logging.warning(f'Image writer queue is full. Acquisition blocked for {blocked:.2f} s')
+        with self._lock:
+            self.blocked_time += blocked
+
+    @staticmethod
+    def _temporary_name(file_name):
+        # keep the extension - it defines the image format
+        base, ext = os.path.splitext(file_name)
+        return base + '.part' + ext
+
+    @staticmethod
+    def _save(image, file_name):
+        if hasattr(image, 'save'):
+            image.save(file_name)
+        else:
+            import tifffile
+            tifffile.imwrite(file_name, np.asarray(image).T)  # Image is transposed compared to AS data
+
+    def _worker(self):
+        while True:
+            item = self._queue.get()
+            if item is None:  # stop signal
+                self._queue.task_done()
+                break
+            image, file_name, submit_time = item
+            start = time.perf_counter()
+            temporary_name = self._temporary_name(file_name)
+            try:
+                self._save(image, temporary_name)
+                with open(temporary_name, 'rb+') as f:
+                    os.fsync(f.fileno())
+                os.replace(temporary_name, file_name)
+                with self._lock:
+                    self.latencies.append(time.perf_counter() - start)
+                    self.queue_waits.append(start - submit_time)
+                    self.images_written += 1
+                logging.debug(f'Image {file_name} saved in {time.perf_counter() - start:.2f} s')
+            except Exception as e:
+                logging.error(f'Image {file_name} saving failed. ' + repr(e))
+                with self._lock:
+                    self._errors.append((file_name, e))
+            finally:
+                self._queue.task_done()
+
+    def flush(self):
+        """
+        Wait until all queued images are written.
+
+        :return: List of (file name, exception) of failed writes since the last flush.
+        """
+        if self._thread is not None:
+            self._queue.join()
+        return self.pop_errors()
+
+    def pop_errors(self):
+        """ Return list of (file name, exception) of failed writes (without waiting) and clear it """
+        with self._lock:
+            errors = self._errors
+            self._errors = []
+        return errors
+
+    def stop(self):
+        """ Write all images and stop the writer thread """
+        errors = self.flush()
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
+        return errors
+
+    @property
+    def pending(self):
+        """ Number of images waiting in the queue """
+        return self._queue.qsize()
+
+    def statistics(self):
+        """ Write latency metrics """
+        with self._lock:
+            latencies = list(self.latencies)
+            queue_waits = list(self.queue_waits)
+            result = {'images_written': self.images_written, 'blocked_time': float(self.blocked_time)}
+        if len(latencies) > 0:
+            result['write_p50'] = float(np.percentile(latencies, 50))
+            result['write_p95'] = float(np.percentile(latencies, 95))
+            result['write_max'] = float(np.max(latencies))
+            result['queue_wait_p95'] = float(np.percentile(queue_waits, 95))
+        return result
@@ -0,0 +1,134 @@
+import logging
+import queue
+import threading
+
+
+class PipelineJob:
+    """ Work item of one slice that travels through the pipeline stages """
+    def __init__(self, slice_number, data):
+        self.slice_number = slice_number
+        self.data = data  # payload passed by submit (image, log params...)
+        self.results = {}  # stage name -> stage result
+        self.pending = set()  # stages not finished yet
+        self.errors = []  # (stage name, exception)
+
+
+class PipelineStage:
+    """ Stage of the pipeline. Each stage has its own worker thread and bounded input queue """
+    def __init__(self, name, func, depends_on=(), queue_size=2):
+        self.name = name
+        self.func = func  # func(job) -> result
+        self.depends_on = tuple(depends_on)
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.thread = None
+
+
+class SlicePipeline:
+    """
+    Staged pipeline for slice post-processing (CPU/disk bound tasks).
+
+    Each stage runs in a separate worker thread and reads jobs from a bounded queue. If the queue is full,
+    submit blocks (backpressure), so the number of slices waiting for processing is limited.
+    A stage is started for the slice when all stages in its depends_on list are finished for the same slice.
+    Exceptions raised by the stages are collected and returned by wait() (they are handled in the caller thread).
+    """
+    def __init__(self, queue_size=2):
+        self.queue_size = queue_size
+        self._stages = {}
+        self._jobs = []  # unfinished jobs
+        self._errors = []
+        self._condition = threading.Condition()
+
+    def add_stage(self, name, func, depends_on=()):
+        """ Register a new stage. Dependencies must be registered before """
+        for dependency in depends_on:
+            if dependency not in self._stages:
+                raise ValueError(f'Pipeline stage {dependency} is not defined!')
+        self._stages[name] = PipelineStage(name, func, depends_on, self.queue_size)
+
+    def _start(self):
+        """ Start worker threads (only stages that are not running) """
+        for stage in self._stages.values():
+            if stage.thread is None:
+                stage.thread = threading.Thread(target=self._worker, args=[stage], daemon=True,
+                                                name=f'pipeline_{stage.name}')
+                stage.thread.start()
+
+    def _worker(self, stage):
+        while True:
+            job = stage.queue.get()
+            if job is None:  # stop signal
+                break
+            error = None
+            try:
+                result = stage.func(job)
+            except Exception as e:
+                logging.error(f'Pipeline stage {stage.name} failed on slice {job.slice_number}. ' + repr(e))
+                result = None
+                error = e
+            self._stage_finished(stage, job, result, error)
+
+    def _stage_finished(self, stage, job, result, error=None):
+        with self._condition:
+            if error is not None:
+                # under the lock - wait() takes the errors of unfinished jobs
+                job.errors.append((stage.name, error))
+            job.results[stage.name] = result
+            job.pending.discard(stage.name)
+            # stages that have all dependencies finished now
+            ready = [s for s in self._stages.values() if stage.name in s.depends_on
+                     and all(d in job.results for d in s.depends_on)]
+            if len(job.pending) == 0:
+                self._jobs.remove(job)
+                self._errors.extend(job.errors)
+            # wake up also callers waiting for a single stage
+            self._condition.notify_all()
+        # put to queue outside the lock (it can block)
+        for s in ready:
+            s.queue.put(job)
+
+    def submit(self, slice_number, **data):
+        """ Submit slice to the pipeline. It blocks if the queues of the root stages are full """
+        self._start()
+        job = PipelineJob(slice_number, data)
+        with self._condition:
+            job.pending = set(self._stages.keys())
+            self._jobs.append(job)
+        for stage in self._stages.values():
+            if len(stage.depends_on) == 0:
+                stage.queue.put(job)
+        return job
+
+    def wait(self, stage=None):
+        """
+        Wait until all submitted slices are processed.
+
+        :param stage: If set, wait only for this stage (and its dependencies).
+        :return: List of (stage name, exception) raised since the last wait.
+        """
+        with self._condition:
+            if stage is None:
+                self._condition.wait_for(lambda: len(self._jobs) == 0)
+            else:
+                self._condition.wait_for(lambda: all(stage not in job.pending for job in self._jobs))
+                # errors of unfinished jobs
+                for job in self._jobs:
+                    self._errors.extend(job.errors)
+                    job.errors = []
+            errors = self._errors
+            self._errors = []
+        return errors
+
+    @property
+    def busy(self):
+        return len(self._jobs) > 0
+
+    def stop(self):
+        """ Wait for all jobs and stop the worker threads """
+        errors = self.wait()
+        for stage in self._stages.values():
+            if stage.thread is not None:
+                stage.queue.put(None)
+                stage.thread.join()
+                stage.thread = None
+        return errors
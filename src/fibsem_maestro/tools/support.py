@@ -91,8 +91,11 @@ class StagePosition:
 
     def to_stage_position_as(self):
         """Convert StagePosition to AS StagePosition instance."""
-        from autoscript_sdb_microscope_client.structures import StagePosition as StagePositionAS
-        stage_dict = self.to_dict()
+        try:
+            from autoscript_sdb_microscope_client.structures import StagePosition as StagePositionAS
+        except ImportError:
+            from fibsem_maestro.microscope_control.virtual_control import StagePosition as StagePositionAS
+        stage_dict = dict(self.to_dict())  # copy - to_dict returns attributes dict of self
         stage_dict['r'] = math.radians(stage_dict['rotation'])
         stage_dict['t'] = math.radians(stage_dict['tilt'])
         del stage_dict['rotation']
@@ -173,8 +176,11 @@ class ScanningArea:
         self.height = scanning_area.height
 
     def to_as(self):
-        from autoscript_sdb_microscope_client.structures import Rectangle
         """ Convert the coordinates to AS coordinates """
+        try:
+            from autoscript_sdb_microscope_client.structures import Rectangle
+        except ImportError:
+            from fibsem_maestro.microscope_control.virtual_control import Rectangle
         return Rectangle(left=self.leftop.x, top=self.leftop.y, width=self.width, height=self.height)
 
     def to_img_coordinates(self, img_shape):
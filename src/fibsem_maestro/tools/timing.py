@@ -0,0 +1,139 @@
+import functools
+import logging
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+import numpy as np
+import yaml
+
+
+class StageTimer:
+    """
+    Timing of the acquisition cycle stages.
+
+    Wall-clock (time.perf_counter) and CPU time (time.thread_time - CPU time of the thread that runs the stage) are
+    recorded per slice and per stage into the rolling table (the last history slices are kept).
+    Stage executed more times in one slice is summed.
+    """
+    def __init__(self, history=500):
+        self.history = history
+        self.table = OrderedDict()  # slice number -> {stage name -> {'wall': s, 'cpu': s}}
+        self.slice_times = OrderedDict()  # slice number -> total wall time of the slice cycle
+        self.current_slice = None  # slice number used for stages without explicit slice number
+        self._slice_start = None
+        self._run_start = None
+        self._slices_completed = 0
+        self._lock = threading.Lock()
+
+    def reset(self):
+        """ Clear the table (new run) """
+        with self._lock:
+            self.table.clear()
+            self.slice_times.clear()
+            self.current_slice = None
+            self._run_start = time.perf_counter()
+            self._slices_completed = 0
+
+    def start_slice(self, slice_number):
+        if self._run_start is None:
+            self._run_start = time.perf_counter()
+        self.current_slice = slice_number
+        self._slice_start = time.perf_counter()
+
+    def end_slice(self):
+        """ End of slice cycle. Returns total wall time of the slice """
+        if self.current_slice is None:
+            return None
+        total = time.perf_counter() - self._slice_start
+        with self._lock:
+            self.slice_times[self.current_slice] = total
+            self._slices_completed += 1
+            self._trim(self.slice_times)
+        self.current_slice = None
+        return total
+
+    def record(self, stage_name, wall, cpu, slice_number=None):
+        """ Add stage time to the table """
+        if slice_number is None:
+            slice_number = self.current_slice
+        if slice_number is None:
+            return  # stage executed out of acquisition cycle
+        with self._lock:
+            row = self.table.setdefault(slice_number, {})
+            times = row.setdefault(stage_name, {'wall': 0., 'cpu': 0.})
+            times['wall'] += wall
+            times['cpu'] += cpu
+            self._trim(self.table)
+
+    def _trim(self, table):
+        while len(table) > self.history:
+            table.popitem(last=False)
+
+    @contextmanager
+    def stage(self, stage_name, slice_number=None):
+        """ Measure the code block as the stage """
+        if slice_number is None:
+            slice_number = self.current_slice
+        wall_start = time.perf_counter()
+        cpu_start = time.thread_time()
+        try:
+            yield
+        finally:
+            self.record(stage_name, time.perf_counter() - wall_start, time.thread_time() - cpu_start,
+                        slice_number)
+
+    def statistics(self):
+        """ p50/p95 of wall and cpu times per stage and throughput """
+        with self._lock:
+            rows = list(self.table.values())
+            slice_times = list(self.slice_times.values())
+            slices_completed = self._slices_completed
+            run_start = self._run_start
+
+        stage_names = []
+        for row in rows:
+            for name in row:
+                if name not in stage_names:
+                    stage_names.append(name)
+
+        stages = {}
+        for name in stage_names:
+            wall = np.array([row[name]['wall'] for row in rows if name in row])
+            cpu = np.array([row[name]['cpu'] for row in rows if name in row])
+            stages[name] = {'count': len(wall),
+                            'wall_p50': float(np.percentile(wall, 50)),
+                            'wall_p95': float(np.percentile(wall, 95)),
+                            'cpu_p50': float(np.percentile(cpu, 50)),
+                            'cpu_p95': float(np.percentile(cpu, 95))}
+
+        result = {'slices_completed': slices_completed, 'stages': stages}
+        if len(slice_times) > 0:
+            result['slice_p50'] = float(np.percentile(slice_times, 50))
+            result['slice_p95'] = float(np.percentile(slice_times, 95))
+        if run_start is not None and slices_completed > 0:
+            result['slices_per_hour'] = float(slices_completed / (time.perf_counter() - run_start) * 3600)
+        return result
+
+    def save(self, path, extra=None):
+        """ Save statistics (and extra dict) to yaml file """
+        statistics = self.statistics()
+        if extra is not None:
+            statistics.update(extra)
+        try:
+            with open(path, 'w') as f:
+                yaml.safe_dump(statistics, f, sort_keys=False)
+        except Exception as e:
+            logging.error('Timing report saving failed. ' + repr(e))
+
+
+def timed(stage_name):
+    """ Decorator of the SerialControl method. The method is measured by self.timer as stage_name """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(self, *args, **kwargs):
+            with self.timer.stage(stage_name):
+                return func(self, *args, **kwargs)
+        return wrapper
+    return decorator
@@ -0,0 +1,65 @@
+import argparse
+import time
+import tracemalloc
+
+import numpy as np
+from scipy.ndimage import gaussian_filter
+
+import fibsem_maestro.FRC.frc_utils as frc_util
+import fibsem_maestro.FRC.secondary_utils as su
+from fibsem_maestro.FRC.frc import frc, frc_batch
+
+parser = argparse.ArgumentParser(description='FRC benchmark (run time and memory high-water mark)')
+parser.add_argument('--sizes', default=[256, 512, 1024, 2048], type=int, nargs='+', help='image sizes (px)')
+parser.add_argument('--repeat', default=3, type=int, help='number of runs (the best time is reported)')
+parser.add_argument('--tiles', default=64, type=int, help='number of 256 px tiles for the batch benchmark')
+args = parser.parse_args()
+
+pixel_size = 5e-9
+
+
+def frc_reference(img, pixel_size):
+    """ FRC calculation by frc_utils (full-spectrum pipeline) """
+    img = su.normalize_data_ab(0, 1, img.astype(np.float32))
+    sa1, sa2, sb1, sb2 = frc_util.diagonal_split(img)
+    sa1 = frc_util.apply_hanning_2d(su.normalize_data_ab(0, 1, sa1))
+    sa2 = frc_util.apply_hanning_2d(su.normalize_data_ab(0, 1, sa2))
+    xc, corr, xt, thres_val = frc_util.FRC(sa1, sa2, thresholding='EM', inscribed_rings=True)
+    cross_i = next(x for x, val in enumerate(corr) if val < thres_val[3][0])
+    return (1 / (xc[cross_i] / 2)) * pixel_size * np.sqrt(2)
+
+
+def measure(func, *func_args):
+    """ Best run time (s), peak of memory allocated during the call (MB) and result """
+    func(*func_args)  # warm-up (caches)
+    best_time = np.inf
+    for _ in range(args.repeat):
+        start = time.perf_counter()
+        result = func(*func_args)
+        best_time = min(best_time, time.perf_counter() - start)
+    tracemalloc.start()
+    func(*func_args)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return best_time, peak / 2 ** 20, result
+
+
+def test_image(size, rng):
+    return (gaussian_filter(rng.random((size, size)), 2) + 0.05 * rng.random((size, size))).astype(np.float32)
+
+
+rng = np.random.default_rng(0)
+print(f'{"image":>10} {"reference [s]":>14} {"lean [s]":>10} {"reference [MB]":>15} {"lean [MB]":>10} '
+      f'{"input [MB]":>10}  resolution equal')
+for size in args.sizes:
+    img = test_image(size, rng)
+    t_ref, m_ref, r_ref = measure(frc_reference, img, pixel_size)
+    t_lean, m_lean, r_lean = measure(frc, img, pixel_size)
+    print(f'{size:>5}x{size:<4} {t_ref:>14.4f} {t_lean:>10.4f} {m_ref:>15.1f} {m_lean:>10.1f} '
+          f'{img.nbytes / 2 ** 20:>10.1f}  {np.isclose(r_ref, r_lean)}')
+
+tiles = np.stack([test_image(256, rng) for _ in range(args.tiles)])
+t_loop, m_loop, r_loop = measure(lambda x: np.array([frc(tile, pixel_size) for tile in x]), tiles)
+t_batch, m_batch, r_batch = measure(frc_batch, tiles, pixel_size)
+print(f'{args.tiles} tiles 256x256: loop {t_loop:.4f} s ({m_loop:.1f} MB), batch {t_batch:.4f} s ({m_batch:.1f} MB), '
+      f'resolution equal: {np.allclose(r_loop, r_batch)}')
@@ -0,0 +1,51 @@
+import numpy as np
+import pytest
+
+from fibsem_maestro.image_criteria.criteria_math import dog_filter_fft, gauss_filter, gauss_filter_batch, gauss_sigma
+
+PIXEL_SIZE = 5e-9
+SIGMAS = [(0.5, 1.5), (1.0, 3.0), (2.0, 6.0), (4.0, 12.0)]
+SHAPES = [(64, 64), (127, 255), (200, 99), (31, 33)]
+
+
+def _detail(sigma):
+    """ Detail (m) of gauss_filter with the sigma (px) """
+    detail = sigma * 2 * np.pi * PIXEL_SIZE
+    assert np.isclose(gauss_sigma(PIXEL_SIZE, detail), sigma)
+    return detail
+
+
+@pytest.mark.parametrize('sigmas', SIGMAS)
+@pytest.mark.parametrize('shape', SHAPES)
+def test_dog_filter_fft_image(shape, sigmas):
+    """ FFT difference of gaussians is equal to the difference of spatial gauss_filter outputs """
+    rng = np.random.default_rng(0)
+    image = rng.random(shape, dtype=np.float32)
+    low, high = _detail(sigmas[0]), _detail(sigmas[1])
+    expected = gauss_filter(image, PIXEL_SIZE, high) - gauss_filter(image, PIXEL_SIZE, low)
+    result = dog_filter_fft(image, sigmas[0], sigmas[1], filtered_axes=(0, 1))
+    assert result.shape == image.shape
+    assert np.allclose(result, expected, rtol=1e-4, atol=1e-5)
+
+
+@pytest.mark.parametrize('sigmas', SIGMAS)
+def test_dog_filter_fft_tile_stack(sigmas):
+    """ Tiles of the stack are filtered independently (as gauss_filter_batch) """
+    rng = np.random.default_rng(1)
+    tiles = rng.random((5, 48, 37), dtype=np.float32)
+    low, high = _detail(sigmas[0]), _detail(sigmas[1])
+    expected = gauss_filter_batch(tiles, PIXEL_SIZE, high) - gauss_filter_batch(tiles, PIXEL_SIZE, low)
+    result = dog_filter_fft(tiles, sigmas[0], sigmas[1], filtered_axes=(1, 2))
+    assert np.allclose(result, expected, rtol=1e-4, atol=1e-5)
+
+
+@pytest.mark.parametrize('sigmas', SIGMAS)
+def test_dog_filter_fft_lines(sigmas):
+    """ Lines (1D) filtered independently """
+    rng = np.random.default_rng(2)
+    lines = rng.random((7, 301), dtype=np.float32)
+    low, high = _detail(sigmas[0]), _detail(sigmas[1])
+    expected = (gauss_filter_batch(lines, PIXEL_SIZE, high, filtered_ndim=1)
+                - gauss_filter_batch(lines, PIXEL_SIZE, low, filtered_ndim=1))
+    result = dog_filter_fft(lines, sigmas[0], sigmas[1], filtered_axes=(1,))
+    assert np.allclose(result, expected, rtol=1e-4, atol=1e-5)